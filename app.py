@@ -6,17 +6,332 @@ Googleシート連携対応
 """
 
 from flask import Flask, render_template_string, jsonify, request, redirect, abort, Response
+from flask import before_render_template, template_rendered, has_request_context
 from urllib.parse import unquote, urlparse
 import json
 from datetime import datetime
 import os
 import csv
+import hmac
 import io
+from array import array
+import logging
+import queue
+import random
+import sys
 import requests
+import threading
 import time
+import uuid
+
+from product_code import normalize_product_code_key
+from profile_store import is_profile_id, profile_dir, save_profile, start_profiler, stop_profiler
 
 app = Flask(__name__)
 
+# リクエスト単位の処理時間計測（Server-Timing ヘッダ / /api/metrics の Prometheus ヒストグラム）
+# SERVER_TIMING=0 でヘッダ出力のみ止める（集計は継続）
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING', '1') != '0'
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_request_state = threading.local()
+
+
+class _Histogram:
+    """ラベル毎の累積ヒストグラム（Prometheus text format 出力用）"""
+
+    def __init__(self, name, help_text, label, buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for value, (buckets, total, count) in sorted(self._series.items()):
+                label = f'{self.label}="{value}"'
+                for bound, n in zip(self.buckets, buckets):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {n}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label}}} {total:.6f}')
+                lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+class _Counter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for value, n in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{self.label}="{value}"}} {n}')
+        return lines
+
+
+REQUEST_DURATION = _Histogram('kirii_http_request_duration_seconds', 'HTTP request latency by endpoint', 'endpoint')
+SPAN_DURATION = _Histogram('kirii_span_duration_seconds', 'Time spent in instrumented spans', 'span')
+SHEETS_CALLS = _Counter('kirii_sheets_calls_total', 'Google Sheets API reads by sheet', 'sheet')
+SHEETS_CALLS_PER_REQUEST = _Histogram(
+    'kirii_sheets_calls_per_request', 'Google Sheets API reads per HTTP request', 'endpoint',
+    buckets=(0, 1, 2, 3, 5, 8, 13),
+)
+
+
+def _record_span(name, seconds):
+    SPAN_DURATION.observe(name, seconds)
+    spans = getattr(_request_state, 'spans', None)
+    if spans is not None:
+        entry = spans.get(name)
+        if entry is None:
+            spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+class _span:
+    """with _span('name'): / @_span('name') で区間時間を記録（リクエスト外ではヒストグラムのみ）"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record_span(self.name, time.perf_counter() - self._started)
+        return False
+
+    def __call__(self, fn):
+        name = self.name
+
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+
+def _count_sheets_call(sheet_range):
+    SHEETS_CALLS.inc(str(sheet_range).split('!', 1)[0].strip("'") or 'unknown')
+    if getattr(_request_state, 'spans', None) is not None:
+        _request_state.sheets_calls += 1
+
+
+def _mark_cache(name, hit):
+    """キャッシュ命中を Server-Timing の desc に残す"""
+    marks = getattr(_request_state, 'marks', None)
+    if marks is not None:
+        marks[name] = 'hit' if hit else 'miss'
+
+
+@app.before_request
+def _start_request_spans():
+    _request_state.spans = {}
+    _request_state.marks = {}
+    _request_state.sheets_calls = 0
+    _request_state.started = time.perf_counter()
+
+
+@app.after_request
+def _finish_request_spans(response):
+    spans = getattr(_request_state, 'spans', None)
+    if spans is None:
+        return response
+    elapsed = time.perf_counter() - _request_state.started
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_DURATION.observe(endpoint, elapsed)
+    SHEETS_CALLS_PER_REQUEST.observe(endpoint, _request_state.sheets_calls)
+    if SERVER_TIMING_ENABLED:
+        entries = [
+            f'{name};dur={seconds * 1000:.1f};desc="x{count}"' if count > 1 else f'{name};dur={seconds * 1000:.1f}'
+            for name, (seconds, count) in spans.items()
+        ]
+        entries += [f'{name};desc="{state}"' for name, state in _request_state.marks.items()]
+        entries.append(f'sheets_calls;desc="{_request_state.sheets_calls}"')
+        entries.append(f'total;dur={elapsed * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+    _request_state.spans = None
+    return response
+
+
+def _template_render_started(sender, template, context, **extra):
+    stack = getattr(_request_state, 'render_started', None)
+    if stack is None:
+        stack = _request_state.render_started = []
+    stack.append(time.perf_counter())
+
+
+def _template_render_finished(sender, template, context, **extra):
+    stack = getattr(_request_state, 'render_started', None)
+    if stack:
+        _record_span('render', time.perf_counter() - stack.pop())
+
+
+before_render_template.connect(_template_render_started, app)
+template_rendered.connect(_template_render_finished, app)
+
+# 構造化ログ（LOG_LEVEL=DEBUG|INFO|WARNING|ERROR、既定 INFO / LOG_FORMAT=json|text、既定 json）
+# リクエスト経路の DEBUG は LOG_DEBUG_SAMPLE_RATE（既定 0.1）の割合だけ出力する
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+try:
+    LOG_DEBUG_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.1'))))
+except ValueError:
+    LOG_DEBUG_SAMPLE_RATE = 0.1
+
+
+class _JsonLogFormatter(logging.Formatter):
+    """1レコード1行の JSON（time / level / msg / 任意フィールド / リクエスト情報）"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if has_request_context():
+            entry.setdefault('method', request.method)
+            entry.setdefault('path', request.path)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextLogFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        text = f"{record.levelname} {record.getMessage()}"
+        if fields:
+            text += ' ' + ' '.join(f'{k}={v}' for k, v in fields.items())
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+logger = logging.getLogger('kirii')
+if not logger.handlers:
+    _log_handler = logging.StreamHandler(sys.stdout)
+    _log_handler.setFormatter(_JsonLogFormatter() if LOG_FORMAT == 'json' else _TextLogFormatter())
+    logger.addHandler(_log_handler)
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+logger.propagate = False
+
+
+def _log(level, msg, exc_info=None, **fields):
+    """フィールド付きで出力（レベル外なら引数の整形もしない）"""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, exc_info=exc_info, extra={'fields': fields})
+
+
+def _log_debug_sampled(msg, rate=None, **fields):
+    """ホットパス用 DEBUG。LOG_LEVEL=DEBUG かつ抽選に当たった場合のみ出力"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    rate = LOG_DEBUG_SAMPLE_RATE if rate is None else rate
+    if rate < 1.0 and random.random() >= rate:
+        return
+    fields['sample_rate'] = rate
+    logger.debug(msg, extra={'fields': fields})
+
+
+# リクエスト単位のプロファイル（cProfile）。対象: PROFILE_ENDPOINTS
+#  - 管理者指定: ?profile=1 または X-Profile: 1 と Authorization: Bearer <PROFILE_TOKEN>
+#    （未設定なら INVENTORY_SYNC_TOKEN / CRON_SECRET）。トークン未設定時は指定を受け付けない
+#  - 抽選: PROFILE_SAMPLE_RATE（既定 0）の割合で自動取得
+# 結果は PROFILE_DIR（既定 <tmp>/kirii_profiles）に .pstats で保存し、新しい PROFILE_KEEP 件（既定 30）を残す
+# 計測はプロセス内で同時に1件のみ（在庫同期の計測を含む）。計測中に指定されたリクエストは計測せず X-Profile: busy を返す
+PROFILE_ENDPOINTS = {'index', 'product_detail', 'take_stock_page'}
+try:
+    PROFILE_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))))
+except ValueError:
+    PROFILE_SAMPLE_RATE = 0.0
+
+
+def _profile_token():
+    return (os.environ.get('PROFILE_TOKEN') or os.environ.get('INVENTORY_SYNC_TOKEN')
+            or os.environ.get('CRON_SECRET') or '')
+
+
+def _profile_authorized():
+    return _bearer_matches(_profile_token())
+
+
+@app.before_request
+def _start_request_profile():
+    _request_state.profiler = None
+    if request.endpoint not in PROFILE_ENDPOINTS:
+        return
+    requested = request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+    if requested and not _profile_authorized():
+        _request_state.profile_denied = True
+        return
+    if requested or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        # 他のリクエスト・同期が計測中なら今回は計測しない
+        _request_state.profiler = start_profiler()
+        if _request_state.profiler is None and requested:
+            _request_state.profile_busy = True
+
+
+@app.after_request
+def _finish_request_profile(response):
+    profiler = getattr(_request_state, 'profiler', None)
+    if getattr(_request_state, 'profile_denied', False):
+        _request_state.profile_denied = False
+        response.headers['X-Profile'] = 'denied'
+    if getattr(_request_state, 'profile_busy', False):
+        _request_state.profile_busy = False
+        response.headers['X-Profile'] = 'busy'
+    if profiler is None:
+        return response
+    stop_profiler(profiler)
+    _request_state.profiler = None
+    try:
+        profile_id = save_profile(profiler, request.endpoint)
+    except OSError as e:
+        _log(logging.WARNING, 'プロファイル保存エラー', error=str(e))
+        return response
+    response.headers['X-Profile-Id'] = profile_id
+    response.headers['X-Profile-Url'] = f'/api/profiles/{profile_id}'
+    _log(logging.INFO, 'プロファイル保存', profile_id=profile_id, endpoint=request.endpoint)
+    return response
+
+
+@app.teardown_request
+def _abandon_request_profile(_exc):
+    """after_request を通らずに終わった（例外が伝播した）リクエストの計測を止める"""
+    profiler = getattr(_request_state, 'profiler', None)
+    if profiler is not None:
+        _request_state.profiler = None
+        stop_profiler(profiler)
+
 # コードベース特殊カテゴリ（index フィルターと Summary 行のカテゴリ推定で共用）
 TEEBARMK15_CODE_SET = {
     'TNMA1532M3000MK', 'TNMC1525M0600MK', 'TNMC1525M1200MK',
@@ -72,8 +387,8 @@ class KiriiInventoryPlatform:
     def __init__(self):
         # Googleシート設定
         self.sheet_url = os.getenv('GOOGLE_SHEET_URL', 'https://docs.google.com/spreadsheets/d/1u_fsEVAumMySLx8fZdMP5M4jgHiGG6ncPjFEXSXHQ1M/edit?usp=sharing')
-        print(f"🔍 デバッグ: GOOGLE_SHEET_URL = {self.sheet_url}")
-        print(f"🔍 デバッグ: GOOGLE_SERVICE_ACCOUNT_JSON設定済み = {bool(os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON'))}")
+        _log(logging.DEBUG, 'GOOGLE_SHEET_URL', sheet_url=self.sheet_url)
+        _log(logging.DEBUG, 'GOOGLE_SERVICE_ACCOUNT_JSON', configured=bool(os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')))
         
         # HTMLエンティティデコード用のライブラリをインポート
         import html
@@ -85,18 +400,29 @@ class KiriiInventoryPlatform:
         self._inventory_cache_at = 0.0
         self._adjust_cache = None
         self._adjust_cache_at = 0.0
+        # StocktakeSnapshot の product_code → シート行番号 索引（snapshot_key で無効化）
+        self._stocktake_index_cache = None
+        # 保存済み履歴版（不変）のキャッシュ
+        self._history_version_cache = {}
+        # 冪等キー → 保存結果（同一プロセス内の再送は処理中の保存を待って同じ版を返す）
+        self._save_keys = {}
+        self._save_keys_lock = threading.Lock()
+        # Sheets API の接続先。SHEETS_API_STANDIN_URL 指定時はローカル代替サーバー（benchmarks/sheets_standin.py）
+        self.sheets_standin_url = os.getenv('SHEETS_API_STANDIN_URL', '').strip().rstrip('/')
+        self.sheets_api_base = self.sheets_standin_url or 'https://sheets.googleapis.com'
+        # 書込用 Sheets クライアントはスレッド毎に構築する（httplib2 の接続はスレッド間で共有できず、
+        # 同時保存で "Bad file descriptor" 等になる）。_sheets_write_factory が構築関数
+        self._sheets_write_factory = None
+        self._sheets_write_local = threading.local()
         # Googleシート接続を初期化
         self.sheet_client = None
         self.worksheet = None
         self._init_google_sheets()
         
-        print("🏭 KIRII番号ベース在庫管理プラットフォーム初期化完了")
-        print("📱 携帯対応在庫確認システム")
-        print("🔢 QRコード: 番号ベース（超大型マス対応）")
-        if self.use_google_sheets:
-            print("📊 Googleシート連携: 有効")
-        else:
-            print("📊 データソース: ローカル（フォールバック）")
+        _log(
+            logging.INFO, 'KIRII番号ベース在庫管理プラットフォーム初期化完了',
+            data_source='google_sheets' if self.use_google_sheets else 'fallback',
+        )
 
     def _decode_html_entities(self, text):
         """HTMLエンティティをデコードする包括的なメソッド"""
@@ -129,12 +455,12 @@ class KiriiInventoryPlatform:
     def _init_google_sheets(self):
         """Googleシート接続を初期化"""
         try:
-            print(f"🔍 デバッグ: シートURL = {self.sheet_url}")
+            _log(logging.DEBUG, 'シートURL', sheet_url=self.sheet_url)
             # シートIDを抽出
             self.sheet_id = self._extract_sheet_id_from_url(self.sheet_url)
-            print(f"🔍 デバッグ: シートID = {self.sheet_id}")
+            _log(logging.DEBUG, 'シートID', sheet_id=self.sheet_id)
             if not self.sheet_id:
-                print("⚠️ 無効なシートURL")
+                _log(logging.WARNING, "無効なシートURL")
                 self.use_google_sheets = False
                 return
                 
@@ -142,14 +468,27 @@ class KiriiInventoryPlatform:
             self.sheets_service = None
             self.credentials = None
             self.write_credentials = None
-            self.sheets_write_service = None
+            self._sheets_write_factory = None
             self.api_key = None
             
             # 環境変数からサービスアカウントJSONを取得
             service_account_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON')
-            print(f"🔍 デバッグ: サービスアカウントJSON設定済み = {bool(service_account_json)}")
-            if service_account_json:
-                print("🔍 デバッグ: サービスアカウントJSON内容 = [REDACTED]")
+            _log(logging.DEBUG, 'サービスアカウントJSON', configured=bool(service_account_json))
+            if self.sheets_standin_url:
+                # 代替サーバーは認証不要（key は形式上のみ）。読取は API Key 経路、書込は同じ接続先の Sheets クライアント
+                _log(logging.INFO, 'Sheets API 代替サーバーを使用', url=self.sheets_standin_url)
+                self.api_key = 'standin'
+                try:
+                    from googleapiclient.discovery import build  # type: ignore
+                    self._set_sheets_write_factory(lambda: build(
+                        'sheets', 'v4', developerKey=self.api_key,
+                        client_options={'api_endpoint': self.sheets_standin_url},
+                        cache_discovery=False,
+                    ))
+                except Exception as write_build_err:
+                    _log(logging.WARNING, 'Sheets書込サービス初期化失敗', error=str(write_build_err))
+            elif service_account_json:
+                _log(logging.DEBUG, "サービスアカウントJSON内容 = [REDACTED]")
                 try:
                     # 依存が無い環境でも動作するよう遅延インポート
                     from google.oauth2 import service_account  # type: ignore
@@ -158,7 +497,7 @@ class KiriiInventoryPlatform:
 
                     # JSON文字列をパース
                     service_account_info = json.loads(service_account_json)
-                    print(f"🔍 デバッグ: サービスアカウント情報 = {service_account_info.get('client_email', 'N/A')}")
+                    _log(logging.DEBUG, 'サービスアカウント情報', client_email=service_account_info.get('client_email', 'N/A'))
                     
                     credentials = service_account.Credentials.from_service_account_info(
                         service_account_info,
@@ -174,27 +513,30 @@ class KiriiInventoryPlatform:
                     self.write_credentials = write_credentials
                     try:
                         from googleapiclient.discovery import build  # type: ignore
-                        self.sheets_write_service = build('sheets', 'v4', credentials=write_credentials)
+                        self._set_sheets_write_factory(
+                            lambda: build('sheets', 'v4', credentials=write_credentials, cache_discovery=False)
+                        )
                     except Exception as write_build_err:
-                        print(f"⚠️ Sheets書込サービス初期化失敗: {write_build_err}")
-                    print("✅ サービスアカウント認証成功（読取/書込）")
+                        _log(logging.WARNING, 'Sheets書込サービス初期化失敗', error=str(write_build_err))
+                    _log(logging.INFO, "サービスアカウント認証成功（読取/書込）")
                 except Exception as e:
-                    print(f"⚠️ サービスアカウント認証失敗: {e}")
-                    print("📋 API Key方式にフォールバック")
+                    _log(logging.WARNING, 'サービスアカウント認証失敗', error=str(e))
+                    _log(logging.INFO, "API Key方式にフォールバック")
                     self.api_key = os.getenv('GOOGLE_SHEETS_API_KEY', '').strip()
             else:
-                print("⚠️ サービスアカウントJSONが設定されていません")
-                print("📋 API Key方式を使用します")
+                _log(logging.WARNING, "サービスアカウントJSONが設定されていません")
+                _log(logging.INFO, "API Key方式を使用します")
                 self.api_key = os.getenv('GOOGLE_SHEETS_API_KEY', '').strip()
             
             # Google Sheets API接続テスト
             if self.credentials:
                 # サービスアカウント認証での接続テスト
                 try:
-                    print(f"🔍 デバッグ: サービスアカウント認証で接続テスト開始")
-                    print(f"🔍 デバッグ: シートID = {self.sheet_id}")
-                    print(f"🔍 デバッグ: 範囲 = Stock!A1:Y1")
-                    test_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1"
+                    _log(
+                        logging.DEBUG, 'サービスアカウント認証で接続テスト開始',
+                        sheet_id=self.sheet_id, range='Stock!A1:Y1',
+                    )
+                    test_url = f"{self.sheets_api_base}/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1"
                     result_response = requests.get(
                         test_url,
                         headers={'Authorization': f'Bearer {self.credentials.token}'},
@@ -202,33 +544,35 @@ class KiriiInventoryPlatform:
                     )
                     result_response.raise_for_status()
                     result = result_response.json()
-                    print(f"✅ Googleシート接続成功 (サービスアカウント認証) (ID: {self.sheet_id[:8]}...)")
-                    print(f"🔍 デバッグ: 取得データ = {result}")
+                    _log(logging.INFO, 'Googleシート接続成功', auth='service_account', sheet_id=f'{self.sheet_id[:8]}...')
+                    _log(logging.DEBUG, '接続テスト取得データ', result=result)
                     self.use_google_sheets = True
                 except Exception as e:
-                    print(f"❌ Googleシート接続失敗 (サービスアカウント): {e}")
-                    print(f"🔍 デバッグ: エラー詳細 = {type(e).__name__}: {str(e)}")
-                    print("📋 フォールバックモードで動作")
+                    _log(
+                        logging.ERROR, 'Googleシート接続失敗',
+                        auth='service_account', error=str(e), error_type=type(e).__name__,
+                    )
+                    _log(logging.INFO, "フォールバックモードで動作")
                     self.use_google_sheets = False
             elif self.api_key:
                 # API Key認証での接続テスト
-                test_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1"
+                test_url = f"{self.sheets_api_base}/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1"
                 test_response = requests.get(test_url, params={'key': self.api_key}, timeout=10)
                 
                 if test_response.status_code == 200:
-                    print(f"✅ Googleシート接続成功 (API Key認証) (ID: {self.sheet_id[:8]}...)")
+                    _log(logging.INFO, 'Googleシート接続成功', auth='api_key', sheet_id=f'{self.sheet_id[:8]}...')
                     self.use_google_sheets = True
                 else:
-                    print(f"❌ Googleシート接続失敗: {test_response.status_code}")
-                    print("📋 フォールバックモードで動作")
+                    _log(logging.ERROR, 'Googleシート接続失敗', auth='api_key', status=test_response.status_code)
+                    _log(logging.INFO, "フォールバックモードで動作")
                     self.use_google_sheets = False
             else:
-                print("❌ 認証方法が設定されていません")
+                _log(logging.ERROR, "認証方法が設定されていません")
                 self.use_google_sheets = False
                 
         except Exception as e:
-            print(f"❌ Googleシート初期化エラー: {e}")
-            print("📋 フォールバックモードで動作")
+            _log(logging.ERROR, 'Googleシート初期化エラー', error=str(e), error_type=type(e).__name__)
+            _log(logging.INFO, "フォールバックモードで動作")
             self.use_google_sheets = False
     
     def _extract_sheet_id_from_url(self, url):
@@ -240,10 +584,12 @@ class KiriiInventoryPlatform:
             pass
         return None
 
+    @_span('sheets')
     def _get_sheet_values(self, sheet_range):
         """Google Sheets API から指定範囲の値を取得"""
         import requests
-        api_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values/{sheet_range}"
+        _count_sheets_call(sheet_range)
+        api_url = f"{self.sheets_api_base}/v4/spreadsheets/{self.sheet_id}/values/{sheet_range}"
         if self.credentials:
             if not self.credentials.valid:
                 from google.auth.transport.requests import Request  # type: ignore
@@ -271,20 +617,55 @@ class KiriiInventoryPlatform:
         except ValueError:
             return None
 
-    @staticmethod
-    def _normalize_product_code_key(code):
-        import re
-        s = str(code or '').strip().upper()
-        s = re.sub(r"[|'\"`]", '', s)
-        s = re.sub(r'[‐‑‒–—―ー]', '-', s)
-        s = re.sub(r'\s+', '', s)
-        s = re.sub(r'[^A-Z0-9-]', '', s)
-        m = re.match(r'^([A-Z]{1,4})-([0-9O]+)$', s)
-        if m:
-            s = f"{m[1]}-{m[2].replace('O', '0')}"
-        if s == 'GSC08I11000B':
-            s = 'GSC08I1000B'
-        return s
+    # _parse_quantity_columns のマスク種別
+    QUANTITY_BLANK = 1
+    QUANTITY_ERROR = 2
+
+    @classmethod
+    def _parse_quantity_columns(cls, rows, indexes):
+        """rows の指定列をまとめて数量変換する（列単位・同じ文字列は1回だけ変換）
+
+        {列index: (値 array('q'), マスク bytearray)} を返す。マスクは 0=数値,
+        QUANTITY_BLANK=空欄, QUANTITY_ERROR=#N/A・#REF! 等のエラー値や数値化できない値。
+        マスクが立つ要素の値は 0。
+        """
+        n = len(rows)
+        memo = {'': (cls.QUANTITY_BLANK,)}
+        memo_get = memo.get
+        classify = cls._classify_quantity
+        columns = {}
+        for idx in indexes:
+            values = array('q', bytes(8 * n))
+            mask = bytearray(n)
+            width = idx + 1
+            for i, row in enumerate(rows):
+                raw = row[idx] if len(row) >= width else ''
+                if raw.__class__ is str:
+                    parsed = memo_get(raw)
+                    if parsed is None:
+                        # 18 桁までの整数表記は int64 に収まるのでそのまま int 化（それ以外は範囲確認付きの汎用変換）
+                        parsed = memo[raw] = int(raw) if raw.isdecimal() and len(raw) <= 18 else classify(raw)
+                else:
+                    parsed = classify(raw)
+                if parsed.__class__ is int:
+                    values[i] = parsed
+                else:
+                    mask[i] = parsed[0]
+            columns[idx] = (values, mask)
+        return columns
+
+    @classmethod
+    def _classify_quantity(cls, raw):
+        """数量なら int、空欄・エラーなら (マスク種別,)"""
+        if raw is None or str(raw).strip() == '':
+            return (cls.QUANTITY_BLANK,)
+        number = cls._parse_sheet_quantity(raw)
+        if number is None or not -(1 << 63) <= number < (1 << 63):
+            return (cls.QUANTITY_ERROR,)
+        return number
+
+    # 照合規則は product_code.py（inventory_sync と共用）
+    _normalize_product_code_key = staticmethod(normalize_product_code_key)
 
     def _lookup_summary_row(self, summary_by_code, code):
         """Summary行を製品コードで検索（完全一致→OCRゆれフォールバック）"""
@@ -311,22 +692,27 @@ class KiriiInventoryPlatform:
                 return candidates[0][1]
         return None
 
+    @_span('fetch_summary')
     def _fetch_inventory_summary_by_code(self):
         """Gmail同期先 InventorySummaryReport を製品コード索引に変換"""
         summary = {}
         try:
-            rows = self._get_sheet_values('InventorySummaryReport!A2:E5000')
-            for row in rows:
-                if not row or not str(row[0]).strip():
-                    continue
+            rows = [
+                row for row in self._get_sheet_values('InventorySummaryReport!A2:E5000')
+                if row and str(row[0]).strip()
+            ]
+            quantities = self._parse_quantity_columns(rows, (2, 3, 4))
+            (on_hands, on_hand_mask), (without_dns, without_dn_mask), (available, _) = (
+                quantities[i] for i in (2, 3, 4)
+            )
+            for i, row in enumerate(rows):
                 code_key = self._normalize_product_code_key(row[0])
                 if not code_key:
                     continue
-                on_hand = self._parse_sheet_quantity(row[2] if len(row) > 2 else '')
-                without_dn = self._parse_sheet_quantity(row[3] if len(row) > 3 else '')
-                quantity = self._parse_sheet_quantity(row[4] if len(row) > 4 else '')
-                if quantity is None:
-                    quantity = 0
+                on_hand = None if on_hand_mask[i] else on_hands[i]
+                without_dn = None if without_dn_mask[i] else without_dns[i]
+                # 空欄・エラーの要素は 0 が入っている
+                quantity = available[i]
                 entry = {
                     'description': str(row[1] if len(row) > 1 else '').strip(),
                     'on_hand': on_hand,
@@ -336,17 +722,18 @@ class KiriiInventoryPlatform:
                 prev = summary.get(code_key)
                 if prev is None or quantity > (prev.get('quantity') or 0):
                     summary[code_key] = entry
-            print(f"✅ InventorySummaryReport {len(summary)}件を読込")
+            _log(logging.DEBUG, 'InventorySummaryReport 読込', codes=len(summary))
         except Exception as e:
-            print(f"⚠️ InventorySummaryReport取得エラー: {e}")
+            _log(logging.WARNING, 'InventorySummaryReport取得エラー', error=str(e))
         return summary
 
+    @_span('stocktake_snapshot')
     def get_stocktake_snapshot(self):
         """StocktakeSnapshot シートから盤點表データを取得"""
         try:
             values = self._get_sheet_values('StocktakeSnapshot!A1:I2000')
         except Exception as e:
-            print(f"⚠️ StocktakeSnapshot取得エラー: {e}")
+            _log(logging.WARNING, 'StocktakeSnapshot取得エラー', error=str(e))
             return {'meta': {}, 'rows': [], 'error': str(e)}
 
         if not values or len(values) < 2:
@@ -378,12 +765,80 @@ class KiriiInventoryPlatform:
                 'available': padded[7],
                 'adjust': padded[8],
             })
-        return {'meta': meta, 'rows': rows}
+        snapshot = {'meta': meta, 'rows': rows}
+        self._store_stocktake_index(snapshot)
+        return snapshot
+
+    @staticmethod
+    def stocktake_snapshot_key(meta):
+        """盤點表の版マーカー。ページ側 localStorage キー・行番号索引・tbody キャッシュと共用
+
+        同じメールの再処理で行構成が変わる場合（明細数の違う取り直し等）も別の版になるよう、
+        受信時刻に加えて品目数とスクリプト版を含める。
+        """
+        meta = meta or {}
+        return (
+            f"{meta.get('report_date', '')}_{meta.get('report_time', '')}_"
+            f"{meta.get('source_email_at', '') or meta.get('saved_at', '')}_"
+            f"{meta.get('product_count', '')}_{meta.get('script_version', '')}"
+        )
+
+    def _store_stocktake_index(self, snapshot):
+        """読込済みスナップショットから product_code → シート行番号 の索引を作成・保持"""
+        row_index = {}
+        for idx, row in enumerate(snapshot.get('rows', [])):
+            if row.get('row_type') != 'product':
+                continue
+            # meta 行 + ヘッダー行の2行分オフセット
+            row_index.setdefault(row.get('product_code', ''), []).append(idx + 3)
+        self._stocktake_index_cache = {
+            'snapshot_key': self.stocktake_snapshot_key(snapshot.get('meta')),
+            'row_index': row_index,
+            # 履歴凍結用のコピー（呼び出し側での rows 書換えの影響を受けないように）
+            'snapshot': {
+                'meta': dict(snapshot.get('meta') or {}),
+                'rows': [dict(r) for r in snapshot.get('rows', [])],
+            },
+        }
+
+    def _stocktake_index_matches_sheet(self, cached):
+        """キャッシュ索引の行構成がシートの製品コード列（D列）と一致するか（列1本だけ読む）"""
+        try:
+            values = self._get_sheet_values('StocktakeSnapshot!D3:D2000')
+        except Exception as e:
+            _log(logging.WARNING, 'StocktakeSnapshot コード列読取エラー', error=str(e))
+            return False
+        sheet_codes = [cell[0] if cell else '' for cell in values or []]
+        cached_codes = [row.get('product_code', '') for row in cached['snapshot']['rows']]
+        while sheet_codes and not sheet_codes[-1]:
+            sheet_codes.pop()
+        while cached_codes and not cached_codes[-1]:
+            cached_codes.pop()
+        return sheet_codes == cached_codes
+
+    def _get_stocktake_index(self, snapshot_key=None):
+        """snapshot_key が一致し行構成も変わっていなければキャッシュ索引を返し、それ以外は再読込
+
+        同じ版マーカーのまま行が入れ替わった場合（再処理・画面が古い版のまま等）に
+        別の行へ書き込まないよう、キャッシュ利用時も製品コード列だけは照合する。
+        """
+        cached = self._stocktake_index_cache
+        if snapshot_key and cached and cached['snapshot_key'] == snapshot_key:
+            if self._stocktake_index_matches_sheet(cached):
+                return cached
+            _log(logging.INFO, 'StocktakeSnapshot の行構成が変わったため索引を再作成', snapshot_key=snapshot_key)
+        snapshot = self.get_stocktake_snapshot()
+        if snapshot.get('error'):
+            return None
+        return self._stocktake_index_cache
 
+    @_span('fetch_adjust')
     def get_stocktake_adjust_by_code(self):
         """StocktakeSnapshot の Adjust 列を product_code キー辞書で返す"""
         if self._adjust_cache is not None and time.time() - self._adjust_cache_at < 60:
+            _mark_cache('adjust_cache', True)
             return self._adjust_cache
+        _mark_cache('adjust_cache', False)
 
         adjust_map = {}
         snapshot = self.get_stocktake_snapshot()
@@ -415,6 +870,7 @@ class KiriiInventoryPlatform:
                 return adjust_by_code[v]
         return ''
 
+    @_span('attach_adjust')
     def attach_adjust_to_inventory(self, inventory_data):
         """Stock 由来の在庫データに StocktakeSnapshot の Adjust を付与"""
         adjust_by_code = self.get_stocktake_adjust_by_code()
@@ -424,6 +880,7 @@ class KiriiInventoryPlatform:
 
     HISTORY_INDEX_SHEET = 'StocktakeHistoryIndex'
     HISTORY_DATA_SHEET = 'StocktakeHistoryData'
+    HISTORY_VERSION_CACHE_SIZE = 20
 
     def _ensure_sheet_tab(self, title):
         """書込用シートタブが無ければ作成"""
@@ -442,7 +899,7 @@ class KiriiInventoryPlatform:
             ).execute()
             return True
         except Exception as e:
-            print(f"❌ シート作成失敗 ({title}): {e}")
+            _log(logging.ERROR, 'シート作成失敗', sheet=title, error=str(e))
             return False
 
     def _ensure_history_sheets(self):
@@ -452,19 +909,19 @@ class KiriiInventoryPlatform:
         if not self._ensure_sheet_tab(self.HISTORY_DATA_SHEET):
             return False
         try:
-            existing = self._get_sheet_values(f'{self.HISTORY_INDEX_SHEET}!A1:G1')
-            if not existing:
+            existing = self._get_sheet_values(f'{self.HISTORY_INDEX_SHEET}!A1:H1')
+            if not existing or len(existing[0]) < 8:
                 self.sheets_write_service.spreadsheets().values().update(
                     spreadsheetId=self.sheet_id,
-                    range=f'{self.HISTORY_INDEX_SHEET}!A1:G1',
+                    range=f'{self.HISTORY_INDEX_SHEET}!A1:H1',
                     valueInputOption='RAW',
                     body={'values': [[
                         'version_id', 'saved_at', 'report_date', 'report_time',
-                        'product_count', 'start_row', 'end_row',
+                        'product_count', 'start_row', 'end_row', 'idempotency_key',
                     ]]},
                 ).execute()
         except Exception as e:
-            print(f"⚠️ History Index ヘッダー初期化: {e}")
+            _log(logging.WARNING, 'History Index ヘッダー初期化エラー', error=str(e))
         return True
 
     def list_stocktake_history_versions(self):
@@ -472,7 +929,7 @@ class KiriiInventoryPlatform:
         try:
             values = self._get_sheet_values(f'{self.HISTORY_INDEX_SHEET}!A2:G500')
         except Exception as e:
-            print(f"⚠️ History Index 読取: {e}")
+            _log(logging.WARNING, 'History Index 読取エラー', error=str(e))
             return []
         versions = []
         for row in values or []:
@@ -497,6 +954,10 @@ class KiriiInventoryPlatform:
         version_id = str(version_id or '').strip()
         if not version_id:
             return {'meta': {}, 'rows': [], 'error': 'missing version_id'}
+        # 保存済み版は書換えられないため、一度読めばシートを再参照しない
+        cached = self._history_version_cache.get(version_id)
+        if cached is not None:
+            return cached
         try:
             index_rows = self._get_sheet_values(f'{self.HISTORY_INDEX_SHEET}!A2:G500')
         except Exception as e:
@@ -552,9 +1013,96 @@ class KiriiInventoryPlatform:
                 'available': padded[7],
                 'adjust': padded[8],
             })
-        return {'meta': meta_info, 'rows': rows, 'version_id': version_id}
+        snapshot = {'meta': meta_info, 'rows': rows, 'version_id': version_id}
+        if len(self._history_version_cache) >= self.HISTORY_VERSION_CACHE_SIZE:
+            self._history_version_cache.pop(next(iter(self._history_version_cache)))
+        self._history_version_cache[version_id] = snapshot
+        return snapshot
+
+    STOCKTAKE_DIFF_FIELDS = ('on_hand', 'sc_wo_dn', 'available', 'adjust')
+
+    def diff_stocktake_history_versions(self, from_version_id, to_version_id):
+        """2つの履歴版を製品コードで突合し、数量/Adjust が変わった製品のみ返す
+
+        値は added / removed / changed とも前後空白を除いた文字列で返す。同じコードが複数行ある場合は
+        出現順（n 番目同士）で突合し、該当コードを duplicate_codes に、各変更に occurrence を付ける。
+        """
+        old = self.get_stocktake_history_version(from_version_id)
+        if old.get('error') and not old.get('rows'):
+            return {'error': f"{from_version_id}: {old.get('error')}"}
+        new = self.get_stocktake_history_version(to_version_id)
+        if new.get('error') and not new.get('rows'):
+            return {'error': f"{to_version_id}: {new.get('error')}"}
+
+        def by_code(snapshot):
+            index = {}
+            seen = {}
+            for row in snapshot.get('rows', []):
+                if row.get('row_type') != 'product':
+                    continue
+                code_key = self._normalize_product_code_key(row.get('product_code', ''))
+                if code_key:
+                    seen[code_key] = seen.get(code_key, 0) + 1
+                    index[(code_key, seen[code_key])] = row
+            return index, {code for code, count in seen.items() if count > 1}
+
+        def value(row, field):
+            return str(row.get(field, '') or '').strip() if row is not None else ''
+
+        old_by_code, old_duplicates = by_code(old)
+        new_by_code, new_duplicates = by_code(new)
+        duplicates = old_duplicates | new_duplicates
+
+        def change_entry(key, row, change, fields):
+            entry = {
+                'product_code': row.get('product_code', ''),
+                'description': row.get('description', ''),
+                'change': change,
+                'fields': fields,
+            }
+            if key[0] in duplicates:
+                entry['occurrence'] = key[1]
+            return entry
+
+        changes = []
+        for key, new_row in new_by_code.items():
+            old_row = old_by_code.get(key)
+            fields = {}
+            for f in self.STOCKTAKE_DIFF_FIELDS:
+                before, after = value(old_row, f), value(new_row, f)
+                if old_row is None or before != after:
+                    fields[f] = {'from': before, 'to': after}
+            if old_row is None:
+                changes.append(change_entry(key, new_row, 'added', fields))
+            elif fields:
+                changes.append(change_entry(key, new_row, 'changed', fields))
+        for key, old_row in old_by_code.items():
+            if key in new_by_code:
+                continue
+            fields = {f: {'from': value(old_row, f), 'to': ''} for f in self.STOCKTAKE_DIFF_FIELDS}
+            changes.append(change_entry(key, old_row, 'removed', fields))
+        return {
+            'from': {'version_id': from_version_id, 'meta': old.get('meta', {})},
+            'to': {'version_id': to_version_id, 'meta': new.get('meta', {})},
+            'compared_products': len(new_by_code),
+            'changed_count': len(changes),
+            'duplicate_codes': sorted(duplicates),
+            'changes': changes,
+        }
+
+    def _find_history_version_by_key(self, idempotency_key):
+        """履歴 Index の H 列（冪等キー）から保存済みの version_id を探す（他インスタンスでの保存も対象）"""
+        try:
+            values = self._get_sheet_values(f'{self.HISTORY_INDEX_SHEET}!A2:H500')
+        except Exception as e:
+            _log(logging.WARNING, 'History Index 読取エラー', error=str(e))
+            return None
+        for row in reversed(values or []):
+            if len(row) >= 8 and row[0] and row[7] == idempotency_key:
+                return row[0]
+        return None
 
-    def _append_stocktake_history(self, snapshot, adjustments):
+    def _append_stocktake_history(self, snapshot, adjustments, idempotency_key=''):
         """現在スナップショット + Adjust を履歴として凍結保存。version_id を返す"""
         if not getattr(self, 'sheets_write_service', None):
             return None, 'write service unavailable'
@@ -618,39 +1166,88 @@ class KiriiInventoryPlatform:
             ).execute()
             self.sheets_write_service.spreadsheets().values().append(
                 spreadsheetId=self.sheet_id,
-                range=f'{self.HISTORY_INDEX_SHEET}!A:G',
+                range=f'{self.HISTORY_INDEX_SHEET}!A:H',
                 valueInputOption='RAW',
                 insertDataOption='INSERT_ROWS',
                 body={'values': [[
                     version_id, saved_at, report_date, report_time,
-                    str(product_count), str(start_row), str(end_row),
+                    str(product_count), str(start_row), str(end_row), idempotency_key or '',
                 ]]},
             ).execute()
             return version_id, f'history saved ({product_count} products)'
         except Exception as e:
-            print(f"❌ History保存エラー: {e}")
+            _log(logging.ERROR, 'History保存エラー', error=str(e))
             return None, str(e)
 
-    def save_stocktake_adjustments(self, adjustments):
-        """StocktakeSnapshot の Adjust 列（I列）を更新し、フル版を履歴へ凍結"""
+    def _refresh_snapshot_adjust(self, snapshot):
+        """Adjust 列（I列）だけを再読込してスナップショットへ反映。失敗時は False"""
+        rows = snapshot.get('rows') or []
+        if not rows:
+            return True
+        try:
+            values = self._get_sheet_values(f'StocktakeSnapshot!I3:I{len(rows) + 2}')
+        except Exception as e:
+            _log(logging.WARNING, 'Adjust再読込エラー', error=str(e))
+            return False
+        for idx, row in enumerate(rows):
+            cell = values[idx] if idx < len(values) else []
+            row['adjust'] = cell[0] if cell else ''
+        return True
+
+    # 冪等キーの保持時間（画面の自動再送は数秒以内）
+    SAVE_KEY_TTL_SECONDS = 3600
+
+    def save_stocktake_adjustments(self, adjustments, snapshot_key=None, idempotency_key=None):
+        """StocktakeSnapshot の Adjust 列（I列）を更新し、フル版を履歴へ凍結
+
+        snapshot_key がキャッシュ済み索引と一致し製品コード列も変わっていなければ、書込先の特定に
+        シート全体の再読込を省略する。履歴版は書込後に Adjust 列を読み直して作る（キャッシュ後の他者の保存を含めるため）。
+        idempotency_key 付きの再送（応答が失われた後の自動再送）は保存済みの版を返し、重複版を作らない。
+        同一プロセス内では処理中の保存の完了を待ち、他インスタンスでの保存は履歴 Index の H 列で照合する。
+        """
+        if not idempotency_key:
+            return self._save_stocktake_adjustments(adjustments, snapshot_key)
+        now = time.time()
+        with self._save_keys_lock:
+            for key, entry in list(self._save_keys.items()):
+                if entry['at'] < now - self.SAVE_KEY_TTL_SECONDS and not entry['lock'].locked():
+                    del self._save_keys[key]
+            entry = self._save_keys.setdefault(
+                idempotency_key, {'lock': threading.Lock(), 'result': None, 'at': now}
+            )
+        with entry['lock']:
+            if entry['result'] is None:
+                version_id = self._find_history_version_by_key(idempotency_key)
+                if not version_id:
+                    result = self._save_stocktake_adjustments(adjustments, snapshot_key, idempotency_key)
+                    # 失敗した保存は再送で改めて実行する
+                    if result[0]:
+                        entry['result'] = result
+                    return result
+                entry['result'] = (True, 'history saved', version_id)
+            _, message, version_id = entry['result']
+            _log(logging.INFO, 'Adjust保存の再送（保存済みの版を返す）', version_id=version_id)
+            return True, f'already saved (duplicate request); {message}', version_id
+
+    def _save_stocktake_adjustments(self, adjustments, snapshot_key=None, idempotency_key=''):
         if adjustments is None or not isinstance(adjustments, dict):
             return False, 'adjustments empty', None
         if not getattr(self, 'sheets_write_service', None):
             return False, 'write service unavailable', None
 
-        snapshot = self.get_stocktake_snapshot()
+        index = self._get_stocktake_index(snapshot_key)
+        if index is None:
+            return False, 'stocktake snapshot unavailable', None
+        snapshot = index['snapshot']
         data = []
-        for idx, row in enumerate(snapshot.get('rows', [])):
-            if row.get('row_type') != 'product':
-                continue
-            code = row.get('product_code', '')
+        for code, sheet_rows in index['row_index'].items():
             if code not in adjustments:
                 continue
-            sheet_row = idx + 3
-            data.append({
-                'range': f'StocktakeSnapshot!I{sheet_row}',
-                'values': [[str(adjustments[code])]]
-            })
+            for sheet_row in sheet_rows:
+                data.append({
+                    'range': f'StocktakeSnapshot!I{sheet_row}',
+                    'values': [[str(adjustments[code])]]
+                })
 
         try:
             if data:
@@ -661,10 +1258,24 @@ class KiriiInventoryPlatform:
             self._adjust_cache = None
             self._adjust_cache_at = 0.0
         except Exception as e:
-            print(f"❌ Adjust保存エラー: {e}")
+            _log(logging.ERROR, 'Adjust保存エラー', error=str(e))
+            # 書込結果が不明なため索引キャッシュも破棄
+            self._stocktake_index_cache = None
             return False, str(e), None
 
-        version_id, hist_msg = self._append_stocktake_history(snapshot, adjustments)
+        # キャッシュ後に他端末・他インスタンスが保存した Adjust を取り込んでから凍結する
+        if not self._refresh_snapshot_adjust(snapshot):
+            self._stocktake_index_cache = None
+            fresh = self.get_stocktake_snapshot()
+            if fresh.get('error'):
+                return False, f"adjust saved but history failed: {fresh['error']}", None
+            snapshot = self._stocktake_index_cache['snapshot']
+        # 読込結果に自分の書込が未反映の場合に備えて上書き（次回保存の凍結コピー用）
+        for row in snapshot.get('rows', []):
+            if row.get('row_type') == 'product' and row.get('product_code', '') in adjustments:
+                row['adjust'] = str(adjustments[row['product_code']])
+
+        version_id, hist_msg = self._append_stocktake_history(snapshot, adjustments, idempotency_key)
         if not version_id:
             return False, f'adjust saved but history failed: {hist_msg}', None
         return True, f'updated {len(data)} rows; {hist_msg}', version_id
@@ -682,10 +1293,10 @@ class KiriiInventoryPlatform:
                     continue
                 padded = row + [''] * (len(header) - len(row))
                 rows.append(dict(zip(header, padded)))
-            print(f"✅ InventorySummaryReport {len(rows)}行取得")
+            _log(logging.DEBUG, 'InventorySummaryReport 取得', rows=len(rows))
             return rows
         except Exception as e:
-            print(f"⚠️ InventorySummaryReport取得エラー: {e}")
+            _log(logging.WARNING, 'InventorySummaryReport取得エラー', error=str(e))
             return []
 
     def build_download_list_rows(self):
@@ -714,7 +1325,9 @@ class KiriiInventoryPlatform:
     def get_inventory_data(self):
         """在庫データを取得（Googleシートまたはローカル）"""
         if self._inventory_cache is not None and time.time() - self._inventory_cache_at < 60:
+            _mark_cache('inventory_cache', True)
             return self._inventory_cache
+        _mark_cache('inventory_cache', False)
 
         if self.use_google_sheets and (getattr(self, 'credentials', None) or getattr(self, 'api_key', None)):
             try:
@@ -723,11 +1336,11 @@ class KiriiInventoryPlatform:
                 self._inventory_cache_at = time.time()
                 return data
             except Exception as e:
-                print(f"⚠️ Googleシートからのデータ取得エラー: {e}")
-                print("📋 フォールバックデータを使用します")
+                _log(logging.WARNING, 'Googleシートからのデータ取得エラー（フォールバックデータを使用）', error=str(e))
                 
         return self.fallback_inventory
 
+    @_span('fetch_stock')
     def _fetch_from_google_sheets(self):
         """Googleシートからデータを取得（サービスアカウント認証またはAPI Key方式）"""
         import requests
@@ -739,18 +1352,20 @@ class KiriiInventoryPlatform:
                 if not self.credentials.valid:
                     from google.auth.transport.requests import Request  # type: ignore
                     self.credentials.refresh(Request())
-                api_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1500"
-                response = requests.get(
-                    api_url,
-                    headers={'Authorization': f'Bearer {self.credentials.token}'},
-                    timeout=10
-                )
-                response.raise_for_status()
-                data = response.json()
+                api_url = f"{self.sheets_api_base}/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1500"
+                _count_sheets_call('Stock!A1:Y1500')
+                with _span('sheets'):
+                    response = requests.get(
+                        api_url,
+                        headers={'Authorization': f'Bearer {self.credentials.token}'},
+                        timeout=10
+                    )
+                    response.raise_for_status()
+                    data = response.json()
                 values = data.get('values', [])
             else:
                 # API Key認証でのデータ取得
-                api_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1500"
+                api_url = f"{self.sheets_api_base}/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1500"
                 
                 # Google Sheets APIからデータを取得（キャッシュ無効化ヘッダー付き）
                 headers = {
@@ -758,14 +1373,15 @@ class KiriiInventoryPlatform:
                     'Pragma': 'no-cache',
                     'Expires': '0'
                 }
-                response = requests.get(api_url, params={'key': self.api_key}, headers=headers, timeout=10)
-                response.raise_for_status()
-                
-                data = response.json()
+                _count_sheets_call('Stock!A1:Y1500')
+                with _span('sheets'):
+                    response = requests.get(api_url, params={'key': self.api_key}, headers=headers, timeout=10)
+                    response.raise_for_status()
+                    data = response.json()
                 values = data.get('values', [])
             
             if not values:
-                print("⚠️ Googleシートにデータがありません")
+                _log(logging.WARNING, 'Googleシートにデータがありません')
                 return self.fallback_inventory
             
             # ヘッダー行を取得
@@ -786,8 +1402,14 @@ class KiriiInventoryPlatform:
 
             next_auto_number = max_number + 1
             summary_by_code = self._fetch_inventory_summary_by_code()
+            # U/V/W列: StockのVLOOKUP結果は列単位でまとめて数値化
+            quantities = self._parse_quantity_columns(rows, (20, 21, 22))
+            (on_hands, on_hand_mask), (without_dns, without_dn_mask), (available, _) = (
+                quantities[i] for i in (20, 21, 22)
+            )
             inventory_data = {}
-            for row in rows:
+            debug_html = logger.isEnabledFor(logging.DEBUG)
+            for row_idx, row in enumerate(rows):
                 try:
                     # 採用条件: C列にProductCodeがある
                     if len(row) <= 2:
@@ -808,9 +1430,9 @@ class KiriiInventoryPlatform:
                     raw_name = row[3] if len(row) > 3 else ''
                     name = self._decode_html_entities(raw_name)
                     
-                    # デバッグ用：HTMLエンティティが含まれる製品名を確認
-                    if raw_name and ('&#34;' in str(raw_name) or '&#39;' in str(raw_name) or 'Marco' in str(raw_name) or 'Themawool' in str(raw_name)):
-                        print(f"🔍 DEBUG HTML: raw='{raw_name}', decoded='{name}'")
+                    # デバッグ用：HTMLエンティティが含まれる製品名を確認（LOG_LEVEL=DEBUG 時のみ判定）
+                    if debug_html and raw_name and ('&#34;' in str(raw_name) or '&#39;' in str(raw_name) or 'Marco' in str(raw_name) or 'Themawool' in str(raw_name)):
+                        _log_debug_sampled('HTMLエンティティ デコード', raw=raw_name, decoded=name)
 
                     # T列: 保管場所 正規化（空/"0"→"0"）
                     raw_loc = row[19] if len(row) > 19 else ''
@@ -818,14 +1440,10 @@ class KiriiInventoryPlatform:
                     normalized_loc = '0' if (loc_str == '' or loc_str == '0') else loc_str
 
                     # U/V/W列: StockのVLOOKUP結果（失敗時0になるためSummaryを優先）
-                    raw_on_hand = row[20] if len(row) > 20 else ''
-                    raw_wo = row[21] if len(row) > 21 else ''
-                    raw_qty = row[22] if len(row) > 22 else ''
-                    on_hand = self._parse_sheet_quantity(raw_on_hand)
-                    without_dn = self._parse_sheet_quantity(raw_wo)
-                    quantity = self._parse_sheet_quantity(raw_qty)
-                    if quantity is None:
-                        quantity = 0
+                    on_hand = None if on_hand_mask[row_idx] else on_hands[row_idx]
+                    without_dn = None if without_dn_mask[row_idx] else without_dns[row_idx]
+                    # 空欄・エラーの要素は 0 が入っている
+                    quantity = available[row_idx]
 
                     summary = self._lookup_summary_row(summary_by_code, code_cell)
                     if summary:
@@ -858,7 +1476,7 @@ class KiriiInventoryPlatform:
                         'category_detail': row[3] if len(row) > 3 else ''
                     }
                 except (ValueError, IndexError) as e:
-                    print(f"⚠️ 行データ処理エラー: {e}")
+                    _log(logging.WARNING, '行データ処理エラー', row=row_idx + 2, error=str(e))
                     continue
 
             # Stock に無く InventorySummaryReport にのみ存在する製品を追加（例: SW-002）
@@ -893,25 +1511,46 @@ class KiriiInventoryPlatform:
                 stock_code_keys.add(code_key)
 
             if inventory_data:
-                print(f"✅ Googleシートから{len(inventory_data)}件のデータを取得")
+                _log(logging.DEBUG, 'Googleシートから在庫データを取得', items=len(inventory_data))
                 return inventory_data
             else:
-                print("⚠️ 有効なデータが見つかりませんでした")
+                _log(logging.WARNING, '有効なデータが見つかりませんでした')
                 return self.fallback_inventory
                 
         except requests.RequestException as e:
-            print(f"❌ Googleシート API リクエストエラー: {e}")
-            if hasattr(self, 'api_key') and self.api_key:
-                api_url = f"https://sheets.googleapis.com/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1500"
-                print(f"📋 API URL: {api_url}?key=[REDACTED]")
-            print(f"📋 レスポンスコード: {getattr(e.response, 'status_code', 'N/A')}")
-            print(f"📋 レスポンス内容: {getattr(e.response, 'text', 'N/A')}")
+            _log(
+                logging.ERROR, 'Googleシート API リクエストエラー',
+                error=str(e),
+                url=f"{self.sheets_api_base}/v4/spreadsheets/{self.sheet_id}/values/Stock!A1:Y1500",
+                status=getattr(e.response, 'status_code', None),
+                body=(getattr(e.response, 'text', None) or '')[:500],
+            )
             return self.fallback_inventory
         except Exception as e:
-            print(f"❌ データ処理エラー: {e}")
-            print(f"📋 エラータイプ: {type(e).__name__}")
+            _log(logging.ERROR, 'データ処理エラー', exc_info=True, error=str(e), error_type=type(e).__name__)
             return self.fallback_inventory
 
+    def _set_sheets_write_factory(self, factory):
+        """書込クライアントの構築関数を登録し、このスレッド用を構築して検証（失敗時は例外）"""
+        self._sheets_write_local = threading.local()
+        self._sheets_write_local.service = factory()
+        self._sheets_write_factory = factory
+
+    @property
+    def sheets_write_service(self):
+        """書込用 Sheets クライアント（呼出スレッド専用。未設定・構築失敗時は None）"""
+        factory = self._sheets_write_factory
+        if factory is None:
+            return None
+        service = getattr(self._sheets_write_local, 'service', None)
+        if service is None:
+            try:
+                service = self._sheets_write_local.service = factory()
+            except Exception as e:
+                _log(logging.WARNING, 'Sheets書込サービス初期化失敗', error=str(e))
+                return None
+        return service
+
     @property
     def inventory_mapping(self):
         """在庫データのプロパティ"""
@@ -929,7 +1568,152 @@ class KiriiInventoryPlatform:
         # Googleシート接続失敗時は空の辞書を返す（エラー表示のため）
         return {}
 
+class StocktakeSaveQueue:
+    """Adjust 保存ジョブのキュー（冪等キー付き、連続した保存は1回の書込にまとめる）
+
+    状態はプロセス内のみ。常駐サーバー向けで STOCKTAKE_ASYNC_SAVE=1 のときだけ使う。
+    """
+
+    # 直後に届いた保存をまとめるための待ち時間
+    COALESCE_WINDOW_SECONDS = 0.3
+    # 完了ジョブの保持時間（冪等キーの有効期間を兼ねる）
+    JOB_TTL_SECONDS = 3600
+
+    def __init__(self, inventory_platform):
+        self.platform = inventory_platform
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._jobs_by_key = {}
+        self._worker = None
+
+    def submit(self, adjustments, snapshot_key=None, idempotency_key=None):
+        """ジョブを登録して (job, created) を返す。同じ冪等キーの再送は既存ジョブを返す"""
+        with self._lock:
+            self._prune()
+            if idempotency_key and idempotency_key in self._jobs_by_key:
+                return self._public(self._jobs[self._jobs_by_key[idempotency_key]]), False
+            job_id = 'job_' + uuid.uuid4().hex[:16]
+            job = {
+                'job_id': job_id,
+                'status': 'queued',
+                'idempotency_key': idempotency_key,
+                'snapshot_key': snapshot_key,
+                'adjustments': dict(adjustments),
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'version_id': None,
+                'message': '',
+                'coalesced': 1,
+            }
+            self._jobs[job_id] = job
+            if idempotency_key:
+                self._jobs_by_key[idempotency_key] = job_id
+            self._ensure_worker()
+        self._queue.put(job_id)
+        return self._public(job), True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    @staticmethod
+    def _public(job):
+        out = {k: v for k, v in job.items() if k not in ('adjustments', 'idempotency_key')}
+        if job['finished_at'] and job['created_at']:
+            out['elapsed_ms'] = round((job['finished_at'] - job['created_at']) * 1000, 1)
+        return out
+
+    def _prune(self):
+        cutoff = time.time() - self.JOB_TTL_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job['finished_at'] and job['finished_at'] < cutoff:
+                del self._jobs[job_id]
+                if job['idempotency_key']:
+                    self._jobs_by_key.pop(job['idempotency_key'], None)
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name='stocktake-save-worker', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.COALESCE_WINDOW_SECONDS
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # 同じ snapshot_key が連続する区間ごとに1回の保存へまとめる
+            groups = []
+            for job_id in batch:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                if groups and groups[-1][0]['snapshot_key'] == job['snapshot_key']:
+                    groups[-1].append(job)
+                else:
+                    groups.append([job])
+            for group in groups:
+                self._process(group)
+
+    def _process(self, jobs):
+        merged = {}
+        with self._lock:
+            for job in jobs:
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                merged.update(job['adjustments'])
+        try:
+            ok, message, version_id = self.platform.save_stocktake_adjustments(
+                merged, snapshot_key=jobs[-1]['snapshot_key']
+            )
+        except Exception as e:
+            _log(logging.ERROR, 'Adjust保存ジョブエラー', exc_info=True, error=str(e))
+            ok, message, version_id = False, str(e), None
+        finished_at = time.time()
+        with self._lock:
+            for job in jobs:
+                job['status'] = 'done' if ok else 'failed'
+                job['message'] = message
+                job['version_id'] = version_id
+                job['coalesced'] = len(jobs)
+                job['finished_at'] = finished_at
+        if len(jobs) > 1:
+            _log(logging.INFO, 'Adjust保存を集約', jobs=len(jobs), version_id=version_id)
+
+
 platform = KiriiInventoryPlatform()
+stocktake_save_queue = StocktakeSaveQueue(platform)
+
+# 非同期保存（?async=1）は常駐サーバーのみ STOCKTAKE_ASYNC_SAVE=1 で有効。
+# ジョブ・冪等キーはプロセス内にしか無く、Vercel ではレスポンス後にワーカーが止まり別インスタンスから参照できないため
+STOCKTAKE_ASYNC_SAVE = os.environ.get('STOCKTAKE_ASYNC_SAVE') == '1' and not os.environ.get('VERCEL')
+
+
+def _inventory_sync_module():
+    """inventory_sync はVercelデプロイから除外しているため、無い環境では None"""
+    try:
+        import inventory_sync
+    except ImportError:
+        return None
+    return inventory_sync
+
+
+# 常駐サーバーでは INVENTORY_SYNC_SCHEDULER=1 で定時同期スレッドを起動（スレッドを使わない場合は外部 cron から
+# /api/sync/run?scheduled=1。inventory_sync は .vercelignore 対象のため Vercel 上では同期 API は 503）
+if os.environ.get('INVENTORY_SYNC_SCHEDULER') == '1' and not os.environ.get('VERCEL'):
+    _sync = _inventory_sync_module()
+    if _sync is not None and _sync.start_inventory_sync_scheduler():
+        _log(logging.INFO, '在庫同期スケジューラ起動', check_times=_sync._sync_check_times())
 
 # ロゴとファビコンの例外処理のみ有効（認証チェック無効化）
 @app.before_request
@@ -1096,11 +1880,12 @@ def index():
             return ' '.join(s.lower().split())
         needle = normalize(unquote(query))
         filtered = {}
-        for num, item in inventory_data.items():
-            name = item.get('name', '')
-            code = item.get('code', '')
-            if needle in normalize(name) or needle in normalize(code):
-                filtered[num] = item
+        with _span('normalize'):
+            for num, item in inventory_data.items():
+                name = item.get('name', '')
+                code = item.get('code', '')
+                if needle in normalize(name) or needle in normalize(code):
+                    filtered[num] = item
         inventory_data = filtered
 
     import re
@@ -1200,7 +1985,6 @@ def index():
     # cat変数をデコードして統一
     from urllib.parse import unquote
     cat_decoded = unquote(cat) if cat else ''
-    print(f"🔍 DEBUG: cat='{cat}', cat_decoded='{cat_decoded}'")  # デバッグ用
     
     if cat_decoded:
         if cat_decoded in CODE_BASED_FILTERS:
@@ -1270,12 +2054,10 @@ def index():
 
     # E列のカテゴリをそのまま使用（変換不要）
     raw_categories = [v.get('category', '') for v in platform.get_inventory_data().values()]
-    print(f"🔍 E列のカテゴリデータ: {raw_categories[:10]}...")  # デバッグ用
     
     # 空でないカテゴリのみを集計（KSSを除外）
     valid_categories = [c for c in raw_categories if c.strip() and c != 'KSS']
     canon_counts = Counter(valid_categories)
-    print(f"🔍 カテゴリ集計: {dict(canon_counts)}")  # デバッグ用
     
     # コードベース特殊カテゴリの件数を計算
     all_inventory = platform.get_inventory_data()
@@ -1300,12 +2082,14 @@ def index():
         if cat not in ordered_categories:
             ordered_categories.append(cat)
     
-    print(f"🔍 順序付けられたカテゴリ: {ordered_categories}")  # デバッグ用
     
     top_categories_canon = ordered_categories[:10]
     ordered_cnt = [(c, canon_counts[c]) for c in ordered_categories]
     
-    print(f"🔍 表示用カテゴリ（最初の10個）: {top_categories_canon}")  # デバッグ用
+    _log_debug_sampled(
+        'index カテゴリ集計', cat=cat_decoded, raw_categories=raw_categories[:10],
+        counts=canon_counts, ordered=ordered_categories, top=top_categories_canon,
+    )
 
     platform.attach_adjust_to_inventory(inventory_data)
 
@@ -2355,7 +3139,7 @@ def product_detail(product_number):
     ''', product=product, number=product_number)
     
     except Exception as e:
-        print(f"❌ 製品詳細ページエラー (番号: {product_number}): {e}")
+        _log(logging.ERROR, '製品詳細ページエラー', exc_info=True, number=product_number, error=str(e))
         return render_template_string('''
         <div style="text-align: center; padding: 50px; font-family: Arial, sans-serif; background: white; color: #333;">
             <h1>❌ エラーが発生しました</h1>
@@ -2391,6 +3175,48 @@ def api_summary_peek():
     return jsonify({'summary_count': len(summary), 'codes': out})
 
 
+# 盤點表 tbody（Adjust 値は含めない）。snapshot_key 単位で描画結果をキャッシュし、
+# Adjust は ADJUST_VALUES としてページ側で上書きする
+STOCKTAKE_TABLE_BODY_TEMPLATE = '''
+                    {% for row in rows %}
+                    {% if row.row_type == 'category' %}
+                    <tr class="category-row"><td colspan="6">{{ row.category }}</td></tr>
+                    {% elif row.row_type == 'subcategory' %}
+                    <tr class="subcategory-row"><td colspan="6">{{ row.sub_category }}</td></tr>
+                    {% elif row.row_type == 'product' %}
+                    <tr class="product-row" data-code="{{ row.product_code }}">
+                        <td class="code">{{ row.product_code }}</td>
+                        <td>{{ row.description }}</td>
+                        <td class="num">{{ row.on_hand }}</td>
+                        <td class="num">{{ row.sc_wo_dn }}</td>
+                        <td class="num">{{ row.available }}</td>
+                        <td class="num">
+                            <input type="text" class="adjust-input" data-code="{{ row.product_code }}"
+                                   value="" inputmode="decimal"
+                                   {% if read_only %}disabled{% endif %}>
+                        </td>
+                    </tr>
+                    {% endif %}
+                    {% endfor %}
+'''
+STOCKTAKE_TABLE_BODY_CACHE_SIZE = 16
+_stocktake_table_body_cache = {}
+
+
+def _render_stocktake_table_body(rows, snapshot_key, version_id, read_only):
+    """盤點表 tbody を snapshot_key 単位でキャッシュして返す"""
+    cache_key = (snapshot_key, version_id, read_only)
+    body = _stocktake_table_body_cache.get(cache_key)
+    if body is not None:
+        return body
+    body = render_template_string(STOCKTAKE_TABLE_BODY_TEMPLATE, rows=rows, read_only=read_only)
+    if rows and snapshot_key.strip('_'):
+        if len(_stocktake_table_body_cache) >= STOCKTAKE_TABLE_BODY_CACHE_SIZE:
+            _stocktake_table_body_cache.pop(next(iter(_stocktake_table_body_cache)))
+        _stocktake_table_body_cache[cache_key] = body
+    return body
+
+
 @app.route('/take-stock')
 def take_stock_page():
     """盤點ページ - PDF形式の表 + Adjust入力 + 版履歴"""
@@ -2406,12 +3232,14 @@ def take_stock_page():
         snapshot = platform.get_stocktake_snapshot()
     meta = snapshot.get('meta', {})
     rows = snapshot.get('rows', [])
-    if clear_adjust:
+    adjust_values = {}
+    if not clear_adjust:
         for row in rows:
-            if row.get('row_type') == 'product':
-                row['adjust'] = ''
+            if row.get('row_type') == 'product' and row.get('adjust'):
+                adjust_values[row.get('product_code', '')] = row['adjust']
     versions = platform.list_stocktake_history_versions()
-    snapshot_key = f"{meta.get('report_date', '')}_{meta.get('report_time', '')}_{meta.get('source_email_at', '') or meta.get('saved_at', '')}"
+    snapshot_key = platform.stocktake_snapshot_key(meta)
+    table_body = _render_stocktake_table_body(rows, snapshot_key, version_id, read_only)
     return render_template_string('''
 <!DOCTYPE html>
 <html lang="zh-HK">
@@ -2610,26 +3438,7 @@ def take_stock_page():
                     </tr>
                 </thead>
                 <tbody>
-                    {% for row in rows %}
-                    {% if row.row_type == 'category' %}
-                    <tr class="category-row"><td colspan="6">{{ row.category }}</td></tr>
-                    {% elif row.row_type == 'subcategory' %}
-                    <tr class="subcategory-row"><td colspan="6">{{ row.sub_category }}</td></tr>
-                    {% elif row.row_type == 'product' %}
-                    <tr class="product-row" data-code="{{ row.product_code }}">
-                        <td class="code">{{ row.product_code }}</td>
-                        <td>{{ row.description }}</td>
-                        <td class="num">{{ row.on_hand }}</td>
-                        <td class="num">{{ row.sc_wo_dn }}</td>
-                        <td class="num">{{ row.available }}</td>
-                        <td class="num">
-                            <input type="text" class="adjust-input" data-code="{{ row.product_code }}"
-                                   value="{{ row.adjust or '' }}" inputmode="decimal"
-                                   {% if read_only %}disabled{% endif %}>
-                        </td>
-                    </tr>
-                    {% endif %}
-                    {% endfor %}
+{{ table_body | safe }}
                 </tbody>
             </table>
         </div>
@@ -2656,6 +3465,8 @@ def take_stock_page():
         const READ_ONLY = {{ read_only | tojson }};
         const VERSION_ID = {{ version_id | tojson }};
         const CLEAR_ADJUST = {{ clear_adjust | tojson }};
+        const ASYNC_SAVE = {{ async_save | tojson }};
+        const ADJUST_VALUES = {{ adjust_values | tojson }};
         const STORAGE_PREFIX = 'stocktake_adjust_';
         function clearLocalAdjustStorage() {
             try {
@@ -2693,7 +3504,10 @@ def take_stock_page():
                 localStorage.setItem(STORAGE_PREFIX + SNAPSHOT_KEY, JSON.stringify(getAdjustmentsFromInputs()));
             } catch (e) {}
         }
+        // キャッシュ済み tbody にシート上の Adjust 値を重ねる
         document.querySelectorAll('.adjust-input').forEach(el => {
+            const v = ADJUST_VALUES[el.dataset.code];
+            if (v !== undefined) el.value = v;
             el.addEventListener('input', persistLocalAdjustments);
         });
         if (CLEAR_ADJUST) {
@@ -2702,6 +3516,40 @@ def take_stock_page():
         } else {
             restoreLocalAdjustments();
         }
+        function newIdempotencyKey() {
+            if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+            return Date.now().toString(16) + Math.random().toString(16).slice(2);
+        }
+        async function postAdjustments(adjustments, idempotencyKey) {
+            // 通信失敗時は同じ冪等キーで再送（サーバー側で重複版を作らない）
+            let lastError = null;
+            for (let attempt = 0; attempt < 3; attempt++) {
+                try {
+                    return await fetch(ASYNC_SAVE ? '/api/stocktake/adjust?async=1' : '/api/stocktake/adjust', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
+                        body: JSON.stringify({ adjustments, snapshot_key: SNAPSHOT_KEY })
+                    });
+                } catch (e) {
+                    lastError = e;
+                    await new Promise(function (r) { setTimeout(r, 800 * (attempt + 1)); });
+                }
+            }
+            throw lastError;
+        }
+        async function waitForJob(statusUrl) {
+            for (let i = 0; i < 90; i++) {
+                await new Promise(function (r) { setTimeout(r, 700); });
+                try {
+                    const res = await fetch(statusUrl);
+                    if (res.status === 404) break;
+                    const job = await res.json();
+                    if (job.status === 'done' || job.status === 'failed') return job;
+                } catch (e) {}
+            }
+            // 保存済みの可能性があるため失敗とは扱わない
+            return { status: 'unknown' };
+        }
         async function saveAdjustments() {
             if (READ_ONLY) return;
             const status = document.getElementById('status');
@@ -2709,14 +3557,20 @@ def take_stock_page():
             const adjustments = getAdjustmentsFromInputs();
             persistLocalAdjustments();
             try {
-                const res = await fetch('/api/stocktake/adjust', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ adjustments })
-                });
-                const data = await res.json();
+                const res = await postAdjustments(adjustments, newIdempotencyKey());
+                let data = await res.json();
+                if (res.status === 202 && data.status_url) {
+                    status.textContent = 'Queued / 排隊中...';
+                    const job = await waitForJob(data.status_url);
+                    if (job.status === 'unknown') {
+                        status.textContent = 'Save status unknown / 保存狀態未確認 — check history before saving again';
+                        status.style.color = '#e67e22';
+                        return;
+                    }
+                    data = { success: job.status === 'done', message: job.message, error: job.message, elapsed_ms: job.elapsed_ms };
+                }
                 if (res.ok && data.success) {
-                    status.textContent = 'Saved / 已保存 (' + (data.message || '') + ')';
+                    status.textContent = 'Saved / 已保存 (' + (data.message || '') + ', ' + data.elapsed_ms + ' ms)';
                     status.style.color = '#28a745';
                     // reload to show new history row (keep saved Adjust on sheet)
                     setTimeout(function () { window.location.href = '/take-stock'; }, 600);
@@ -2745,7 +3599,8 @@ def take_stock_page():
 </body>
 </html>
     ''', meta=meta, rows=rows, snapshot_key=snapshot_key, versions=versions,
-       read_only=read_only, version_id=version_id, clear_adjust=clear_adjust)
+       read_only=read_only, version_id=version_id, clear_adjust=clear_adjust,
+       table_body=table_body, adjust_values=adjust_values, async_save=STOCKTAKE_ASYNC_SAVE)
 
 
 @app.route('/api/stocktake')
@@ -2766,16 +3621,185 @@ def api_stocktake_version_detail(version_id):
     return jsonify(snapshot)
 
 
+@app.route('/api/stocktake/versions/<from_version_id>/diff/<to_version_id>')
+def api_stocktake_version_diff(from_version_id, to_version_id):
+    diff = platform.diff_stocktake_history_versions(from_version_id, to_version_id)
+    if diff.get('error'):
+        return jsonify(diff), 404
+    return jsonify(diff)
+
+
 @app.route('/api/stocktake/adjust', methods=['POST'])
 def api_stocktake_adjust():
+    started = time.perf_counter()
     payload = request.get_json(silent=True) or {}
     adjustments = payload.get('adjustments') or {}
     if not isinstance(adjustments, dict):
         return jsonify({'success': False, 'error': 'invalid adjustments'}), 400
-    ok, message, version_id = platform.save_stocktake_adjustments(adjustments)
+    snapshot_key = str(payload.get('snapshot_key') or '').strip() or None
+    wants_async = payload.get('async') or request.args.get('async') in ('1', 'true', 'yes')
+    # 画面は通信失敗時に同じキーで再送する（同期・非同期どちらの保存でも重複版を作らない）
+    idempotency_key = (
+        request.headers.get('Idempotency-Key') or str(payload.get('idempotency_key') or '')
+    ).strip()[:100] or None
+    if wants_async and STOCKTAKE_ASYNC_SAVE:
+        if not getattr(platform, 'sheets_write_service', None):
+            return jsonify({'success': False, 'error': 'write service unavailable'}), 503
+        job, created = stocktake_save_queue.submit(
+            adjustments, snapshot_key=snapshot_key, idempotency_key=idempotency_key
+        )
+        return jsonify({
+            'success': True,
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'duplicate': not created,
+            'status_url': f"/api/stocktake/jobs/{job['job_id']}",
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        }), 202
+    ok, message, version_id = platform.save_stocktake_adjustments(
+        adjustments, snapshot_key=snapshot_key, idempotency_key=idempotency_key
+    )
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
     if ok:
-        return jsonify({'success': True, 'message': message, 'version_id': version_id})
-    return jsonify({'success': False, 'error': message}), 503
+        return jsonify({'success': True, 'message': message, 'version_id': version_id, 'elapsed_ms': elapsed_ms})
+    return jsonify({'success': False, 'error': message, 'elapsed_ms': elapsed_ms}), 503
+
+
+@app.route('/api/stocktake/jobs/<job_id>')
+def api_stocktake_job(job_id):
+    job = stocktake_save_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job)
+
+
+def _bearer_matches(*tokens):
+    """Authorization: Bearer <token> が設定済みトークンのいずれかと一致するか（定数時間比較）"""
+    header = request.headers.get('Authorization', '').encode()
+    return any(token and hmac.compare_digest(header, f'Bearer {token}'.encode()) for token in tokens)
+
+
+def _check_sync_token(cron_only=False):
+    """Bearer トークン必須（INVENTORY_SYNC_TOKEN または CRON_SECRET。どちらも未設定なら常に拒否）
+
+    cron_only=True は外部 cron の GET 用で CRON_SECRET のみ受け付ける。
+    """
+    tokens = [os.environ.get('CRON_SECRET')]
+    if not cron_only:
+        tokens.append(os.environ.get('INVENTORY_SYNC_TOKEN'))
+    if not _bearer_matches(*tokens):
+        abort(401)
+
+
+@app.route('/api/sync/run', methods=['GET', 'POST'])
+def api_sync_run():
+    # シートへの書込・Gemini 利用を伴うため POST のみ。GET はプリフェッチ等を避けるため cron（CRON_SECRET）に限る
+    _check_sync_token(cron_only=request.method == 'GET')
+    sync = _inventory_sync_module()
+    if sync is None:
+        return jsonify({'success': False, 'error': 'inventory sync unavailable'}), 503
+    payload = request.get_json(silent=True) or {}
+
+    def flag(name):
+        return bool(payload.get(name)) or request.args.get(name) in ('1', 'true', 'yes')
+
+    if flag('scheduled'):
+        # 定時枠の判定・再トライは inventory_sync 側（checkScheduledTime 相当）
+        tick = sync.run_scheduled_sync_tick()
+        return jsonify({'success': True, **tick}), (202 if tick.get('started') else 200)
+    stock_mode = payload.get('stock_mode') or request.args.get('stock_mode') or None
+    run_id, future = sync.submit_inventory_sync(
+        trigger='manual', force=flag('force'), stock_mode=stock_mode, profile=flag('profile'),
+    )
+    if run_id is None:
+        return jsonify({'success': False, 'error': 'sync already running', 'status_url': '/api/sync/status'}), 409
+    if flag('wait'):
+        # サーバーレスでレスポンス後にスレッドが止まる環境向けに完了まで待つ
+        try:
+            return jsonify({'success': True, 'run_id': run_id, 'result': future.result()})
+        except Exception as e:
+            return jsonify({'success': False, 'run_id': run_id, 'error': str(e)}), 500
+    return jsonify({'success': True, 'run_id': run_id, 'status_url': '/api/sync/status'}), 202
+
+
+@app.route('/api/sync/status')
+def api_sync_status():
+    _check_sync_token()
+    sync = _inventory_sync_module()
+    if sync is None:
+        return jsonify({'error': 'inventory sync unavailable'}), 503
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 100))
+    except ValueError:
+        limit = 10
+    return jsonify(sync.get_sync_status(limit=limit))
+
+
+def _check_profile_token():
+    """プロファイル一覧・取得は管理者のみ（トークン未設定なら常に拒否）"""
+    if not _profile_authorized():
+        abort(401)
+
+
+@app.route('/api/profiles')
+def api_profiles():
+    """保存済みプロファイルの一覧（新しい順）"""
+    _check_profile_token()
+    directory = profile_dir()
+    entries = []
+    if os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.pstats'):
+                continue
+            stat = entry.stat()
+            profile_id = entry.name[:-len('.pstats')]
+            entries.append({
+                'profile_id': profile_id,
+                'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+                'bytes': stat.st_size,
+                'url': f'/api/profiles/{profile_id}',
+            })
+    entries.sort(key=lambda e: e['created_at'], reverse=True)
+    return jsonify({'profiles': entries})
+
+
+@app.route('/api/profiles/<profile_id>')
+def api_profile_download(profile_id):
+    """pstats のダウンロード（?format=text で累積時間順の上位を文字列で返す）"""
+    _check_profile_token()
+    if not is_profile_id(profile_id):
+        abort(404)
+    path = os.path.join(profile_dir(), profile_id + '.pstats')
+    if not os.path.isfile(path):
+        abort(404)
+    if request.args.get('format') == 'text':
+        import pstats
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'ncalls'):
+            sort = 'cumulative'
+        try:
+            limit = max(1, min(int(request.args.get('limit', 60)), 500))
+        except ValueError:
+            limit = 60
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+        return Response(out.getvalue(), mimetype='text/plain; charset=utf-8')
+    with open(path, 'rb') as f:
+        data = f.read()
+    return Response(
+        data,
+        mimetype='application/octet-stream',
+        headers={'Content-Disposition': f'attachment; filename="{profile_id}.pstats"'},
+    )
+
+
+@app.route('/api/metrics')
+def api_metrics():
+    """処理時間・Sheets 呼出数の集計（Prometheus text format）"""
+    lines = []
+    for metric in (REQUEST_DURATION, SPAN_DURATION, SHEETS_CALLS, SHEETS_CALLS_PER_REQUEST):
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/take-stock/export.csv')
@@ -2860,19 +3884,20 @@ def product_detail_by_code(product_code):
         return ' '.join(s.lower().split())
 
     norm_target = normalize(display_code)
-    for num, v in inventory_data.items():
-        code = v.get('code')
-        if normalize(code) == norm_target:
-            return redirect(f'/product/{num}')
-
-    # 部分一致（製品名）: 大文字小文字・全角半角・スペース差を緩く比較
-    needle = norm_target
-    matches = []
-    for num, v in inventory_data.items():
-        name = v.get('name', '')
-        code = v.get('code', '')
-        if needle and (needle in normalize(name) or needle in normalize(code)):
-            matches.append((num, v))
+    with _span('normalize'):
+        for num, v in inventory_data.items():
+            code = v.get('code')
+            if normalize(code) == norm_target:
+                return redirect(f'/product/{num}')
+
+        # 部分一致（製品名）: 大文字小文字・全角半角・スペース差を緩く比較
+        needle = norm_target
+        matches = []
+        for num, v in inventory_data.items():
+            name = v.get('name', '')
+            code = v.get('code', '')
+            if needle and (needle in normalize(name) or needle in normalize(code)):
+                matches.append((num, v))
 
     if len(matches) == 1:
         return redirect(f'/product/{matches[0][0]}')
@@ -2922,7 +3947,7 @@ def product_detail_by_code(product_code):
         logo_data = base64.b64decode(logo_base64)
         return logo_data, 200, {'Content-Type': 'image/png'}
     except Exception as e:
-        print(f"ロゴ読み込みエラー: {e}")
+        _log(logging.WARNING, 'ロゴ読み込みエラー', error=str(e))
         return "KIRII", 200, {'Content-Type': 'text/plain'}
 
 if __name__ == '__main__':
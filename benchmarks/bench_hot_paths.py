@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+在庫ページ系ホットパスのベンチマーク（合成シート 1k / 5k / 20k 行）
+
+Stock / InventorySummaryReport / StocktakeSnapshot / 盤點履歴の合成値を synthetic_sheets で生成し、
+_get_sheet_values と requests.get をスタブに差し替えて以下を計測する（認証情報・通信は不要）。
+
+- _fetch_from_google_sheets
+- index()（q/cat なし・q あり・cat あり、在庫キャッシュ有効時）
+- product_detail_by_code（完全一致・部分一致・該当なし）
+- take_stock_page（最新・履歴版）
+- CSV 出力（/take-stock/export.csv 最新・履歴版、/download-list）
+
+各回の前にアプリ内キャッシュ（在庫60秒・Adjust・盤點 tbody・履歴版）を消すので、
+_warm 以外はシート再読込を含むコールド計測。結果は JSON で標準出力へ。
+
+使い方: python benchmarks/bench_hot_paths.py [--rows 1000,5000,20000] [--repeat 5] [--only index,take_stock]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform as py_platform
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app  # noqa: E402
+
+from synthetic_sheets import HISTORY_VERSION_ID, SyntheticSheets, sheet_ranges, synthetic_codes  # noqa: E402
+
+
+def _reset_caches():
+    p = app.platform
+    p._inventory_cache = None
+    p._inventory_cache_at = 0.0
+    p._adjust_cache = None
+    p._adjust_cache_at = 0.0
+    p._stocktake_index_cache = None
+    p._history_version_cache.clear()
+    app._stocktake_table_body_cache.clear()
+
+
+def _cases(client, rows):
+    codes = synthetic_codes(rows)
+
+    def get(path, expect=200):
+        def run():
+            response = client.get(path)
+            if response.status_code != expect:
+                raise RuntimeError(f'{path}: HTTP {response.status_code}')
+            return len(response.get_data())
+        return run
+
+    return {
+        'fetch_from_google_sheets': lambda: len(app.platform._fetch_from_google_sheets()),
+        'index': get('/'),
+        'index_q': get('/?q=board'),
+        'index_cat': get('/?cat=AllBoard'),
+        'index_warm': (get('/'), False),
+        # 完全一致は末尾のコード（全件走査の最悪ケース）
+        'product_detail_by_code_exact': get(f'/product/code/{codes[-1]}', expect=302),
+        'product_detail_by_code_partial': get('/product/code/Marco'),
+        'product_detail_by_code_missing': get('/product/code/NO-SUCH-CODE', expect=404),
+        'take_stock': get('/take-stock'),
+        'take_stock_version': get(f'/take-stock?version={HISTORY_VERSION_ID}'),
+        'export_csv': get('/take-stock/export.csv'),
+        'export_csv_version': get(f'/take-stock/export.csv?version={HISTORY_VERSION_ID}'),
+        'download_list_csv': get('/download-list'),
+    }
+
+
+def _time(fn, repeat, sheets, cold):
+    timings = []
+    calls = 0
+    size = 0
+    for _ in range(repeat):
+        if cold:
+            _reset_caches()
+        before = sheets.calls
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            size = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        calls = sheets.calls - before
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'sheet_reads': calls,
+        'output_size': size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='1000,5000,20000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', default='', help='計測ケース名の接頭辞（カンマ区切り）')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.rows.split(',') if s.strip()]
+    only = [s.strip() for s in args.only.split(',') if s.strip()]
+
+    p = app.platform
+    p.use_google_sheets = True
+    p.credentials = None
+    p.api_key = 'bench'
+    client = app.app.test_client()
+    original_get = app.requests.get
+    original_values = p._get_sheet_values
+
+    results = {}
+    try:
+        for rows in sizes:
+            sheets = SyntheticSheets(sheet_ranges(rows))
+            p._get_sheet_values = sheets.get_values
+            app.requests.get = sheets.requests_get
+            results[str(rows)] = {}
+            for name, case in _cases(client, rows).items():
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                fn, cold = case if isinstance(case, tuple) else (case, True)
+                if not cold:
+                    _reset_caches()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        fn()
+                results[str(rows)][name] = _time(fn, args.repeat, sheets, cold)
+    finally:
+        app.requests.get = original_get
+        p._get_sheet_values = original_values
+        _reset_caches()
+
+    print(json.dumps({
+        'benchmark': 'hot_paths',
+        'python': py_platform.python_version(),
+        'repeat': args.repeat,
+        'rows': sizes,
+        'results': results,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+_extract_table_locally のベンチマーク
+（合成 7 ページ PDF、逐次 vs プロセスプール、表セル文字列化: pdfplumber の Table.extract vs _table_extract）
+
+使い方: python benchmarks/bench_pdf_extraction.py [--pages 7] [--rows 30] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import inventory_sync  # noqa: E402
+from synthetic_pdf import write_synthetic_report  # noqa: E402
+
+
+def _time_extract(pdf_path, workers, repeat, table_extract='bucketed'):
+    """table_extract='pdfplumber' なら _table_extract を Table.extract() に差し替えて計測（比較用）"""
+    os.environ['INVENTORY_PDF_WORKERS'] = str(workers)
+    original = inventory_sync._table_extract
+    if table_extract == 'pdfplumber':
+        inventory_sync._table_extract = lambda table: table.extract()
+    try:
+        timings = []
+        rows = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = inventory_sync._extract_table_locally(pdf_path)
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        inventory_sync._table_extract = original
+    return {
+        'workers': workers,
+        'table_extract': table_extract,
+        'rows': len(rows) - 1,
+        'median_ms': round(statistics.median(timings), 1),
+        'min_ms': round(min(timings), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=7)
+    parser.add_argument('--rows', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for grid in (True, False):
+            name = 'ruled' if grid else 'unruled'
+            pdf_path = write_synthetic_report(os.path.join(tmp, f'{name}.pdf'), args.pages, args.rows, grid)
+            results[name] = [
+                _time_extract(pdf_path, 1, args.repeat, 'pdfplumber'),
+                _time_extract(pdf_path, 1, args.repeat),
+            ]
+            parallel = min(os.cpu_count() or 1, args.pages)
+            if parallel > 1:
+                results[name].append(_time_extract(pdf_path, parallel, args.repeat))
+    print(json.dumps({
+        'benchmark': 'extract_table_locally',
+        'pages': args.pages,
+        'rows_per_page': args.rows,
+        'results': results,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+数量列の変換ベンチマーク（セル毎の _parse_sheet_quantity vs 列単位の _parse_quantity_columns）
+
+合成データ（既定 5000 行、数値・カンマ付き小数・空欄・#N/A・#REF! の混在、E列=D列）で、
+変換のみの比較（列単位は array + マスクのまま。呼出側も展開せずに使う）と、_fetch_inventory_summary_by_code / _fetch_from_google_sheets 全体の時間を計測する。
+シートへのアクセスはスタブに置き換えるので認証情報は不要。
+
+使い方: python benchmarks/bench_quantity_parse.py [--rows 5000] [--repeat 15]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_sheets import synthetic_quantity  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app  # noqa: E402
+
+
+def _summary_rows(n, rng):
+    # E列は同期処理と同じく Available（D列）の複製
+    rows = []
+    for i in range(n):
+        available = synthetic_quantity(rng)
+        rows.append([f'BD-{i:05d}', f'Synthetic item {i}', synthetic_quantity(rng), available, available])
+    return rows
+
+
+def _stock_values(n, rng):
+    header = [f'H{c}' for c in range(25)]
+    values = [header]
+    for i in range(n):
+        row = [str(i + 1), '', f'BD-{i:05d}', f'Synthetic item {i}', 'Board'] + [''] * 14
+        available = synthetic_quantity(rng)
+        row += ['0', synthetic_quantity(rng), available, available, '支', '2026-10-01']
+        values.append(row)
+    return values
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+    }
+
+
+class _StubResponse:
+    def __init__(self, values):
+        self._values = values
+
+    def raise_for_status(self):
+        return None
+
+    def json(self):
+        return {'values': self._values}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=15)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    platform = app.platform
+    summary_rows = _summary_rows(args.rows, rng)
+    stock_values = _stock_values(args.rows, rng)
+
+    def per_cell():
+        parse = platform._parse_sheet_quantity
+        return [
+            (parse(r[2] if len(r) > 2 else ''), parse(r[3] if len(r) > 3 else ''), parse(r[4] if len(r) > 4 else ''))
+            for r in summary_rows
+        ]
+
+    def columnar():
+        return platform._parse_quantity_columns(summary_rows, (2, 3, 4))
+
+    def expanded(cols):
+        return list(zip(*([None if m else v for v, m in zip(*cols[i])] for i in (2, 3, 4))))
+
+    assert per_cell() == expanded(columnar())
+
+    platform._get_sheet_values = lambda _range: summary_rows
+    platform.credentials = None
+    original_get = app.requests.get
+    app.requests.get = lambda *a, **kw: _StubResponse(stock_values)
+    try:
+        results = {
+            'parse_per_cell': _time(per_cell, args.repeat),
+            'parse_columnar': _time(columnar, args.repeat),
+            'fetch_inventory_summary_by_code': _time(platform._fetch_inventory_summary_by_code, args.repeat),
+            'fetch_from_google_sheets': _time(platform._fetch_from_google_sheets, args.repeat),
+        }
+    finally:
+        app.requests.get = original_get
+
+    print(json.dumps({
+        'benchmark': 'quantity_parse',
+        'rows': args.rows,
+        'columns': 3,
+        'results': results,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
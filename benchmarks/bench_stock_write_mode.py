@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Stock!I:K の書込方式（VLOOKUP 式 / 計算済み値）ごとの同期書込時間と Stock!A1:Y1500 読取レイテンシ比較
+
+各方式で本番と同じ _sheets_write_sync_batch（サマリーシート + Stock!I:K を updateCells で書く）を呼ぶ。
+サマリーは計測前に読んだ同じ内容を書き戻すので、方式間の差は Stock!I:K 部分だけになる。
+
+既定では Sheets API 代替サーバー（sheets_standin）をこのプロセス内で起動して計測する。
+代替サーバーは式を評価しないため、読取側の差（再計算・VLOOKUP のコスト）は実シートでしか測れない。
+代替サーバーで分かるのは書込の時間と送信量、Stock 読取の件数・サイズの差まで。
+
+実シートで測る場合はサマリーと Stock を書き換えるため、必ず検証用コピーの ID を BENCH_SPREADSHEET_ID に指定する
+（GOOGLE_SA_JSON または GOOGLE_SA_FILE も必要）。
+
+使い方: python benchmarks/bench_stock_write_mode.py [サマリーシート名] [--reads 10] [--seed-rows 1500]
+                                                  [--latency-ms 80] [--jitter-ms 40]
+
+代替サーバーでの計測例（Stock 1500 行・サマリー 1516 行、遅延 80±40ms、reads 10、3 回実行）:
+  formulas  書込 868〜897 ms（うち batchUpdate 541〜574 ms、Stock!I:K 送信 499 KB）  Stock 読取 中央値 126〜137 ms
+  values    書込 760〜912 ms（うち batchUpdate 521〜607 ms、Stock!I:K 送信 214 KB）  Stock 読取 中央値 134〜162 ms
+書込はシート情報・Stock!C:C 読取とサマリー 500 行毎の batchUpdate 4 回で遅延が支配的で、方式の差は誤差の範囲。
+送信量は values が式の約 4 割。読取の差も誤差の範囲（代替サーバーは式を評価しないため、再計算コストは実シートで要計測）。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import inventory_sync  # noqa: E402
+
+
+def _time_reads(service, spreadsheet_id, reads):
+    timings = []
+    for _ in range(reads):
+        started = time.perf_counter()
+        service.spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id, range='Stock!A1:Y1500'
+        ).execute()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 1),
+        'p90_ms': round(timings[max(0, int(len(timings) * 0.9) - 1)], 1),
+        'max_ms': round(timings[-1], 1),
+    }
+
+
+def _start_standin(seed_rows, latency_ms, jitter_ms):
+    """代替サーバーを起動して SHEETS_API_STANDIN_URL を設定"""
+    from werkzeug.serving import make_server
+
+    import sheets_standin
+    standin = sheets_standin.create_app(seed_rows, latency_ms, jitter_ms)
+    server = make_server('127.0.0.1', 0, standin, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['SHEETS_API_STANDIN_URL'] = f'http://127.0.0.1:{server.server_port}'
+    return server
+
+
+def _stock_payload_bytes(stock_sheet_id, stock_rows):
+    """batchUpdate に含まれる Stock!I:K の updateCells の JSON サイズ"""
+    return len(json.dumps(inventory_sync._update_cells_request(stock_sheet_id, 1, 8, stock_rows)))
+
+
+def _write(service, spreadsheet_id, title, summary_rows, mode):
+    timings = {}
+    started = time.perf_counter()
+    inventory_sync._sheets_write_sync_batch(service, spreadsheet_id, title, iter(summary_rows), mode, timings)
+    return round((time.perf_counter() - started) * 1000, 1), timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('summary_title', nargs='?', default='InventorySummaryReport')
+    parser.add_argument('--reads', type=int, default=10)
+    parser.add_argument('--seed-rows', type=int, default=1500, help='代替サーバーの合成行数')
+    parser.add_argument('--latency-ms', type=float, default=80.0, help='代替サーバーの応答遅延')
+    parser.add_argument('--jitter-ms', type=float, default=40.0)
+    args = parser.parse_args()
+
+    spreadsheet_id = os.environ.get('BENCH_SPREADSHEET_ID')
+    server = None
+    if spreadsheet_id:
+        os.environ.pop('SHEETS_API_STANDIN_URL', None)
+    else:
+        server = _start_standin(args.seed_rows, args.latency_ms, args.jitter_ms)
+        spreadsheet_id = 'standin'
+    os.environ['PQFORM_SHEET_ID'] = spreadsheet_id
+    service, spreadsheet_id = inventory_sync._ensure_sheets_service()
+
+    summary_rows = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id, range=f'{args.summary_title}!A1:E5000'
+    ).execute().get('values', [])
+
+    stock_codes = inventory_sync._sheets_read_stock_codes(service, spreadsheet_id)
+    last_row = inventory_sync._last_stock_row(stock_codes)
+    lookup = {}
+    for row in summary_rows[1:]:
+        inventory_sync._add_summary_lookup(lookup, row)
+    stock_sheet_id = next(
+        s['properties']['sheetId'] for s in service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()['sheets']
+        if s['properties']['title'] == 'Stock'
+    )
+    payloads = {
+        'formulas': _stock_payload_bytes(
+            stock_sheet_id, inventory_sync._stock_formula_rows(args.summary_title, last_row)),
+        'values': _stock_payload_bytes(
+            stock_sheet_id, inventory_sync._stock_values_from_lookup(stock_codes, lookup)),
+    }
+
+    results = {}
+    for mode in ('formulas', 'values'):
+        write_ms, timings = _write(service, spreadsheet_id, args.summary_title, summary_rows, mode)
+        results[mode] = {
+            'write_ms': write_ms,
+            'sync_timings': timings,
+            'stock_payload_bytes': payloads[mode],
+            'stock_read': _time_reads(service, spreadsheet_id, args.reads),
+        }
+
+    # 既定の式モードに戻しておく
+    _write(service, spreadsheet_id, args.summary_title, summary_rows, 'formulas')
+    if server is not None:
+        server.shutdown()
+    print(json.dumps({
+        'benchmark': 'stock_write_mode',
+        'target': 'spreadsheet' if server is None else 'standin',
+        'stock_rows': last_row - 1,
+        'summary_rows': len(summary_rows),
+        'reads': args.reads,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+inventory_sync の IMAP 取得経路を IMAP 代替サーバー（imap_standin）に対して検証・計測する
+
+_find_latest_inventory_pdf_from_gmail を実際に呼び、次を確認して JSON で出力する:
+
+  - 最新 inventory メールの PDF パートだけを取得し、デコード結果が元 PDF とバイト一致する
+    （入れ子 multipart・引用符/バックスラッシュ入りファイル名・base64 / quoted-printable・
+      8bit ファイル名のリテラル・部分 FETCH の境界が 4 の倍数でない場合を含む）
+  - SUBJECT/SINCE 検索と X-GM-RAW 検索（--gmail 相当）の両方
+  - カーソル指定時: 新着なし → 空パス、新着 inventory → そのメールを取得、UIDVALIDITY 変更 → 全件から再検索
+
+各シナリオのコマンド件数・送信バイト数と、従来方式（最新100通の RFC822 全体取得）の推定バイト数も出す。
+
+使い方: python benchmarks/imap_check.py [--filler 200] [--pdf-pages 7]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from imap_standin import ImapStandin, Mailbox, build_message, seed_mailbox  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import inventory_sync  # noqa: E402
+
+
+class _Server:
+    def __init__(self, mailbox, gmail):
+        self.server = ImapStandin(('127.0.0.1', 0), mailbox, gmail=gmail)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        os.environ['IMAP_STANDIN_ADDR'] = f'127.0.0.1:{self.server.server_address[1]}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _fetch(server, cursor=None, chunk_bytes=None):
+    """(PDF バイト列 or None, カーソル, 統計) を返す。一時ファイルは削除する"""
+    if chunk_bytes:
+        os.environ['INVENTORY_IMAP_CHUNK_BYTES'] = str(chunk_bytes)
+    else:
+        os.environ.pop('INVENTORY_IMAP_CHUNK_BYTES', None)
+    server.stats.clear()
+    path, new_cursor = inventory_sync._find_latest_inventory_pdf_from_gmail(cursor)
+    data = None
+    if path:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.unlink(path)
+    stats = dict(server.stats)
+    return data, new_cursor, {
+        'commands': {k: v for k, v in stats.items() if k != 'bytes_sent'},
+        'bytes_sent': stats.get('bytes_sent', 0),
+    }
+
+
+def _legacy_bytes(mailbox):
+    """従来方式（SEARCH ALL → 最新100通を RFC822 で取得）の推定受信バイト数"""
+    return sum(len(m['raw']) for m in mailbox.messages[-100:])
+
+
+def _scenario(name, ok, **extra):
+    return {'scenario': name, 'ok': bool(ok), **extra}
+
+
+def run(filler, pdf_pages):
+    os.environ.setdefault('GMAIL_ADDRESS', 'standin@example.com')
+    os.environ.setdefault('GMAIL_APP_PASSWORD', 'standin')
+    os.environ.pop('TEST_PDF_PATH', None)
+    results = []
+
+    for gmail in (False, True):
+        for chunk in (None, 1000):
+            mailbox = Mailbox(uidvalidity=7)
+            expected = seed_mailbox(mailbox, filler=filler, pdf_pages=pdf_pages)
+            server = _Server(mailbox, gmail)
+            try:
+                data, cursor, stats = _fetch(server.server, chunk_bytes=chunk)
+            finally:
+                server.close()
+            results.append(_scenario(
+                f"latest_pdf{'_gmail' if gmail else ''}{f'_chunk{chunk}' if chunk else ''}",
+                data == expected['pdf'] and cursor == {'uidvalidity': '7', 'uid': str(expected['uid'])},
+                pdf_bytes=len(data or b''), cursor=cursor, legacy_bytes=_legacy_bytes(mailbox), **stats,
+            ))
+
+    # カーソル: 新着なし → 新着 inventory（quoted-printable・8bit ファイル名・octet-stream）→ UIDVALIDITY 変更
+    mailbox = Mailbox(uidvalidity=7)
+    expected = seed_mailbox(mailbox, filler=filler, pdf_pages=pdf_pages)
+    server = _Server(mailbox, gmail=False)
+    try:
+        _, cursor, _ = _fetch(server.server)
+        data, same_cursor, stats = _fetch(server.server, cursor)
+        results.append(_scenario('cursor_no_new_mail', data is None and same_cursor == cursor, **stats))
+
+        now = datetime.now(timezone.utc)
+        new_pdf = expected['pdf'].replace(b'Synthetic item', b'Synthetic ITEM')
+        new_uid = mailbox.add(build_message(
+            'Inventory Summary Report 新', now,
+            [('在庫レポート.pdf', 'application', 'octet-stream', new_pdf, 'quoted-printable')],
+        ), now)
+        data, next_cursor, stats = _fetch(server.server, cursor, chunk_bytes=777)
+        results.append(_scenario(
+            'cursor_new_inventory_mail',
+            data == new_pdf and next_cursor.get('uid') == str(new_uid), **stats,
+        ))
+
+        mailbox.add(build_message('Newsletter late', now + timedelta(minutes=1)), now)
+        data, after_cursor, stats = _fetch(server.server, next_cursor)
+        results.append(_scenario(
+            'cursor_new_non_inventory_mail', data is None and after_cursor == next_cursor, **stats,
+        ))
+
+        mailbox.reset_uidvalidity(8)
+        data, reset_cursor, stats = _fetch(server.server, next_cursor)
+        results.append(_scenario(
+            'cursor_uidvalidity_changed', data == new_pdf and reset_cursor.get('uidvalidity') == '8', **stats,
+        ))
+    finally:
+        server.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filler', type=int, default=200)
+    parser.add_argument('--pdf-pages', type=int, default=7)
+    args = parser.parse_args()
+
+    results = run(args.filler, args.pdf_pages)
+    print(json.dumps({
+        'benchmark': 'imap_check',
+        'filler': args.filler,
+        'ok': all(r['ok'] for r in results),
+        'results': results,
+    }, ensure_ascii=False, indent=2))
+    if not all(r['ok'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
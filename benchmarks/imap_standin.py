@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Gmail IMAP のローカル代替サーバー（inventory_sync の IMAP 経路の検証用、平文・認証なし）
+
+inventory_sync が使うコマンドだけを実装する:
+  CAPABILITY / LOGIN / SELECT / EXAMINE / NOOP / LOGOUT
+  UID SEARCH   UID a:b / a:* ・SUBJECT ・SINCE ・ALL ・X-GM-RAW（--gmail 時のみ。subject: filename: newer_than:）
+  UID FETCH    UID / BODYSTRUCTURE / RFC822 / BODY[.PEEK][HEADER.FIELDS (...)] / BODY[.PEEK][<part>]<offset.length>
+
+ヘッダ・本文はリテラル {n} で返し、BODYSTRUCTURE の文字列は引用符付き（\\" \\\\ エスケープあり）、
+8bit を含む文字列はリテラルで返す。"n:*" は該当が無くても最大 UID を返す（RFC 3501 の挙動）。
+
+統計（コマンド別件数・送信バイト数）は ImapStandin.stats に入る。
+
+アプリ側は IMAP_STANDIN_ADDR=127.0.0.1:8993 を指定する（GMAIL_ADDRESS / GMAIL_APP_PASSWORD は任意の値）。
+
+使い方: python benchmarks/imap_standin.py [--port 8993] [--filler 200] [--pdf-pages 7] [--gmail]
+"""
+
+import argparse
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email import message_from_bytes, policy
+from email.header import decode_header, make_header
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_pdf import write_synthetic_report  # noqa: E402
+
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _quote(value) -> bytes:
+    """IMAP 文字列。8bit・改行を含む場合はリテラル"""
+    if value is None:
+        return b'NIL'
+    raw = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    if any(b > 0x7e for b in raw) or b'\r' in raw or b'\n' in raw:
+        return b'{%d}\r\n' % len(raw) + raw
+    return b'"' + raw.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def _params(pairs) -> bytes:
+    if not pairs:
+        return b'NIL'
+    return b'(' + b' '.join(_quote(k.upper()) + b' ' + _quote(v) for k, v in pairs) + b')'
+
+
+def _raw_params(part, header: str) -> list:
+    """RFC 2231 等をデコードしたパラメータ（値は str）"""
+    out = []
+    for key, value in part.get_params(header=header)[1:] if part.get(header) else []:
+        if isinstance(value, tuple):
+            value = value[2].encode('latin-1').decode(value[0] or 'utf-8', 'replace') if value[0] else value[2]
+        out.append((key, value))
+    return out
+
+
+def _body_structure(part) -> bytes:
+    if part.is_multipart():
+        children = b''.join(_body_structure(child) for child in part.get_payload())
+        return (b'(' + children + b' ' + _quote(part.get_content_subtype().upper()) + b' '
+                + _params(_raw_params(part, 'content-type')) + b' NIL NIL NIL)')
+    payload = _part_body(part)
+    maintype, subtype = part.get_content_maintype(), part.get_content_subtype()
+    encoding = (part.get('Content-Transfer-Encoding') or '7BIT').upper()
+    fields = [
+        _quote(maintype.upper()), _quote(subtype.upper()),
+        _params(_raw_params(part, 'content-type')),
+        _quote(part.get('Content-ID')), b'NIL', _quote(encoding), str(len(payload)).encode(),
+    ]
+    if maintype == 'text':
+        fields.append(str(payload.count(b'\n')).encode())
+    fields.append(b'NIL')  # MD5
+    disposition = part.get_content_disposition()
+    if disposition:
+        fields.append(b'(' + _quote(disposition.upper()) + b' '
+                      + _params(_raw_params(part, 'content-disposition')) + b')')
+    else:
+        fields.append(b'NIL')
+    fields.append(b'NIL')  # language
+    return b'(' + b' '.join(fields) + b')'
+
+
+def _part_body(part) -> bytes:
+    """パートの転送エンコード済み本文（BODY[n] で返す内容）"""
+    raw = part.as_bytes(policy=policy.SMTP)
+    sep = raw.find(b'\r\n\r\n')
+    return raw[sep + 4:] if sep >= 0 else b''
+
+
+def _find_part(msg, part_id: str):
+    part = msg
+    for index in part_id.split('.'):
+        if not part.is_multipart():
+            if index != '1':
+                return None
+            continue
+        children = part.get_payload()
+        i = int(index) - 1
+        if i < 0 or i >= len(children):
+            return None
+        part = children[i]
+    return part
+
+
+def _decoded_subject(msg) -> str:
+    try:
+        return str(make_header(decode_header(msg.get('Subject') or '')))
+    except Exception:
+        return msg.get('Subject') or ''
+
+
+class Mailbox:
+    """INBOX 1つ分のメール（UID 昇順）"""
+
+    def __init__(self, uidvalidity: int = 1):
+        self.lock = threading.Lock()
+        self.uidvalidity = uidvalidity
+        self.messages: List[dict] = []
+        self.next_uid = 1
+
+    def add(self, raw: bytes, internal_date: datetime) -> int:
+        with self.lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages.append({
+                'uid': uid,
+                'raw': raw,
+                'msg': message_from_bytes(raw, policy=policy.SMTP),
+                'date': internal_date,
+            })
+            return uid
+
+    def reset_uidvalidity(self, uidvalidity: int) -> None:
+        """UIDVALIDITY の変更（メールボックス再作成相当）。UID は振り直す"""
+        with self.lock:
+            self.uidvalidity = uidvalidity
+            for i, m in enumerate(self.messages):
+                m['uid'] = 1000 + i
+            self.next_uid = 1000 + len(self.messages)
+
+
+def build_message(subject: str, sent_at: datetime, attachments=(), nested: bool = False) -> bytes:
+    """attachments: [(filename, maintype, subtype, data, cte)]。nested=True で multipart/alternative を入れ子にする"""
+    msg = EmailMessage(policy=policy.SMTP)
+    msg['From'] = 'report@example.com'
+    msg['To'] = 'warehouse@example.com'
+    msg['Subject'] = subject
+    msg['Date'] = format_datetime(sent_at)
+    msg.set_content('Please find the report attached.\n')
+    if nested:
+        msg.add_alternative('<p>Please find the report attached.</p>', subtype='html')
+    for filename, maintype, subtype, data, cte in attachments:
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename, cte=cte)
+    return msg.as_bytes()
+
+
+def seed_mailbox(mailbox: Mailbox, filler: int = 200, pdf_pages: int = 7, now: datetime = None) -> dict:
+    """
+    雑多なメール + inventory メールを投入し、最新 inventory PDF の期待値を返す。
+    期待値: {'uid', 'pdf'（デコード後バイト列）, 'filename'}
+    """
+    now = now or datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = write_synthetic_report(os.path.join(tmp, 'report.pdf'), pages=pdf_pages)
+        with open(pdf_path, 'rb') as f:
+            pdf = f.read()
+    image = bytes(range(256)) * 64
+    for i in range(filler):
+        sent_at = now - timedelta(days=60) + timedelta(hours=i * 6)
+        attachments = [('photo.jpg', 'image', 'jpeg', image, 'base64')] if i % 5 == 0 else []
+        # 件名だけ一致して PDF が無いもの・古い inventory PDF（検索範囲外）も混ぜる
+        if i % 40 == 7:
+            subject = f'Re: inventory question #{i}'
+        elif i == 3:
+            subject = 'Inventory Summary Report (old)'
+            attachments = [('old.pdf', 'application', 'pdf', pdf[:-10] + b'%%EOF\n', 'base64')]
+        else:
+            subject = f'Newsletter {i}'
+        mailbox.add(build_message(subject, sent_at, attachments), sent_at)
+
+    older = now - timedelta(hours=5)
+    mailbox.add(build_message(
+        '=?UTF-8?B?5Zyo5bqr?= Inventory Summary Report', older,
+        [('Inventory "A".pdf', 'application', 'pdf', pdf[::-1], 'quoted-printable')],
+    ), older)
+    latest = now - timedelta(hours=2)
+    uid = mailbox.add(build_message(
+        'FW: Inventory Summary Report', latest,
+        [('summary.xlsx', 'application', 'octet-stream', b'PK\x03\x04' * 1000, 'base64'),
+         ('Inventory "Summary" \\ 2026.pdf', 'application', 'pdf', pdf, 'base64')],
+        nested=True,
+    ), latest)
+    # 最新メールは inventory 以外
+    newest = now - timedelta(hours=1)
+    mailbox.add(build_message('Lunch menu', newest), newest)
+    return {'uid': uid, 'pdf': pdf, 'filename': 'Inventory "Summary" \\ 2026.pdf'}
+
+
+def _parse_args(text: str) -> List[str]:
+    """コマンド引数（atom / "quoted" / (list) / [節] を1語として扱う）"""
+    args, i, n = [], 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == ' ':
+            i += 1
+        elif c == '"':
+            j, buf = i + 1, []
+            while j < n and text[j] != '"':
+                if text[j] == '\\':
+                    j += 1
+                buf.append(text[j])
+                j += 1
+            args.append(''.join(buf))
+            i = j + 1
+        else:
+            j, depth = i, 0
+            while j < n and (depth or text[j] != ' '):
+                if text[j] in '([':
+                    depth += 1
+                elif text[j] in ')]':
+                    depth -= 1
+                j += 1
+            args.append(text[i:j])
+            i = j
+    return args
+
+
+def _parse_uid_set(text: str, max_uid: int) -> List[tuple]:
+    ranges = []
+    for part in text.split(','):
+        lo, _, hi = part.partition(':')
+        lo_v = max_uid if lo == '*' else int(lo)
+        hi_v = lo_v if not hi else (max_uid if hi == '*' else int(hi))
+        ranges.append((min(lo_v, hi_v), max(lo_v, hi_v)))
+    return ranges
+
+
+def _has_pdf(msg) -> bool:
+    for part in msg.walk():
+        filename = part.get_filename() or ''
+        if part.get_content_type() == 'application/pdf' or filename.lower().endswith('.pdf'):
+            return True
+    return False
+
+
+_FETCH_ITEM = re.compile(
+    r'BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|UID|BODYSTRUCTURE|RFC822\.SIZE|RFC822|INTERNALDATE|FLAGS',
+    re.I,
+)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def send(self, data: bytes) -> None:
+        self.wfile.write(data)
+        self.server.count('bytes_sent', len(data))
+
+    def handle(self):
+        standin = self.server
+        self.send(b'* OK IMAP4rev1 stand-in ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            text = line.decode('utf-8', 'replace').rstrip('\r\n')
+            tag, _, rest = text.partition(' ')
+            command, _, arg_text = rest.partition(' ')
+            command = command.upper()
+            if command == 'UID':
+                sub, _, arg_text = arg_text.partition(' ')
+                command = f'UID {sub.upper()}'
+            standin.count(command)
+            handler = {
+                'CAPABILITY': self.cmd_capability, 'LOGIN': self.cmd_ok, 'NOOP': self.cmd_ok,
+                'SELECT': self.cmd_select, 'EXAMINE': self.cmd_select,
+                'UID SEARCH': self.cmd_search, 'UID FETCH': self.cmd_fetch,
+            }.get(command)
+            if command == 'LOGOUT':
+                self.send(b'* BYE stand-in logging out\r\n' + tag.encode() + b' OK LOGOUT completed\r\n')
+                return
+            if handler is None:
+                self.send(tag.encode() + b' BAD unsupported command\r\n')
+                continue
+            try:
+                handler(tag.encode(), arg_text)
+            except Exception as e:  # 解析できない引数は BAD
+                self.send(tag.encode() + b' BAD ' + str(e).encode('utf-8', 'replace') + b'\r\n')
+
+    def cmd_ok(self, tag, _args):
+        self.send(tag + b' OK completed\r\n')
+
+    def cmd_capability(self, tag, _args):
+        caps = b'IMAP4rev1' + (b' X-GM-EXT-1' if self.server.gmail else b'')
+        self.send(b'* CAPABILITY ' + caps + b'\r\n' + tag + b' OK CAPABILITY completed\r\n')
+
+    def cmd_select(self, tag, _args):
+        box = self.server.mailbox
+        with box.lock:
+            self.send(
+                b'* FLAGS (\\Seen)\r\n'
+                + b'* %d EXISTS\r\n' % len(box.messages)
+                + b'* OK [UIDVALIDITY %d] UIDs valid\r\n' % box.uidvalidity
+                + b'* OK [UIDNEXT %d] Predicted next UID\r\n' % box.next_uid
+                + tag + b' OK [READ-ONLY] completed\r\n'
+            )
+
+    def cmd_search(self, tag, arg_text):
+        box = self.server.mailbox
+        args = _parse_args(arg_text)
+        with box.lock:
+            messages = list(box.messages)
+        max_uid = messages[-1]['uid'] if messages else 0
+        now = datetime.now(timezone.utc)
+        hits = messages
+        i = 0
+        while i < len(args):
+            key = args[i].upper()
+            if key == 'ALL':
+                i += 1
+            elif key == 'UID':
+                ranges = _parse_uid_set(args[i + 1], max_uid)
+                hits = [m for m in hits if any(lo <= m['uid'] <= hi for lo, hi in ranges)]
+                i += 2
+            elif key == 'SUBJECT':
+                word = args[i + 1].lower()
+                hits = [m for m in hits if word in _decoded_subject(m['msg']).lower()]
+                i += 2
+            elif key == 'SINCE':
+                day, mon, year = args[i + 1].split('-')
+                since = datetime(int(year), _MONTHS.index(mon.title()) + 1, int(day), tzinfo=timezone.utc)
+                hits = [m for m in hits if m['date'] >= since]
+                i += 2
+            elif key == 'X-GM-RAW' and self.server.gmail:
+                for term in args[i + 1].split():
+                    name, _, value = term.partition(':')
+                    if name == 'subject':
+                        hits = [m for m in hits if value.lower() in _decoded_subject(m['msg']).lower()]
+                    elif name == 'filename' and value.lower() == 'pdf':
+                        hits = [m for m in hits if _has_pdf(m['msg'])]
+                    elif name == 'newer_than' and value.endswith('d'):
+                        cutoff = now - timedelta(days=int(value[:-1]))
+                        hits = [m for m in hits if m['date'] >= cutoff]
+                    else:
+                        raise ValueError(f'unsupported X-GM-RAW term {term}')
+                i += 2
+            else:
+                raise ValueError(f'unsupported search key {key}')
+        self.send(b'* SEARCH' + b''.join(b' %d' % m['uid'] for m in hits) + b'\r\n' + tag + b' OK SEARCH completed\r\n')
+
+    def cmd_fetch(self, tag, arg_text):
+        box = self.server.mailbox
+        uid_set, _, items = arg_text.partition(' ')
+        with box.lock:
+            messages = list(box.messages)
+        max_uid = messages[-1]['uid'] if messages else 0
+        ranges = _parse_uid_set(uid_set, max_uid)
+        wanted = [m.group(0) for m in _FETCH_ITEM.finditer(items.strip()[1:-1] if items.startswith('(') else items)]
+        if not wanted:
+            raise ValueError('no fetch items')
+        out = b''
+        for seq, m in enumerate(messages, start=1):
+            if not any(lo <= m['uid'] <= hi for lo, hi in ranges):
+                continue
+            parts = [b'UID %d' % m['uid']]
+            for item in wanted:
+                parts.append(self._fetch_item(m, item))
+            out += b'* %d FETCH (' % seq + b' '.join(p for p in parts if p) + b')\r\n'
+        self.send(out + tag + b' OK FETCH completed\r\n')
+
+    def _fetch_item(self, m, item: str) -> bytes:
+        upper = item.upper()
+        if upper == 'UID':
+            return b''
+        if upper == 'BODYSTRUCTURE':
+            return b'BODYSTRUCTURE ' + _body_structure(m['msg'])
+        if upper == 'RFC822':
+            return b'RFC822 {%d}\r\n' % len(m['raw']) + m['raw']
+        if upper == 'RFC822.SIZE':
+            return b'RFC822.SIZE %d' % len(m['raw'])
+        if upper == 'INTERNALDATE':
+            return b'INTERNALDATE "' + m['date'].strftime('%d-%b-%Y %H:%M:%S +0000').encode() + b'"'
+        if upper == 'FLAGS':
+            return b'FLAGS (\\Seen)'
+        match = _FETCH_ITEM.fullmatch(item)
+        section, offset, length = match.group(1), match.group(2), match.group(3)
+        if section.upper().startswith('HEADER.FIELDS'):
+            names = section[section.index('(') + 1:section.rindex(')')].split()
+            data = b''.join(
+                f'{name}: {m["msg"][name]}\r\n'.encode('utf-8') for name in
+                (n.title() for n in names) if m['msg'][name] is not None
+            ) + b'\r\n'
+        elif section == '':
+            data = m['raw']
+        else:
+            part = _find_part(m['msg'], section)
+            data = _part_body(part) if part is not None else b''
+        name = f'BODY[{section}]'.encode()
+        if offset is not None:
+            start = int(offset)
+            data = data[start:start + int(length)]
+            name += b'<%d>' % start
+        return name + b' {%d}\r\n' % len(data) + data
+
+
+class ImapStandin(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, mailbox: Mailbox, gmail: bool = False):
+        super().__init__(address, _Handler)
+        self.mailbox = mailbox
+        self.gmail = gmail
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8993)
+    parser.add_argument('--filler', type=int, default=200, help='inventory 以外のメール件数')
+    parser.add_argument('--pdf-pages', type=int, default=7)
+    parser.add_argument('--gmail', action='store_true', help='X-GM-EXT-1 を広告して X-GM-RAW 検索を受け付ける')
+    args = parser.parse_args()
+
+    mailbox = Mailbox()
+    expected = seed_mailbox(mailbox, filler=args.filler, pdf_pages=args.pdf_pages)
+    server = ImapStandin((args.host, args.port), mailbox, gmail=args.gmail)
+    print(f"🧪 IMAP 代替サーバー: {args.host}:{args.port} （{len(mailbox.messages)}通、最新 inventory UID {expected['uid']}）")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+負荷試験ドライバー（同時に使われるハンディ端末の QR スキャン・盤點保存を再現）
+
+--users 台の端末をスレッドで動かし、各端末は think 時間（指数分布、平均 --think-ms）を挟みながら
+--mix の重みで次の操作を繰り返す:
+
+  scan     GET /product/<n>（QR スキャン後の製品ページ）
+  cat      GET /?cat=<カテゴリ>
+  q        GET /?q=<キーワード>
+  poll     GET /api/inventory
+  adjust   POST /api/stocktake/adjust（--adjust-async で非同期ジョブ）
+
+結果は操作別の p50/p95/p99・最大・件数・エラー数とスループットを JSON で出力する。
+--standin-url を指定すると Sheets API 代替サーバー（benchmarks/sheets_standin.py）の統計から
+「1リクエストあたりの Sheets 呼出数」を全体と操作別（負荷前に1件ずつ直列で計測）で出す。
+
+例:
+  python benchmarks/sheets_standin.py --seed-rows 1500 &
+  SHEETS_API_STANDIN_URL=http://127.0.0.1:8765 python app.py &
+  python benchmarks/load_test.py --base-url http://127.0.0.1:5000 --standin-url http://127.0.0.1:8765 \\
+      --users 20 --duration 60
+
+--serve を付けると app.py をこのプロセス内のスレッドサーバーで起動して試験する
+（SHEETS_API_STANDIN_URL は環境変数で指定しておく）。
+
+adjust は試験対象のシートの StocktakeSnapshot・盤點履歴へ実際に書き込むため、--mix に adjust を含む場合は
+--standin-url（代替サーバー相手の試験）か --allow-writes（書き込んでよいシートであることを明示）が必要。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+DEFAULT_MIX = 'scan=50,cat=10,q=10,poll=20,adjust=5'
+QUERIES = ['board', 'bd-06', 'screw', 'marco', 'fc-0', 'hanger']
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[rank], 1)
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {'scan', 'cat', 'q', 'poll', 'adjust'}
+    if unknown:
+        raise SystemExit(f'未知の操作: {", ".join(sorted(unknown))}')
+    return mix
+
+
+class Workload:
+    """試験対象から製品番号・カテゴリ・盤點コードを取得し、操作を組み立てる"""
+
+    def __init__(self, base_url, adjust_async):
+        self.base_url = base_url.rstrip('/')
+        self.adjust_async = adjust_async
+        inventory = requests.get(f'{self.base_url}/api/inventory', timeout=120).json()
+        self.numbers = [int(n) for n in inventory]
+        self.categories = sorted({v.get('category') for v in inventory.values() if v.get('category')})
+        self.categories.append('AllBoard')
+        snapshot = requests.get(f'{self.base_url}/api/stocktake', timeout=120).json()
+        meta = snapshot.get('meta') or {}
+        # app.KiriiInventoryPlatform.stocktake_snapshot_key と同じ形式
+        self.snapshot_key = (
+            f"{meta.get('report_date', '')}_{meta.get('report_time', '')}_"
+            f"{meta.get('source_email_at', '') or meta.get('saved_at', '')}_"
+            f"{meta.get('product_count', '')}_{meta.get('script_version', '')}"
+        )
+        self.stocktake_codes = [
+            r['product_code'] for r in snapshot.get('rows', [])
+            if r.get('row_type') == 'product' and r.get('product_code')
+        ]
+        if not self.numbers:
+            raise SystemExit('在庫データが空です（Sheets 接続・代替サーバーを確認してください）')
+
+    def request(self, action, rng):
+        """(method, url, kwargs) を返す"""
+        if action == 'scan':
+            return 'GET', f'{self.base_url}/product/{rng.choice(self.numbers)}', {}
+        if action == 'cat':
+            return 'GET', f'{self.base_url}/', {'params': {'cat': rng.choice(self.categories)}}
+        if action == 'q':
+            return 'GET', f'{self.base_url}/', {'params': {'q': rng.choice(QUERIES)}}
+        if action == 'poll':
+            return 'GET', f'{self.base_url}/api/inventory', {}
+        codes = rng.sample(self.stocktake_codes, k=min(len(self.stocktake_codes), rng.randint(1, 3)))
+        payload = {
+            'adjustments': {code: str(rng.randint(-5, 5)) for code in codes},
+            'snapshot_key': self.snapshot_key,
+        }
+        if self.adjust_async:
+            payload['async'] = True
+        return 'POST', f'{self.base_url}/api/stocktake/adjust', {'json': payload}
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, action, status, elapsed_ms):
+        with self.lock:
+            self.latencies[action].append(elapsed_ms)
+            self.statuses[action][str(status)] += 1
+            if status is None or status >= 400:
+                self.errors[action] += 1
+
+    def summary(self, wall_seconds):
+        out = {}
+        total = 0
+        for action, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total += len(values)
+            out[action] = {
+                'count': len(values),
+                'errors': self.errors[action],
+                'statuses': dict(self.statuses[action]),
+                'p50_ms': _percentile(values, 50),
+                'p95_ms': _percentile(values, 95),
+                'p99_ms': _percentile(values, 99),
+                'max_ms': round(values[-1], 1),
+                'rps': round(len(values) / wall_seconds, 2),
+            }
+        every = sorted(v for values in self.latencies.values() for v in values)
+        out['all'] = {
+            'count': total,
+            'errors': sum(self.errors.values()),
+            'p50_ms': _percentile(every, 50),
+            'p95_ms': _percentile(every, 95),
+            'p99_ms': _percentile(every, 99),
+            'rps': round(total / wall_seconds, 2),
+        }
+        return out
+
+
+def _standin_stats(standin_url):
+    return requests.get(f'{standin_url}/__standin/stats', timeout=10).json()
+
+
+def _sheets_calls_per_action(workload, standin_url, actions):
+    """操作別の Sheets 呼出数（1回目=キャッシュ無効時を含む、2回目=直後の再実行）を直列で計測"""
+    rng = random.Random(0)
+    session = requests.Session()
+    out = {}
+    for action in actions:
+        counts = []
+        for _ in range(2):
+            before = _standin_stats(standin_url)['total_calls']
+            method, url, kwargs = workload.request(action, rng)
+            session.request(method, url, timeout=120, **kwargs)
+            if action == 'adjust' and workload.adjust_async:
+                # 非同期保存はワーカーの書込完了まで少し待つ
+                time.sleep(1.0)
+            counts.append(_standin_stats(standin_url)['total_calls'] - before)
+        out[action] = {'first': counts[0], 'repeat': counts[1]}
+    return out
+
+
+def _user_loop(workload, mix, recorder, stop_at, think_ms, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    actions, weights = list(mix), list(mix.values())
+    while time.time() < stop_at:
+        action = rng.choices(actions, weights)[0]
+        method, url, kwargs = workload.request(action, rng)
+        started = time.perf_counter()
+        try:
+            status = session.request(method, url, timeout=120, allow_redirects=False, **kwargs).status_code
+        except requests.RequestException:
+            status = None
+        recorder.add(action, status, (time.perf_counter() - started) * 1000)
+        if think_ms > 0:
+            time.sleep(min(rng.expovariate(1000 / think_ms), max(0.0, stop_at - time.time())))
+
+
+def _serve_in_process():
+    from werkzeug.serving import make_server
+
+    import app
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-app', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def _run(args, mix, base_url, standin_url):
+    workload = Workload(base_url, args.adjust_async)
+    per_action_calls = None
+    if standin_url:
+        per_action_calls = _sheets_calls_per_action(workload, standin_url, list(mix))
+        requests.post(f'{standin_url}/__standin/reset', timeout=10)
+
+    recorder = Recorder()
+    started = time.time()
+    stop_at = started + args.ramp_up + args.duration
+    threads = []
+    for i in range(args.users):
+        thread = threading.Thread(
+            target=_user_loop,
+            args=(workload, mix, recorder, stop_at, args.think_ms, args.seed + i),
+            name=f'handheld-{i}', daemon=True,
+        )
+        threads.append(thread)
+        thread.start()
+        if args.users > 1:
+            time.sleep(args.ramp_up / args.users)
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.time() - started
+
+    latency = recorder.summary(wall_seconds)
+    result = {
+        'benchmark': 'load_test',
+        'base_url': base_url,
+        'users': args.users,
+        'duration_s': round(wall_seconds, 1),
+        'think_ms': args.think_ms,
+        'mix': mix,
+        'latency': latency,
+    }
+    if standin_url:
+        stats = _standin_stats(standin_url)
+        requests_total = latency['all']['count'] or 1
+        result['sheets'] = {
+            'calls': stats['calls'],
+            'throttled': stats['throttled'],
+            'calls_per_request': round(stats['total_calls'] / requests_total, 2),
+            'per_action': per_action_calls,
+            'standin_config': stats['config'],
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--serve', action='store_true', help='app.py をこのプロセス内で起動する')
+    parser.add_argument('--standin-url', default='', help='Sheets API 代替サーバー（呼出数の集計用）')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30.0, help='秒')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='全端末が動き出すまでの秒数')
+    parser.add_argument('--think-ms', type=float, default=1000.0)
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--adjust-async', action='store_true')
+    parser.add_argument('--allow-writes', action='store_true',
+                        help='代替サーバー以外に対しても adjust（盤點保存）を実行する')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    mix = _parse_mix(args.mix)
+    standin_url = args.standin_url.rstrip('/')
+    if mix.get('adjust') and not (standin_url or args.allow_writes):
+        raise SystemExit(
+            'adjust は試験対象のシートへ書き込みます。--standin-url で代替サーバーを使うか、'
+            '書き込んでよいシートなら --allow-writes を指定してください（または --mix から adjust を外す）'
+        )
+    if not args.serve:
+        result = _run(args, mix, args.base_url, standin_url)
+    else:
+        # 同一プロセスで動かすアプリのログは stderr へ（stdout は結果 JSON のみ）
+        with contextlib.redirect_stdout(sys.stderr):
+            base_url, server = _serve_in_process()
+            try:
+                result = _run(args, mix, base_url, standin_url)
+            finally:
+                server.shutdown()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
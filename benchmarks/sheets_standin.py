@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Google Sheets API v4 のローカル代替サーバー（負荷試験用）
+
+app.py / inventory_sync.py が使う範囲だけを実装する:
+  GET  /v4/spreadsheets/{id}/values/{range}          values.get
+  PUT  /v4/spreadsheets/{id}/values/{range}          values.update
+  POST /v4/spreadsheets/{id}/values/{range}:append   values.append
+  POST /v4/spreadsheets/{id}/values:batchUpdate      values.batchUpdate
+  GET  /v4/spreadsheets/{id}                         spreadsheets.get（fields は無視）
+  POST /v4/spreadsheets/{id}:batchUpdate             addSheet / deleteSheet / updateSheetProperties /
+                                                     updateCells / appendDimension（実 API と同じく全件成功か全件無効）
+
+スプレッドシート ID は区別せず1冊のブックを共有する。値は文字列で返し、数式は評価せず文字列のまま保持する。
+グリッドは実シートと同じく新規 1000 行 × 26 列で、values.* の書込では広がり、updateCells は範囲外なら 400 を返す。
+応答前に latency_ms ± jitter_ms の遅延を入れ、error_rate の確率、または分間クォータ
+（read_quota / write_quota、0 で無制限）超過で 429 RESOURCE_EXHAUSTED を返す。
+
+管理用:
+  GET  /__standin/stats   操作別の呼出数・429 件数
+  POST /__standin/reset   統計をリセット
+  POST /__standin/config  {"latency_ms": .., "jitter_ms": .., "error_rate": .., "read_quota": .., "write_quota": ..}
+
+アプリ側は SHEETS_API_STANDIN_URL=http://127.0.0.1:8765 を指定して起動する。
+
+使い方: python benchmarks/sheets_standin.py [--port 8765] [--seed-rows 1000] [--latency-ms 80] [--jitter-ms 40]
+                                            [--error-rate 0.0] [--read-quota 0] [--write-quota 0]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import unquote
+
+from flask import Flask, jsonify, request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_sheets import sheet_ranges  # noqa: E402
+
+_CELL_RE = re.compile(r'^([A-Za-z]*)(\d*)$')
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def _column_letters(index: int) -> str:
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def parse_range(a1: str):
+    """'Sheet!A2:E5000' → (title, 行開始, 列開始, 行終了, 列終了)。0 始まり・終了は含む・None は無制限"""
+    a1 = unquote(a1)
+    title, _, cells = a1.rpartition('!') if '!' in a1 else (a1, '', '')
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    if not cells:
+        return title, 0, 0, None, None
+    start, _, end = cells.partition(':')
+    m1, m2 = _CELL_RE.match(start), _CELL_RE.match(end or start)
+    if not m1 or not m2:
+        raise ValueError(f'Unable to parse range: {a1}')
+    r1 = int(m1.group(2)) - 1 if m1.group(2) else 0
+    c1 = _column_index(m1.group(1)) if m1.group(1) else 0
+    r2 = int(m2.group(2)) - 1 if m2.group(2) else None
+    c2 = _column_index(m2.group(1)) if m2.group(1) else None
+    return title, r1, c1, r2, c2
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _trim(rows):
+    """Sheets API と同じく行末の空セル・末尾の空行を落とす"""
+    out = []
+    for row in rows:
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        out.append(row)
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+class Workbook:
+    """タイトル → {'sheetId', 'rows'} のブック。操作はすべてロック下で行う"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sheets = {}
+
+    def add_sheet(self, title: str, sheet_id: int = None, grid: dict = None) -> dict:
+        if title in self.sheets:
+            raise ValueError(f'Invalid requests[0].addSheet: A sheet with the name "{title}" already exists.')
+        if sheet_id is None:
+            sheet_id = max((s['sheetId'] for s in self.sheets.values()), default=-1) + 1
+        grid = grid or {}
+        self.sheets[title] = {
+            'sheetId': sheet_id, 'rows': [],
+            # 実シートと同じく既定 1000 行 × 26 列
+            'rowCount': int(grid.get('rowCount') or 1000),
+            'columnCount': int(grid.get('columnCount') or 26),
+        }
+        return {'sheetId': sheet_id, 'title': title, 'index': len(self.sheets) - 1,
+                'gridProperties': {'rowCount': self.sheets[title]['rowCount'],
+                                   'columnCount': self.sheets[title]['columnCount']}}
+
+    def delete_sheet(self, sheet_id: int) -> None:
+        for title, sheet in self.sheets.items():
+            if sheet['sheetId'] == sheet_id:
+                del self.sheets[title]
+                return
+        raise ValueError(f'Invalid requests[0].deleteSheet: No sheet with id: {sheet_id}')
+
+    def update_sheet_properties(self, req: dict) -> None:
+        """updateSheetProperties（fields の title / index のみ対応）"""
+        props = req.get('properties', {})
+        fields = {f.strip() for f in req.get('fields', '').split(',')}
+        unsupported = fields - {'title', 'index'}
+        if unsupported:
+            raise ValueError(f'Unsupported updateSheetProperties fields: {",".join(sorted(unsupported))}')
+        sheet = self._by_id(props.get('sheetId', 0))
+        items = [(t, s) for t, s in self.sheets.items() if s is not sheet]
+        title = next(t for t, s in self.sheets.items() if s is sheet)
+        index = next(i for i, (_, s) in enumerate(self.sheets.items()) if s is sheet)
+        if 'title' in fields:
+            if props['title'] != title and props['title'] in self.sheets:
+                raise ValueError(f'Invalid requests[0].updateSheetProperties: '
+                                 f'A sheet with the name "{props["title"]}" already exists.')
+            title = props['title']
+        if 'index' in fields:
+            index = min(int(props.get('index', 0)), len(items))
+        items.insert(index, (title, sheet))
+        self.sheets = dict(items)
+
+    def _sheet(self, title: str) -> dict:
+        sheet = self.sheets.get(title)
+        if sheet is None:
+            raise ValueError(f'Unable to parse range: {title}')
+        return sheet
+
+    def _by_id(self, sheet_id: int) -> dict:
+        for sheet in self.sheets.values():
+            if sheet['sheetId'] == sheet_id:
+                return sheet
+        raise ValueError(f'No grid with id: {sheet_id}')
+
+    @staticmethod
+    def _write(sheet: dict, r0: int, c0: int, values) -> int:
+        """値の書込（values.update / append と同じくグリッドは自動で広がる）"""
+        sheet['rowCount'] = max(sheet['rowCount'], r0 + len(values))
+        sheet['columnCount'] = max([sheet['columnCount']] + [c0 + len(v) for v in values])
+        rows = sheet['rows']
+        for i, values_row in enumerate(values):
+            while len(rows) <= r0 + i:
+                rows.append([])
+            target = rows[r0 + i]
+            if len(target) < c0 + len(values_row):
+                target.extend([''] * (c0 + len(values_row) - len(target)))
+            target[c0:c0 + len(values_row)] = [_cell_text(v) for v in values_row]
+        return len(values)
+
+    def get(self, a1: str):
+        title, r1, c1, r2, c2 = parse_range(a1)
+        rows = self._sheet(title)['rows']
+        selected = rows[r1:None if r2 is None else r2 + 1]
+        return _trim([row[c1:None if c2 is None else c2 + 1] for row in selected])
+
+    def update(self, a1: str, values) -> dict:
+        title, r1, c1, _, _ = parse_range(a1)
+        count = self._write(self._sheet(title), r1, c1, values)
+        width = max((len(v) for v in values), default=0)
+        return {
+            'updatedRange': f'{title}!{_column_letters(c1)}{r1 + 1}',
+            'updatedRows': count,
+            'updatedColumns': width,
+            'updatedCells': sum(len(v) for v in values),
+        }
+
+    def append(self, a1: str, values) -> dict:
+        title, _, c1, _, _ = parse_range(a1)
+        sheet = self._sheet(title)
+        start = len(_trim(sheet['rows']))
+        self._write(sheet, start, c1, values)
+        return {'updates': {
+            'updatedRange': f'{title}!{_column_letters(c1)}{start + 1}',
+            'updatedRows': len(values),
+            'updatedCells': sum(len(v) for v in values),
+        }}
+
+    @staticmethod
+    def _check_grid(sheet: dict, r_end: int, c_end: int) -> None:
+        """updateCells はグリッドを広げない（範囲外は 400）"""
+        if r_end > sheet['rowCount'] or c_end > sheet['columnCount']:
+            raise ValueError(
+                f"Invalid requests[0].updateCells: Range ({_column_letters(c_end - 1)}{r_end}) exceeds grid limits. "
+                f"Max rows: {sheet['rowCount']}, max columns: {sheet['columnCount']}"
+            )
+
+    def append_dimension(self, req: dict) -> None:
+        sheet = self._by_id(req.get('sheetId', 0))
+        key = 'rowCount' if req.get('dimension') == 'ROWS' else 'columnCount'
+        sheet[key] += int(req.get('length', 0))
+
+    def update_cells(self, req: dict) -> None:
+        """updateCells（start 起点の書込、または range 指定で範囲を rows で置換・不足分は消去）"""
+        values = []
+        for row in req.get('rows', []):
+            cells = []
+            for cell in row.get('values', []):
+                entered = cell.get('userEnteredValue') or {}
+                cells.append(next(iter(entered.values()), ''))
+            values.append(cells)
+        if 'start' in req:
+            start = req['start']
+            sheet = self._by_id(start.get('sheetId', 0))
+            r0, c0 = start.get('rowIndex', 0), start.get('columnIndex', 0)
+            self._check_grid(sheet, r0 + len(values), c0 + max((len(v) for v in values), default=0))
+            self._write(sheet, r0, c0, values)
+            return
+        grid = req.get('range') or {}
+        sheet = self._by_id(grid.get('sheetId', 0))
+        r0, c0 = grid.get('startRowIndex', 0), grid.get('startColumnIndex', 0)
+        r_end = grid.get('endRowIndex', max(len(sheet['rows']), r0 + len(values)))
+        c_end = grid.get('endColumnIndex', c0 + max((len(v) for v in values), default=0))
+        self._check_grid(sheet, r_end, c_end)
+        blank = [[''] * (c_end - c0) for _ in range(r_end - r0)]
+        for i, row in enumerate(values[:len(blank)]):
+            blank[i][:len(row[:c_end - c0])] = row[:c_end - c0]
+        self._write(sheet, r0, c0, blank)
+
+    def metadata(self, spreadsheet_id: str) -> dict:
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'properties': {'title': 'Sheets stand-in'},
+            'sheets': [
+                {'properties': {
+                    'sheetId': s['sheetId'], 'title': title, 'index': i,
+                    'gridProperties': {'rowCount': s['rowCount'], 'columnCount': s['columnCount']},
+                }}
+                for i, (title, s) in enumerate(self.sheets.items())
+            ],
+        }
+
+
+def seed_workbook(workbook: Workbook, rows: int) -> None:
+    """synthetic_sheets の合成値を各範囲の開始セルへ書く（0 行なら空の Stock のみ）"""
+    workbook.add_sheet('Stock')
+    if rows <= 0:
+        return
+    for a1, values in sheet_ranges(rows).items():
+        title = parse_range(a1)[0]
+        if title not in workbook.sheets:
+            workbook.add_sheet(title)
+        workbook.update(a1, values)
+    workbook.update('StocktakeHistoryIndex!A1:H1', [[
+        'version_id', 'saved_at', 'report_date', 'report_time', 'product_count', 'start_row', 'end_row',
+        'idempotency_key',
+    ]])
+
+
+def create_app(seed_rows: int = 1000, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+               error_rate: float = 0.0, read_quota: int = 0, write_quota: int = 0) -> Flask:
+    app = Flask(__name__)
+    workbook = Workbook()
+    seed_workbook(workbook, seed_rows)
+    config = {
+        'latency_ms': latency_ms, 'jitter_ms': jitter_ms, 'error_rate': error_rate,
+        'read_quota': read_quota, 'write_quota': write_quota,
+    }
+    stats_lock = threading.Lock()
+    stats = {'calls': Counter(), 'throttled': Counter(), 'started_at': time.time()}
+    windows = {'read': deque(), 'write': deque()}
+    app.config['WORKBOOK'] = workbook
+
+    def error(code: int, status: str, message: str):
+        return jsonify({'error': {'code': code, 'message': message, 'status': status}}), code
+
+    def admit(op: str, kind: str):
+        """遅延を入れ、429 にすべきなら応答を返す"""
+        delay = config['latency_ms'] + random.uniform(-1, 1) * config['jitter_ms']
+        if delay > 0:
+            time.sleep(delay / 1000)
+        now = time.time()
+        with stats_lock:
+            stats['calls'][op] += 1
+            window = windows[kind]
+            while window and now - window[0] > 60:
+                window.popleft()
+            quota = config[f'{kind}_quota']
+            over_quota = bool(quota) and len(window) >= quota
+            if not over_quota:
+                window.append(now)
+            injected = random.random() < config['error_rate']
+            if over_quota or injected:
+                stats['throttled'][op] += 1
+                return error(429, 'RESOURCE_EXHAUSTED',
+                             f"Quota exceeded for quota metric '{kind.title()} requests' (stand-in)")
+        return None
+
+    def run(op: str, kind: str, fn):
+        throttled = admit(op, kind)
+        if throttled:
+            return throttled
+        try:
+            with workbook.lock:
+                return jsonify(fn())
+        except ValueError as e:
+            return error(400, 'INVALID_ARGUMENT', str(e))
+
+    @app.route('/v4/spreadsheets/<path:target>', methods=['GET', 'PUT', 'POST'])
+    def sheets_api(target):
+        spreadsheet_id, _, rest = target.partition('/')
+        body = request.get_json(silent=True) or {}
+
+        if not rest and spreadsheet_id.endswith(':batchUpdate') and request.method == 'POST':
+            spreadsheet_id = spreadsheet_id[:-len(':batchUpdate')]
+
+            def batch_update():
+                # 実 API と同じく途中で失敗したら先行リクエストも反映しない
+                saved = {t: {**sh, 'rows': [list(r) for r in sh['rows']]} for t, sh in workbook.sheets.items()}
+                try:
+                    return apply_batch_update()
+                except ValueError:
+                    workbook.sheets = saved
+                    raise
+
+            def apply_batch_update():
+                replies = []
+                for req in body.get('requests', []):
+                    if 'addSheet' in req:
+                        props = req['addSheet'].get('properties', {})
+                        replies.append({'addSheet': {'properties': workbook.add_sheet(
+                            props.get('title') or f'Sheet{len(workbook.sheets) + 1}', props.get('sheetId'),
+                            props.get('gridProperties'),
+                        )}})
+                    elif 'deleteSheet' in req:
+                        workbook.delete_sheet(req['deleteSheet'].get('sheetId'))
+                        replies.append({})
+                    elif 'updateSheetProperties' in req:
+                        workbook.update_sheet_properties(req['updateSheetProperties'])
+                        replies.append({})
+                    elif 'appendDimension' in req:
+                        workbook.append_dimension(req['appendDimension'])
+                        replies.append({})
+                    elif 'updateCells' in req:
+                        workbook.update_cells(req['updateCells'])
+                        replies.append({})
+                    else:
+                        raise ValueError(f'Unsupported request: {next(iter(req), "")}')
+                return {'spreadsheetId': spreadsheet_id, 'replies': replies}
+            return run('batchUpdate', 'write', batch_update)
+
+        if not rest and request.method == 'GET':
+            return run('get', 'read', lambda: workbook.metadata(spreadsheet_id))
+
+        if rest == 'values:batchUpdate' and request.method == 'POST':
+            def values_batch_update():
+                responses = [workbook.update(d['range'], d.get('values', [])) for d in body.get('data', [])]
+                return {
+                    'spreadsheetId': spreadsheet_id,
+                    'totalUpdatedRows': sum(r['updatedRows'] for r in responses),
+                    'responses': responses,
+                }
+            return run('values.batchUpdate', 'write', values_batch_update)
+
+        if rest.startswith('values/'):
+            a1 = rest[len('values/'):]
+            if request.method == 'GET':
+                return run('values.get', 'read', lambda: {
+                    'range': unquote(a1), 'majorDimension': 'ROWS', 'values': workbook.get(a1),
+                })
+            if request.method == 'PUT':
+                return run('values.update', 'write', lambda: {
+                    'spreadsheetId': spreadsheet_id, **workbook.update(a1, body.get('values', [])),
+                })
+            if request.method == 'POST' and a1.endswith(':append'):
+                return run('values.append', 'write', lambda: {
+                    'spreadsheetId': spreadsheet_id, **workbook.append(a1[:-len(':append')], body.get('values', [])),
+                })
+
+        return error(404, 'NOT_FOUND', f'Not supported by stand-in: {request.method} {target}')
+
+    @app.route('/__standin/stats')
+    def standin_stats():
+        with stats_lock:
+            return jsonify({
+                'calls': dict(stats['calls']),
+                'throttled': dict(stats['throttled']),
+                'total_calls': sum(stats['calls'].values()),
+                'since': stats['started_at'],
+                'config': config,
+            })
+
+    @app.route('/__standin/reset', methods=['POST'])
+    def standin_reset():
+        with stats_lock:
+            stats['calls'].clear()
+            stats['throttled'].clear()
+            stats['started_at'] = time.time()
+        return jsonify({'ok': True})
+
+    @app.route('/__standin/config', methods=['POST'])
+    def standin_config():
+        payload = request.get_json(silent=True) or {}
+        with stats_lock:
+            for key in config:
+                if key in payload:
+                    config[key] = type(config[key])(payload[key])
+        return jsonify({'ok': True, 'config': config})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed-rows', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=80.0)
+    parser.add_argument('--jitter-ms', type=float, default=40.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--read-quota', type=int, default=0, help='分間の読取リクエスト上限（0 で無制限）')
+    parser.add_argument('--write-quota', type=int, default=0, help='分間の書込リクエスト上限（0 で無制限）')
+    args = parser.parse_args()
+
+    app = create_app(args.seed_rows, args.latency_ms, args.jitter_ms, args.error_rate,
+                     args.read_quota, args.write_quota)
+    print(f"🧪 Sheets API 代替サーバー: http://{args.host}:{args.port} （{args.seed_rows}行で初期化）")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
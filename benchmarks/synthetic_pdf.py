@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の合成 Inventory Summary Report PDF を生成
+（外部ライブラリ不要。罫線付きの表を生の PDF 命令で描画する）
+"""
+
+import os
+import sys
+from typing import List
+
+PAGE_W, PAGE_H = 595, 842
+COLUMNS = [
+    ('Product Code', 40, 150),
+    ('Description', 150, 400),
+    ('OnHand Quantity', 400, 480),
+    ('Available', 480, 555),
+]
+ROW_H = 22
+TOP = 800
+
+
+def synthetic_items(count: int) -> List[List[str]]:
+    """Product Code / Description / OnHand / Available の合成行"""
+    prefixes = ['BD', 'FC', 'AC', 'SW', 'TNMA', 'GSC']
+    items = []
+    for i in range(count):
+        prefix = prefixes[i % len(prefixes)]
+        code = f'{prefix}-{i:03d}' if len(prefix) == 2 else f'{prefix}{i:04d}M3000MK'
+        items.append([code, f'Synthetic item {i} 2440x1220mm', f'{(i * 37) % 5000:,}.00', f'{(i * 31) % 4000:,}.00'])
+    return items
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_stream(rows: List[List[str]], grid: bool = True) -> bytes:
+    ops = ['0.5 w']
+    table = [[c[0] for c in COLUMNS]] + rows
+    bottom = TOP - ROW_H * len(table)
+    if grid:
+        for r in range(len(table) + 1):
+            y = TOP - ROW_H * r
+            ops.append(f'{COLUMNS[0][1]} {y} m {COLUMNS[-1][2]} {y} l S')
+        for x in [c[1] for c in COLUMNS] + [COLUMNS[-1][2]]:
+            ops.append(f'{x} {TOP} m {x} {bottom} l S')
+    for r, row in enumerate(table):
+        y = TOP - ROW_H * r - 15
+        for (_, x0, _), cell in zip(COLUMNS, row):
+            ops.append(f'BT /F1 8 Tf {x0 + 3} {y} Td ({_escape(cell)}) Tj ET')
+    return '\n'.join(ops).encode('latin-1')
+
+
+def write_synthetic_report(path: str, pages: int = 7, rows_per_page: int = 30, grid: bool = True) -> str:
+    """grid=False で罫線なし（text 戦略でしか取れない）レイアウトを生成"""
+    items = synthetic_items(pages * rows_per_page)
+    objects: List[bytes] = []
+    font_id = 3
+    page_ids = []
+    content_ids = []
+    next_id = 4
+    for _ in range(pages):
+        page_ids.append(next_id)
+        content_ids.append(next_id + 1)
+        next_id += 2
+
+    objects.append(b'<< /Type /Catalog /Pages 2 0 R >>')
+    kids = ' '.join(f'{pid} 0 R' for pid in page_ids)
+    objects.append(f'<< /Type /Pages /Kids [{kids}] /Count {pages} >>'.encode())
+    objects.append(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    for p in range(pages):
+        rows = items[p * rows_per_page:(p + 1) * rows_per_page]
+        stream = _page_stream(rows, grid)
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_W} {PAGE_H}] '
+            f'/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_ids[p]} 0 R >>'.encode()
+        )
+        objects.append(b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream')
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{i} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref_at = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for off in offsets:
+        out += f'{off:010d} 00000 n \n'.encode()
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n'.encode()
+    with open(path, 'wb') as f:
+        f.write(out)
+    return path
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), 'synthetic_inventory.pdf')
+    print(write_synthetic_report(target))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用の合成シート値（Stock A:Y / InventorySummaryReport / StocktakeSnapshot / 盤點履歴）
+
+値は Sheets API values.get の 'values' と同じ「文字列の2次元配列」。
+app.py が読む範囲文字列 → 値 の辞書を sheet_ranges() で作り、SyntheticSheets で配信する。
+"""
+
+import random
+from typing import Dict, List
+from urllib.parse import unquote
+
+# 実在コードを混ぜてカテゴリ判定（BD/FC/Taishan 等）の分岐も通す
+KNOWN_CODES = ['BD-060', 'BD-061', 'FC-003', 'FC-056', 'AC-204', 'SW-002', 'TNIA2432I0800MK']
+PREFIXES = ['BD', 'FC', 'AC', 'SW', 'TNMA', 'GSC']
+CATEGORIES = ['Board', 'Board- Fibre Cement', 'Accessories', 'SCREW', 'Tee-Bar (MK -15)', 'Metal Angle']
+HISTORY_VERSION_ID = 'v_bench_0001'
+
+
+def synthetic_codes(count: int) -> List[str]:
+    codes = []
+    for i in range(count):
+        if i < len(KNOWN_CODES):
+            codes.append(KNOWN_CODES[i])
+            continue
+        prefix = PREFIXES[i % len(PREFIXES)]
+        codes.append(f'{prefix}-{i:05d}' if len(prefix) == 2 else f'{prefix}{i:05d}M3000MK')
+    return codes
+
+
+def synthetic_quantity(rng: random.Random) -> str:
+    """Sheets 上の数量セル相当（空・エラー値・0・整数・桁区切り小数を混在）"""
+    roll = rng.random()
+    if roll < 0.08:
+        return ''
+    if roll < 0.12:
+        return rng.choice(['#N/A', '#REF!'])
+    if roll < 0.40:
+        return '0'
+    if roll < 0.75:
+        return str(rng.randint(1, 500))
+    return f"{rng.randint(1, 20000):,}.00"
+
+
+def stock_values(codes: List[str], rng: random.Random) -> List[List[str]]:
+    """Stock!A1:Y（ヘッダ + A番号 / C コード / D 品名 / E カテゴリ / T 保管場所 / U:W 数量 / X 単位 / Y 更新日）"""
+    values = [[f'H{c}' for c in range(25)]]
+    for i, code in enumerate(codes):
+        # 一部の A 列は空欄にして自動採番の経路も通す
+        number = '' if i % 50 == 49 else str(i + 1)
+        name = f'Synthetic item {i} 2440x1220mm' if i % 97 else f'Marco &#34;{i}&#34; Board'
+        row = [number, '', code, name, CATEGORIES[i % len(CATEGORIES)]] + [''] * 14
+        available = synthetic_quantity(rng)
+        row += [rng.choice(['0', '', 'A-1', 'B-2']), synthetic_quantity(rng), available, available, '支', '2026-10-01']
+        values.append(row)
+    return values
+
+
+def summary_values(codes: List[str], rng: random.Random) -> List[List[str]]:
+    """InventorySummaryReport!A1:E（同期処理と同じく E 列は Available の複製）"""
+    values = [['Product Code', 'Description', 'OnHand Quantity SC w/o DN', 'Available', 'Available (dup)']]
+    for i, code in enumerate(codes):
+        available = synthetic_quantity(rng)
+        values.append([code, f'Synthetic item {i} 2440x1220mm', synthetic_quantity(rng), available, available])
+    # Stock に無くサマリーにのみ存在する製品
+    for i in range(max(1, len(codes) // 100)):
+        values.append([f'ISR-ONLY-{i:04d}', f'Summary only {i}', '5', '5', '5'])
+    return values
+
+
+def snapshot_block(codes: List[str], rng: random.Random, report_time: str = '10:00') -> List[List[str]]:
+    """StocktakeSnapshot!A1:I（メタ行 + ヘッダ + category/subcategory/product 行）"""
+    values = [
+        ['2026/10/01', report_time, str(len(codes)), '2026-10-01 09:00', 'v-bench'],
+        ['row_type', 'category', 'sub_category', 'product_code', 'description',
+         'on_hand', 'sc_wo_dn', 'available', 'adjust'],
+    ]
+    per_category = max(1, len(codes) // len(CATEGORIES))
+    for i, code in enumerate(codes):
+        if i % per_category == 0:
+            values.append(['category', CATEGORIES[(i // per_category) % len(CATEGORIES)], '', '', '', '', '', '', ''])
+        if i % 40 == 0:
+            values.append(['subcategory', '', f'Group {i // 40}', '', '', '', '', '', ''])
+        adjust = str(rng.randint(-5, 5)) if i % 10 == 0 else ''
+        values.append(['product', '', '', code, f'Synthetic item {i}',
+                       synthetic_quantity(rng), synthetic_quantity(rng), synthetic_quantity(rng), adjust])
+    return values
+
+
+def sheet_ranges(rows: int, seed: int = 42) -> Dict[str, List[List[str]]]:
+    """app.py が読む範囲文字列 → 値。範囲の行上限は無視して全行を返す（行数増加時の処理コストを測るため）"""
+    rng = random.Random(seed)
+    codes = synthetic_codes(rows)
+    summary = summary_values(codes, rng)
+    history = snapshot_block(codes, rng, report_time='09:00')
+    start_row, end_row = 1, len(history)
+    return {
+        'Stock!A1:Y1500': stock_values(codes, rng),
+        'InventorySummaryReport!A2:E5000': summary[1:],
+        'InventorySummaryReport!A1:G2000': summary,
+        'StocktakeSnapshot!A1:I2000': snapshot_block(codes, rng),
+        'StocktakeHistoryIndex!A2:G500': [[
+            HISTORY_VERSION_ID, '2026-10-01 09:30', '2026/10/01', '09:00',
+            str(len(codes)), str(start_row), str(end_row),
+        ]],
+        f'StocktakeHistoryData!A{start_row}:I{end_row}': history,
+    }
+
+
+class SyntheticSheets:
+    """範囲文字列で合成値を返すスタブ（_get_sheet_values と requests.get の両方に差し込む）"""
+
+    def __init__(self, ranges: Dict[str, List[List[str]]]):
+        self.ranges = ranges
+        self.calls = 0
+
+    def get_values(self, sheet_range: str) -> List[List[str]]:
+        self.calls += 1
+        return self.ranges.get(unquote(sheet_range), [])
+
+    def requests_get(self, url, *args, **kwargs):
+        return _StubResponse(self.get_values(url.rsplit('/values/', 1)[-1]))
+
+
+class _StubResponse:
+    status_code = 200
+
+    def __init__(self, values):
+        self._values = values
+
+    def raise_for_status(self):
+        return None
+
+    def json(self):
+        return {'values': self._values}
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 import email
 import imaplib
+import logging
+import math
 import os
 import re
 import tempfile
+from contextlib import contextmanager
+import time
 from datetime import datetime, timezone, timedelta
-from typing import List, Any, Tuple
+from typing import List, Any, Tuple, Iterable, Iterator
 
 from google.oauth2.service_account import Credentials as SA_Credentials
 import json as _json
@@ -13,6 +17,18 @@ from googleapiclient.discovery import build as ga_build
 from googleapiclient.errors import HttpError
 from email.header import decode_header, make_header
 
+from product_code import normalize_product_code_key
+from profile_store import save_profile, start_profiler, stop_profiler
+
+# app.py の 'kirii' ロガー（JSON/テキスト整形・LOG_LEVEL）に流す子ロガー
+logger = logging.getLogger('kirii.sync')
+
+
+def _log(level, msg, exc_info=None, **fields):
+    """フィールド付きで出力（app.py の _log と同じ形式）"""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, exc_info=exc_info, extra={'fields': fields})
+
 
 def _now_jst() -> datetime:
     return datetime.now(timezone(timedelta(hours=9)))
@@ -29,6 +45,13 @@ def _ensure_sheets_service() -> Tuple[Any, str]:
     if not spreadsheet_id:
         raise RuntimeError('環境変数 PQFORM_SHEET_ID が未設定です')
 
+    standin_url = (os.environ.get('SHEETS_API_STANDIN_URL') or '').strip().rstrip('/')
+    if standin_url:
+        # ローカル代替サーバー（benchmarks/sheets_standin.py）。認証不要
+        service = ga_build('sheets', 'v4', developerKey='standin',
+                           client_options={'api_endpoint': standin_url}, cache_discovery=False)
+        return service, spreadsheet_id
+
     sa_json = os.environ.get('GOOGLE_SA_JSON')
     sa_file = os.environ.get('GOOGLE_SA_FILE')
     if not sa_json and not sa_file:
@@ -44,57 +67,335 @@ def _ensure_sheets_service() -> Tuple[Any, str]:
     return service, spreadsheet_id
 
 
-def _find_latest_inventory_pdf_from_gmail() -> str:
+_IMAP_HEADER_ITEM = 'BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)]'
+# 件名チェック対象とする新しい順の最大件数（従来の「最新100通」相当）
+_IMAP_MAX_CANDIDATES = 100
+
+
+class _ImapLiteral(bytes):
+    """IMAP リテラル {n} で受け取ったバイト列"""
+
+
+_IMAP_OPEN = object()
+_IMAP_CLOSE = object()
+
+
+def _imap_tokenize(stream: bytes) -> List[Any]:
+    """IMAP 応答を 括弧 / 文字列 / None(NIL) / リテラル(bytes) のトークン列に分解"""
+    tokens: List[Any] = []
+    i, n = 0, len(stream)
+    while i < n:
+        c = stream[i:i+1]
+        if c in (b' ', b'\r', b'\n'):
+            i += 1
+        elif c in (b'(', b')'):
+            tokens.append(_IMAP_OPEN if c == b'(' else _IMAP_CLOSE)
+            i += 1
+        elif c == b'"':
+            j = i + 1
+            buf = bytearray()
+            while j < n and stream[j:j+1] != b'"':
+                if stream[j:j+1] == b'\\':
+                    j += 1
+                buf += stream[j:j+1]
+                j += 1
+            tokens.append(bytes(buf).decode('utf-8', 'replace'))
+            i = j + 1
+        elif c == b'{':
+            m = re.match(rb'\{(\d+)\}\r\n', stream[i:i+32])
+            if not m:
+                raise ValueError('IMAP literal parse error')
+            start = i + m.end()
+            size = int(m.group(1))
+            tokens.append(_ImapLiteral(stream[start:start + size]))
+            i = start + size
+        else:
+            j = i
+            while j < n and stream[j:j+1] not in (b' ', b'(', b')', b'\r', b'\n'):
+                if stream[j:j+1] == b'[':
+                    # BODY[HEADER.FIELDS (SUBJECT DATE)] のような節は1語として扱う
+                    j = stream.index(b']', j)
+                j += 1
+            atom = stream[i:j].decode('utf-8', 'replace')
+            tokens.append(None if atom.upper() == 'NIL' else atom)
+            i = j
+    return tokens
+
+
+def _imap_parse(tokens: List[Any]) -> List[Any]:
+    """トークン列を入れ子リストへ"""
+    stack: List[List[Any]] = [[]]
+    for tok in tokens:
+        if tok is _IMAP_OPEN:
+            stack.append([])
+        elif tok is _IMAP_CLOSE:
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(tok)
+    return stack[0]
+
+
+def _imap_fetch_items(data: List[Any]) -> List[dict]:
+    """imaplib の FETCH 応答を {項目名: 値} の辞書リストに変換"""
+    stream = bytearray()
+    for item in data or []:
+        if isinstance(item, tuple):
+            stream += item[0] + b'\r\n' + item[1]
+        elif isinstance(item, bytes):
+            stream += item
+        stream += b' '
+    parsed = _imap_parse(_imap_tokenize(bytes(stream)))
+    out = []
+    for el in parsed:
+        if not isinstance(el, list):
+            continue  # メッセージ番号
+        fields = {}
+        for k in range(0, len(el) - 1, 2):
+            if isinstance(el[k], str):
+                fields[el[k].upper()] = el[k + 1]
+        out.append(fields)
+    return out
+
+
+def _imap_field(fields: dict, prefix: str) -> Any:
+    for key, value in fields.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+
+def _decode_mime_words(value: str) -> str:
+    try:
+        return str(make_header(decode_header(value or '')))
+    except Exception:
+        return value or ''
+
+
+def _imap_text(value: Any) -> Any:
+    """リテラルで届いた文字列（8bit のファイル名等）を str に揃える"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, list):
+        return [_imap_text(v) for v in value]
+    return value
+
+
+def _find_pdf_part(structure: Any, part_id: str = '') -> Any:
+    """BODYSTRUCTURE から PDF 添付のパート番号・エンコーディングを探す"""
+    if not isinstance(structure, list) or not structure:
+        return None
+    if isinstance(structure[0], list):
+        # multipart: 先頭の子パート群 → subtype → 拡張データ
+        idx = 0
+        while idx < len(structure) and isinstance(structure[idx], list):
+            child_id = f'{part_id}.{idx + 1}' if part_id else str(idx + 1)
+            hit = _find_pdf_part(structure[idx], child_id)
+            if hit:
+                return hit
+            idx += 1
+        return None
+
+    structure = _imap_text(structure)
+    mime_type = f"{structure[0] or ''}/{structure[1] if len(structure) > 1 else ''}".lower()
+    if mime_type == 'message/rfc822':
+        return None
+    filename = ''
+    params = structure[2] if len(structure) > 2 else None
+    if isinstance(params, list):
+        pairs = dict(zip(params[::2], params[1::2]))
+        filename = pairs.get('NAME') or pairs.get('name') or ''
+    disposition = None
+    for ext in structure[7:]:
+        if isinstance(ext, list) and len(ext) >= 1 and isinstance(ext[0], str) \
+                and ext[0].lower() in ('attachment', 'inline'):
+            disposition = ext
+            break
+    if disposition and len(disposition) > 1 and isinstance(disposition[1], list):
+        dparams = dict(zip(disposition[1][::2], disposition[1][1::2]))
+        filename = dparams.get('FILENAME') or dparams.get('filename') or filename
+    filename = _decode_mime_words(filename if isinstance(filename, str) else '')
+    if not filename.lower().endswith('.pdf') and not (mime_type == 'application/pdf' and disposition):
+        return None
+    return {
+        'part': part_id or '1',
+        'encoding': str(structure[5] if len(structure) > 5 and structure[5] else '7BIT').upper(),
+        'filename': filename,
+    }
+
+
+def _imap_search_inventory_uids(mbox, min_uid: int = 0) -> List[bytes]:
+    """件名 'inventory' の候補をサーバー側で検索（Gmail は X-GM-RAW を使用）
+
+    min_uid を指定するとその UID 以降のみを対象にする。
+    """
+    try:
+        since_days = int(os.environ.get('INVENTORY_MAIL_SINCE_DAYS', '30'))
+    except ValueError:
+        since_days = 30
+    caps = {str(c).upper() for c in (getattr(mbox, 'capabilities', None) or ())}
+    criteria = ['UID', f'{min_uid}:*'] if min_uid > 0 else []
+    if 'X-GM-EXT-1' in caps:
+        query = 'subject:inventory filename:pdf'
+        if since_days > 0:
+            query += f' newer_than:{since_days}d'
+        criteria += ['X-GM-RAW', f'"{query}"']
+    else:
+        criteria += ['SUBJECT', '"inventory"']
+        if since_days > 0:
+            since = (datetime.now(timezone.utc) - timedelta(days=since_days)).strftime('%d-%b-%Y')
+            criteria += ['SINCE', since]
+    typ, data = mbox.uid('SEARCH', None, *criteria)
+    if typ != 'OK':
+        raise RuntimeError('Gmail検索に失敗しました')
+    uids = (data[0] or b'').split() if data else []
+    # "n:*" は該当が無くても最大 UID を返すため、範囲外を除外
+    uids = [u for u in uids if int(u) >= min_uid]
+    # UID は到着順に増えるので新しい順に並べる
+    return sorted(uids, key=int, reverse=True)[:_IMAP_MAX_CANDIDATES]
+
+
+class _StreamingPartDecoder:
+    """Content-Transfer-Encoding をチャンク単位でデコードしてファイルへ書き出す"""
+
+    def __init__(self, encoding: str, out):
+        self.encoding = (encoding or '7BIT').upper()
+        self.out = out
+        self._buf = b''
+
+    def feed(self, chunk: bytes) -> None:
+        if self.encoding == 'BASE64':
+            import base64
+            self._buf += chunk.translate(None, b' \t\r\n')
+            usable = len(self._buf) - len(self._buf) % 4
+            if usable:
+                self.out.write(base64.b64decode(self._buf[:usable]))
+                self._buf = self._buf[usable:]
+        elif self.encoding == 'QUOTED-PRINTABLE':
+            import quopri
+            # ソフト改行や =XX が分断されないよう行単位でデコード
+            self._buf += chunk
+            cut = self._buf.rfind(b'\n') + 1
+            if cut:
+                self.out.write(quopri.decodestring(self._buf[:cut]))
+                self._buf = self._buf[cut:]
+        else:
+            self.out.write(chunk)
+
+    def close(self) -> None:
+        if not self._buf:
+            return
+        if self.encoding == 'BASE64':
+            import base64
+            self.out.write(base64.b64decode(self._buf + b'=' * (-len(self._buf) % 4)))
+        elif self.encoding == 'QUOTED-PRINTABLE':
+            import quopri
+            self.out.write(quopri.decodestring(self._buf))
+        self._buf = b''
+
+
+def _imap_download_part(mbox, uid: bytes, pdf_part: dict) -> str:
+    """PDF パートのみを部分 FETCH (<offset.length>) で分割取得し、
+    デコードしながら一時ファイルへ書き出してパスを返す（添付サイズに依らずメモリ一定）"""
+    try:
+        chunk_size = int(os.environ.get('INVENTORY_IMAP_CHUNK_BYTES') or 1 << 19)
+    except ValueError:
+        chunk_size = 1 << 19
+    part = pdf_part['part']
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
+        try:
+            decoder = _StreamingPartDecoder(pdf_part['encoding'], tmp)
+            offset = 0
+            while True:
+                typ, data = mbox.uid('FETCH', uid, f'(BODY.PEEK[{part}]<{offset}.{chunk_size}>)')
+                if typ != 'OK':
+                    raise RuntimeError('PDF添付の取得に失敗しました')
+                fields = _imap_fetch_items(data)
+                raw = _imap_field(fields[0], 'BODY[') if fields else None
+                if raw is None:
+                    if offset == 0:
+                        raise RuntimeError('PDF添付の取得に失敗しました')
+                    break
+                raw = raw if isinstance(raw, bytes) else str(raw).encode('latin-1')
+                decoder.feed(raw)
+                offset += len(raw)
+                if len(raw) < chunk_size:
+                    break
+            decoder.close()
+        except BaseException:
+            # 途中まで書いた PDF を残さない
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+        return tmp.name
+
+
+def _imap_connect():
+    """Gmail IMAP に接続。IMAP_STANDIN_ADDR=host:port 指定時はローカル代替サーバー（benchmarks/imap_standin.py、平文）"""
+    standin = (os.environ.get('IMAP_STANDIN_ADDR') or '').strip()
+    if standin:
+        host, _, port = standin.rpartition(':')
+        return imaplib.IMAP4(host or '127.0.0.1', int(port))
+    return imaplib.IMAP4_SSL('imap.gmail.com', 993)
+
+
+def _find_latest_inventory_pdf_from_gmail(cursor: dict = None) -> Tuple[str, dict]:
     """
-    GmailのIMAPで件名に 'inventory' を含む最新メールのPDF添付を1つ保存して返す。
+    GmailのIMAPで件名に 'inventory' を含む最新メールのPDF添付を1つ保存し、
+    (PDFパス, メールカーソル {uidvalidity, uid}) を返す。
+    件名検索はサーバー側で行い、ヘッダ(SUBJECT/DATE)と BODYSTRUCTURE を1回の FETCH で
+    まとめて取得し、PDF パートだけをダウンロードする。
+    cursor（前回処理分）と UIDVALIDITY が一致する場合はそれより新しい UID だけを調べ、
+    新着が無ければ PDF パスを空文字で返す。
     必要環境変数: GMAIL_ADDRESS, GMAIL_APP_PASSWORD
     """
     # 1) テスト用フォールバック（手元のPDFを直接指定してバイパス）
     test_pdf = os.environ.get('TEST_PDF_PATH')
     if test_pdf and os.path.isfile(test_pdf):
-        return test_pdf
+        return test_pdf, {}
 
     user = os.environ.get('GMAIL_ADDRESS')
     app_pw = os.environ.get('GMAIL_APP_PASSWORD')
     if not user or not app_pw:
         raise RuntimeError('GMAIL_ADDRESS または GMAIL_APP_PASSWORD が未設定です')
 
-    mbox = imaplib.IMAP4_SSL('imap.gmail.com', 993)
+    cursor = cursor or {}
+    mbox = _imap_connect()
     try:
         mbox.login(user, app_pw)
-        mbox.select('INBOX')
-        # シンプルに最新100通を対象に件名マッチ + PDF添付を探索
-        typ, data = mbox.search(None, 'ALL')
-        if typ != 'OK':
-            raise RuntimeError('Gmail検索に失敗しました')
-        all_ids = data[0].split()
-        if not all_ids:
-            raise RuntimeError('メールボックスが空です')
-        ids = all_ids[-100:]  # 末尾（新しい）100通に限定
-        # 最新から探索
-        for msg_id in reversed(ids):
-            typ, msg_data = mbox.fetch(msg_id, '(RFC822)')
+        mbox.select('INBOX', readonly=True)
+        _, validity = mbox.response('UIDVALIDITY')
+        uidvalidity = (validity[0] or b'').decode() if validity and validity[0] else ''
+        min_uid = 0
+        if uidvalidity and cursor.get('uidvalidity') == uidvalidity and cursor.get('uid'):
+            min_uid = int(cursor['uid']) + 1
+        uids = _imap_search_inventory_uids(mbox, min_uid)
+        if min_uid and not uids:
+            # 前回処理以降に新着なし
+            return '', dict(cursor)
+        if uids:
+            typ, data = mbox.uid('FETCH', b','.join(uids), f'(UID {_IMAP_HEADER_ITEM} BODYSTRUCTURE)')
             if typ != 'OK':
-                continue
-            msg = email.message_from_bytes(msg_data[0][1])
-            try:
-                subj_decoded = str(make_header(decode_header(msg.get('Subject') or '')))
-            except Exception:
-                subj_decoded = msg.get('Subject') or ''
-            subj_lower = subj_decoded.lower()
-            if 'inventory' not in subj_lower:
-                continue
-            # 添付からPDFを探す
-            for part in msg.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get('Content-Disposition') is None:
+                raise RuntimeError('Gmailヘッダ取得に失敗しました')
+            messages = _imap_fetch_items(data)
+            # 最新から探索
+            messages.sort(key=lambda f: int(f.get('UID') or 0), reverse=True)
+            for fields in messages:
+                header_bytes = _imap_field(fields, 'BODY[HEADER') or b''
+                if not isinstance(header_bytes, bytes):
+                    header_bytes = str(header_bytes).encode('utf-8')
+                headers = email.message_from_bytes(header_bytes)
+                subj_decoded = _decode_mime_words(headers.get('Subject') or '')
+                if 'inventory' not in subj_decoded.lower():
                     continue
-                filename = part.get_filename() or ''
-                if filename.lower().endswith('.pdf'):
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                        tmp.write(part.get_payload(decode=True))
-                        return tmp.name
+                pdf_part = _find_pdf_part(fields.get('BODYSTRUCTURE'))
+                if pdf_part:
+                    uid = str(fields.get('UID'))
+                    path = _imap_download_part(mbox, uid.encode(), pdf_part)
+                    return path, {'uidvalidity': uidvalidity, 'uid': uid}
+            if min_uid:
+                # 新着はあるが PDF 付き inventory メールではない
+                return '', dict(cursor)
         raise RuntimeError('PDF添付が見つかりませんでした（最新100通・件名に"inventory"）\nTEST_PDF_PATH にファイルパスを設定するとフォールバックできます')
     finally:
         try:
@@ -103,226 +404,746 @@ def _find_latest_inventory_pdf_from_gmail() -> str:
             pass
 
 
-def _extract_table_locally(pdf_path: str) -> List[List[Any]]:
-    """pdfplumber で表を抽出し、必要列にマッピングして返す。Gemini不要。"""
+_REQUIRED_HEADERS = [
+    ('product code', ['product code', 'code', 'item code', 'product']),
+    ('description', ['description', 'item description', 'desc']),
+    ('onhand', ['onhand quantity sc w/o dn', 'onhand quantity', 'onhand', 'qty on hand']),
+    ('available', ['available', 'availble', 'available qty', 'balance']),
+]
+
+# 複数戦略でテーブル抽出を試す（先に必要ヘッダが見つかった戦略で打ち切り）
+_TABLE_STRATEGIES = [
+    dict(vertical_strategy='lines', horizontal_strategy='lines'),
+    dict(vertical_strategy='text', horizontal_strategy='text'),
+    {},
+]
+
+
+def _normalize_header(s: Any) -> str:
+    return str(s or '').strip().lower()
+
+
+def _find_column_indices(header_row: List[Any]) -> dict:
+    mapping = {}
+    norm = [_normalize_header(h) for h in header_row]
+    for key, variants in _REQUIRED_HEADERS:
+        idx = -1
+        for i, h in enumerate(norm):
+            if any(v in h for v in variants):
+                idx = i
+                break
+        if idx >= 0:
+            mapping[key] = idx
+    return mapping
+
+
+def _find_header(t: List[List[Any]]) -> Tuple[int, dict]:
+    """先頭にヘッダがある前提で走査（数行見て合致ヘッダを探す）。(行番号, 列マップ) を返す"""
+    max_scan = min(5, len(t))
+    for r in range(max_scan):
+        col_map = _find_column_indices(t[r])
+        if len(col_map) >= 3:  # 必要列のうち3つ以上検出できれば採用
+            return r, col_map
+    return -1, {}
+
+
+def _map_table_rows(data_rows: List[List[Any]], col_map: dict) -> List[List[str]]:
+    """列マップに従ってデータ行を [code, desc, onhand, available] に変換"""
+    out: List[List[str]] = []
+    for row in data_rows:
+        if not row or not any(row):
+            continue
+        def get(idx: int) -> Any:
+            try:
+                return row[idx]
+            except Exception:
+                return ''
+        prod = get(col_map.get('product code', -1))
+        desc = get(col_map.get('description', -1))
+        onhand = get(col_map.get('onhand', -1))
+        avail = get(col_map.get('available', -1))
+        # 最低限コードか説明がある行のみ
+        if not str(prod).strip() and not str(desc).strip():
+            continue
+        out.append([
+            str(prod or '').strip(),
+            str(desc or '').strip(),
+            str(onhand or '').strip(),
+            str(avail or '').strip(),
+        ])
+    return out
+
+
+# 明細行: 製品コード（英字始まり・数字を含む）で始まり、数量が2つ以上並んで終わる行
+_PDF_ITEM_LINE_RE = re.compile(
+    r'^\s*(?=[A-Z0-9./-]*\d)[A-Z][A-Z0-9./]*(?:-[A-Z0-9./]+)*\s+.*?(?:\s+-?[\d,]*\d(?:\.\d+)?){2,}\s*$'
+)
+
+
+def _count_item_lines(text: str) -> int:
+    """ページテキスト中の明細行数（Apps Script の countPdfItemsByPage を LLM なしで行う）"""
+    return sum(1 for line in (text or '').splitlines() if _PDF_ITEM_LINE_RE.match(line))
+
+
+def _page_item_count(page) -> int:
+    try:
+        return _count_item_lines(page.extract_text() or '')
+    except Exception:
+        return 0
+
+
+def _pdf_page_item_counts(pdf_path: str) -> List[int]:
+    """ページ毎の明細行数。pdfplumber が使えなければ空リスト（検証しない）"""
     try:
         import pdfplumber  # type: ignore
+        with pdfplumber.open(pdf_path) as pdf:
+            counts = []
+            for page in pdf.pages:
+                counts.append(_page_item_count(page))
+                page.close()
+            return counts
+    except Exception:
+        return []
+
+
+def _table_extract(table) -> List[List[Any]]:
+    """pdfplumber の Table.extract() と同じ結果を返す
+
+    Table.extract() は表の行ごとにページ全体の文字を走査する（明細30行のページで文字判定が数万回）。
+    文字を縦方向の中心でソートしておき、各行の縦範囲を二分探索で切り出してから同じ判定をかける。
+    """
+    from bisect import bisect_left
+    from pdfplumber import utils  # type: ignore
+
+    chars = table.page.chars
+    mids = [(c['top'] + c['bottom']) / 2 for c in chars]
+    order = sorted(range(len(chars)), key=mids.__getitem__)
+    sorted_mids = [mids[i] for i in order]
+
+    def in_bbox(char, bbox) -> bool:
+        h_mid = (char['x0'] + char['x1']) / 2
+        v_mid = (char['top'] + char['bottom']) / 2
+        x0, top, x1, bottom = bbox
+        return x0 <= h_mid < x1 and top <= v_mid < bottom
+
+    out = []
+    for row in table.rows:
+        x0, top, x1, bottom = row.bbox
+        # 元の文字順を保つ（セル内の文字列化は並び順に依存する）
+        band = sorted(order[bisect_left(sorted_mids, top):bisect_left(sorted_mids, bottom)])
+        row_chars = [chars[i] for i in band if x0 <= (chars[i]['x0'] + chars[i]['x1']) / 2 < x1]
+        cells = []
+        for cell in row.cells:
+            if cell is None:
+                cells.append(None)
+                continue
+            cell_chars = [c for c in row_chars if in_bbox(c, cell)]
+            cells.append(utils.extract_text(cell_chars) if cell_chars else '')
+        out.append(cells)
+    return out
+
+
+def _extract_page_rows(page) -> Tuple[List[List[str]], int]:
+    """1ページ分の抽出。戦略を順に試し、ヘッダ付きの表が取れた最初の戦略の (行, テキスト上の明細行数) を返す"""
+    rows: List[List[str]] = []
+    for ts in _TABLE_STRATEGIES:
+        try:
+            tables = page.find_tables(table_settings=ts) if ts else page.find_tables()
+        except Exception:
+            continue
+        matched = False
+        page_rows: List[List[str]] = []
+        for table in tables or []:
+            try:
+                t = _table_extract(table)
+            except Exception:
+                continue
+            if not t or not any(any(cell for cell in row) for row in t):
+                continue
+            header_idx, col_map = _find_header(t)
+            if header_idx == -1:
+                continue
+            matched = True
+            page_rows.extend(_map_table_rows(t[header_idx+1:], col_map))
+        if matched:
+            rows = page_rows
+            break
+    return rows, _page_item_count(page)
+
+
+def _extract_page_rows_from_path(pdf_path: str, page_index: int):
+    """プロセスプール用: ワーカー側でPDFを開き直して1ページを抽出"""
+    import pdfplumber  # type: ignore
+    with pdfplumber.open(pdf_path) as pdf:
+        return _extract_page_rows(pdf.pages[page_index])
+
+
+def _load_json_state(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = _json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _save_json_state(path: str, data: dict) -> None:
+    try:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            _json.dump(data, f)
+        os.replace(tmp_path, path)
     except Exception as e:
-        raise RuntimeError(f'pdfplumber の読み込みに失敗しました: {e}')
+        _log(logging.WARNING, '状態ファイル保存失敗', path=path, error=str(e))
 
-    required_headers = [
-        ('product code', ['product code', 'code', 'item code', 'product']),
-        ('description', ['description', 'item description', 'desc']),
-        ('onhand', ['onhand quantity sc w/o dn', 'onhand quantity', 'onhand', 'qty on hand']),
-        ('available', ['available', 'availble', 'available qty', 'balance']),
-    ]
 
-    def normalize(s: Any) -> str:
-        return str(s or '').strip().lower()
-
-    def find_column_indices(header_row: List[Any]) -> dict:
-        mapping = {}
-        norm = [normalize(h) for h in header_row]
-        for key, variants in required_headers:
-            idx = -1
-            for i, h in enumerate(norm):
-                if any(v in h for v in variants):
-                    idx = i
-                    break
-            if idx >= 0:
-                mapping[key] = idx
-        return mapping
+def _local_extract_workers(page_count: int) -> int:
+    try:
+        configured = int(os.environ.get('INVENTORY_PDF_WORKERS') or 0)
+    except ValueError:
+        configured = 0
+    workers = configured if configured > 0 else (os.cpu_count() or 1)
+    return max(1, min(workers, page_count))
+
+
+# サマリーシート（A:E）のヘッダ。E列は Available の複製（Stock の VLOOKUP 5列目用）
+_SUMMARY_HEADER = [
+    'Product Code',
+    'Description',
+    'OnHand Quantity SC w/o DN',
+    'Available',
+    'Available (dup)'
+]
+
+
+def _iter_local_page_rows(pdf_path: str) -> Iterator[Tuple[int, List[List[str]], int]]:
+    """pdfplumber でページ順に (ページ番号(0始まり), [code, desc, onhand, available] の行リスト, 明細行数) を yield する
+
+    ページ単位でプロセスプールに分散する（INVENTORY_PDF_WORKERS で並列数指定、1 で逐次）。
+    プールは全ページを先に投入するので、呼び出し側が書込中も後続ページの解析が進む。
+    """
+    try:
+        import pdfplumber  # type: ignore
+    except Exception as e:
+        raise RuntimeError(f'pdfplumber の読み込みに失敗しました: {e}')
 
-    collected: List[List[Any]] = []
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            # 複数戦略でテーブル抽出を試す
-            strategies = [
-                dict(vertical_strategy='lines', horizontal_strategy='lines'),
-                dict(vertical_strategy='text', horizontal_strategy='text'),
-                {},
+        page_count = len(pdf.pages)
+    workers = _local_extract_workers(page_count)
+    done = 0
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = None
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            futures = [
+                pool.submit(_extract_page_rows_from_path, pdf_path, i)
+                for i in range(page_count)
             ]
-            for ts in strategies:
-                try:
-                    tables = page.extract_tables(table_settings=ts) if ts else page.extract_tables()
-                except Exception:
-                    continue
-                for t in tables or []:
-                    if not t or not any(any(cell for cell in row) for row in t):
-                        continue
-                    # 先頭にヘッダがある前提で走査（数行見て合致ヘッダを探す）
-                    header_idx = -1
-                    col_map = {}
-                    max_scan = min(5, len(t))
-                    for r in range(max_scan):
-                        col_map = find_column_indices(t[r])
-                        if len(col_map) >= 3:  # 必要列のうち3つ以上検出できれば採用
-                            header_idx = r
-                            break
-                    if header_idx == -1:
-                        continue
-                    # データ行を収集
-                    for row in t[header_idx+1:]:
-                        if not row or not any(row):
-                            continue
-                        def get(idx: int) -> Any:
-                            try:
-                                return row[idx]
-                            except Exception:
-                                return ''
-                        prod = get(col_map.get('product code', -1))
-                        desc = get(col_map.get('description', -1))
-                        onhand = get(col_map.get('onhand', -1))
-                        avail = get(col_map.get('available', -1))
-                        # 最低限コードか説明がある行のみ
-                        if not str(prod).strip() and not str(desc).strip():
-                            continue
-                        collected.append([
-                            str(prod or '').strip(),
-                            str(desc or '').strip(),
-                            str(onhand or '').strip(),
-                            str(avail or '').strip(),
-                        ])
-
-    # ヘッダ付与とE列ダミー追加
-    if not collected:
-        raise RuntimeError('PDFからテーブルを抽出できませんでした（ローカル解析）')
-    header = [
-        'Product Code',
-        'Description',
-        'OnHand Quantity SC w/o DN',
-        'Available',
-        'Available (dup)'
-    ]
-    rows = [header]
-    for prod, desc, onhand, avail in collected:
-        rows.append([prod, desc, onhand, avail, avail])
-    return rows
+            for page_index, future in enumerate(futures):
+                rows, expected = future.result()
+                done += 1
+                yield page_index, rows, expected
+        except (OSError, NotImplementedError, RuntimeError):
+            # /dev/shm が無い等、プロセスプールが使えない環境では残りを逐次処理
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+    if done < page_count:
+        with pdfplumber.open(pdf_path) as pdf:
+            for page_index in range(done, page_count):
+                page = pdf.pages[page_index]
+                rows, expected = _extract_page_rows(page)
+                page.close()  # 解析済みページのキャッシュを解放
+                yield page_index, rows, expected
 
 
-def _extract_table_with_gemini(pdf_path: str) -> List[List[Any]]:
+def _page_failure(rows: List[List[str]], expected: int) -> str:
+    """ローカル抽出結果の採点。合格なら空文字、不合格なら理由
+
+    no_header: 明細行があるのにヘッダ付きの表が見つからない（行ゼロ）
+    short: 表は取れたがページテキストの明細行数より少ない
     """
-    Gemini 2.5 PRO でPDFから表を抽出。戻り値は 2次元配列（ヘッダ含む）。
-    必要環境変数: GEMINI_API_KEY
+    if len(rows) >= expected:
+        return ''
+    return 'short' if rows else 'no_header'
+
+
+def _iter_hybrid_pages(pdf_path: str, report: list = None):
+    """ページ単位のハイブリッド抽出: 全ページを pdfplumber で処理し、不合格ページだけ Gemini へ送る
+
+    Gemini 呼び出しは不合格と判定した時点でスレッドプール（GEMINI_MAX_WORKERS、既定3）に投入し、
+    ローカル抽出はそのまま後続ページへ進む。結果はページ順に yield し、Gemini 側の方が
+    多く取れた場合のみ差し替える。report には不合格ページ毎の結果を追加する
+    （Gemini が使えない・失敗した場合は error、取り直し後も不足なら rows < expected のまま残り、
+    _extract_rows_cached はその結果をキャッシュしない）。
     """
-    import google.generativeai as genai  # 遅延import
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
 
-    api_key = os.environ.get('GEMINI_API_KEY')
-    if not api_key:
-        raise RuntimeError('環境変数 GEMINI_API_KEY が未設定です')
+    try:
+        max_workers = max(1, int(os.environ.get('GEMINI_MAX_WORKERS') or 3))
+    except ValueError:
+        max_workers = 3
+    gemini = None
+    pool = None
+    pending = deque()
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-pro')
+    def retry(page_index: int):
+        started = time.perf_counter()
+        rows = _gemini_page_rows(pdf_path, page_index, page_index + 1, *gemini)
+        return rows, round((time.perf_counter() - started) * 1000, 1)
 
-    prompt = (
-        "次のPDFから以下の列を抽出し、ヘッダ行付きの表データをJSON配列で返してください。"
-        "列: Product Code, Description, OnHand Quantity SC w/o DN, Available. "
-        "出力は必ず JSON のみ（例: [{\"Product Code\":\"...\",\"Description\":\"...\",\"OnHand Quantity SC w/o DN\":123,\"Available\":123}]）。"
-    )
+    def settle(item):
+        page_index, rows, expected, entry, future = item
+        if future is not None:
+            try:
+                alt, elapsed_ms = future.result()
+                entry['retry_rows'] = len(alt)
+                entry['retry_ms'] = elapsed_ms
+                if len(alt) > len(rows):
+                    rows = alt
+                    entry['used'] = 'gemini'
+            except Exception as e:
+                entry['error'] = str(e)
+        if entry:
+            # 最終的に採用した行数（不足が残ればキャッシュしない判定に使う）
+            entry['rows'] = len(rows)
+            _log(logging.WARNING, 'ページ検証で抽出行数が不足', page=page_index + 1, expected=expected,
+                 extracted=entry['extracted'], reason=entry['reason'], used=entry['used'])
+            if report is not None:
+                report.append(entry)
+        return page_index, rows, expected
+
+    try:
+        for page_index, rows, expected in _iter_local_page_rows(pdf_path):
+            reason = _page_failure(rows, expected)
+            entry, future = {}, None
+            if reason:
+                entry = {
+                    'pages': [page_index + 1, page_index + 1],
+                    'expected': expected,
+                    'extracted': len(rows),
+                    'reason': reason,
+                    'retried_with': 'gemini',
+                    'used': 'local',
+                }
+                if gemini is None:
+                    try:
+                        gemini = _gemini_model()
+                    except Exception as e:
+                        gemini = False
+                        _log(logging.WARNING, 'Gemini を利用できないため不合格ページもローカル結果を使用',
+                             error=str(e))
+                if gemini:
+                    if pool is None:
+                        pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hybrid-gemini')
+                    future = pool.submit(retry, page_index)
+                else:
+                    entry['error'] = 'gemini unavailable'
+            pending.append((page_index, rows, expected, entry, future))
+            # 先頭から確定済みのページだけ順に出す（Gemini 待ちのページがあればそこで止める）
+            while pending and (pending[0][4] is None or pending[0][4].done()):
+                yield settle(pending.popleft())
+        while pending:
+            yield settle(pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _iter_local_summary_rows(pdf_path: str, check_pages: bool = False, report: list = None) -> Iterator[List[Any]]:
+    """ローカル抽出の結果をヘッダ付き A:E 行として順に yield する
+
+    check_pages=True でページ毎に採点し、不合格ページだけ Gemini で取り直す（ハイブリッド）。
+    """
+    pages = _iter_hybrid_pages(pdf_path, report) if check_pages else _iter_local_page_rows(pdf_path)
+    header_sent = False
+    for _, page_rows, _ in pages:
+        for prod, desc, onhand, avail in page_rows:
+            if not header_sent:
+                header_sent = True
+                yield list(_SUMMARY_HEADER)
+            yield [prod, desc, onhand, avail, avail]
+    if not header_sent:
+        raise RuntimeError('PDFからテーブルを抽出できませんでした（ローカル解析）')
+
+
+def _extract_table_locally(pdf_path: str) -> List[List[Any]]:
+    """pdfplumber で表を抽出し、必要列にマッピングして返す。Gemini不要。"""
+    return list(_iter_local_summary_rows(pdf_path))
+
+
+_GEMINI_PROMPT = (
+    "次のPDFから以下の列を抽出し、ヘッダ行付きの表データをJSON配列で返してください。"
+    "列: Product Code, Description, OnHand Quantity SC w/o DN, Available. "
+    "出力は必ず JSON のみ（例: [{\"Product Code\":\"...\",\"Description\":\"...\",\"OnHand Quantity SC w/o DN\":123,\"Available\":123}]）。"
+)
+
+
+def _pdf_page_text(pdf_path: str, first: int = 0, last: int = None) -> str:
+    """ページ範囲 [first, last) のテキスト（pdfplumber → PyPDF2 の順に試す）"""
+    try:
+        import pdfplumber  # type: ignore
+        extracted = []
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages[first:last]:
+                extracted.append(page.extract_text() or '')
+        return '\n'.join(extracted)
+    except Exception:
+        # pdfplumber不調時はPyPDF2で簡易抽出
+        try:
+            from PyPDF2 import PdfReader  # type: ignore
+            reader = PdfReader(pdf_path)
+            parts = []
+            for page in reader.pages[first:last]:
+                parts.append(page.extract_text() or '')
+            return '\n'.join(parts)
+        except Exception as e:
+            raise RuntimeError(f'PDFテキスト抽出に失敗しました: {e}')
+
+
+def _write_pdf_pages(reader, first: int, last: int) -> str:
+    """PdfReader のページ [first, last) を一時PDFに書き出してパスを返す"""
+    from PyPDF2 import PdfWriter  # type: ignore
+    writer = PdfWriter()
+    for page in reader.pages[first:last]:
+        writer.add_page(page)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f'_p{first + 1}-{last}.pdf') as tmp:
+        writer.write(tmp)
+        return tmp.name
+
+
+def _split_pdf_pages(pdf_path: str, pages_per_chunk: int) -> List[Tuple[int, int, str]]:
+    """PDF をページ範囲ごとの一時PDFに分割。[(開始, 終了(含まず), パス)] を返す"""
+    from PyPDF2 import PdfReader  # type: ignore
+    reader = PdfReader(pdf_path)
+    total = len(reader.pages)
+    if total <= pages_per_chunk:
+        return [(0, total, pdf_path)]
+    chunks = []
+    for first in range(0, total, pages_per_chunk):
+        last = min(first + pages_per_chunk, total)
+        chunks.append((first, last, _write_pdf_pages(reader, first, last)))
+    return chunks
+
+
+def _parse_gemini_rows(text: str) -> List[dict]:
+    m = re.search(r"\[.*\]", text or '', flags=re.S)
+    if not m:
+        raise RuntimeError('Geminiの応答からJSONを抽出できませんでした')
+    arr = _json.loads(m.group(0))
+    return [obj for obj in arr if isinstance(obj, dict)]
 
+
+def _gemini_extract_chunk(model, upload_file, pdf_path: str, chunk: Tuple[int, int, str]) -> dict:
+    """1チャンク分の Gemini 抽出。ファイル送信が失敗したらテキスト送信にフォールバック"""
+    first, last, chunk_path = chunk
+    started = time.perf_counter()
+    mode = 'file'
     text = ''
     try:
+        if upload_file is None:
+            raise RuntimeError('upload unavailable')
         # まずはファイルアップロード経由で解析（推奨）
-        uploaded = genai.upload_file(pdf_path)
-        resp = model.generate_content([uploaded, prompt])
+        uploaded = upload_file(chunk_path)
+        resp = model.generate_content([uploaded, _GEMINI_PROMPT])
         text = resp.text or ''
     except Exception:
         # ファイルアップロードが失敗する環境向けフォールバック
         # ローカルでPDFテキストを抽出して、テキストを直接プロンプトに渡す
-        try:
-            import pdfplumber  # type: ignore
-            extracted = []
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    extracted.append(page.extract_text() or '')
-            pdf_text = '\n'.join(extracted)
-        except Exception:
-            # pdfplumber不調時はPyPDF2で簡易抽出
-            try:
-                from PyPDF2 import PdfReader  # type: ignore
-                reader = PdfReader(pdf_path)
-                parts = []
-                for page in reader.pages:
-                    parts.append(page.extract_text() or '')
-                pdf_text = '\n'.join(parts)
-            except Exception as e:
-                raise RuntimeError(f'PDFテキスト抽出に失敗しました: {e}')
-
-        trimmed = pdf_text[:15000]
+        mode = 'text'
+        trimmed = _pdf_page_text(pdf_path, first, last)[:15000]
         alt_prompt = (
             "次のPDFテキストから、列 Product Code, Description, OnHand Quantity SC w/o DN, Available を抽出し、"
             "ヘッダ付きのJSON配列で返してください。出力はJSONのみ。\n--- PDF TEXT START ---\n" + trimmed + "\n--- PDF TEXT END ---\n"
         )
         resp = model.generate_content(alt_prompt)
         text = resp.text or ''
+    objs = _parse_gemini_rows(text)
+    return {
+        'pages': [first + 1, last],
+        'mode': mode,
+        'rows': objs,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
 
-    # JSON抽出
-    import json
-    m = re.search(r"\[.*\]", text, flags=re.S)
-    if not m:
-        raise RuntimeError('Geminiの応答からJSONを抽出できませんでした')
-    arr = json.loads(m.group(0))
-
-    # 行化（ヘッダ + データ）
-    # フォーミュラ要件に合わせて A:E の5列を作成
-    # 3列目(C) = OnHand Quantity SC w/o DN, 4列目(D) = Available, 5列目(E) = Availableの複製
-    header = [
-        'Product Code',
-        'Description',
-        'OnHand Quantity SC w/o DN',
-        'Available',
-        'Available (dup)'
+
+def _gemini_model():
+    """(model, upload_file) を返す。必要環境変数: GEMINI_API_KEY"""
+    import google.generativeai as genai  # 遅延import
+
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        raise RuntimeError('環境変数 GEMINI_API_KEY が未設定です')
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel('gemini-2.5-pro'), genai.upload_file
+
+
+def _gemini_objs_to_rows(objs: List[dict]) -> List[List[str]]:
+    """Gemini の JSON 行を [code, desc, onhand, available] に"""
+    return [
+        [str(obj.get(k, '') if obj.get(k) is not None else '').strip()
+         for k in ('Product Code', 'Description', 'OnHand Quantity SC w/o DN', 'Available')]
+        for obj in objs
+        if str(obj.get('Product Code') or '').strip() or str(obj.get('Description') or '').strip()
     ]
-    rows = [header]
-    for obj in arr:
-        rows.append([
+
+
+def _gemini_page_rows(pdf_path: str, first: int, last: int, model, upload_file=None) -> List[List[str]]:
+    """ページ範囲 [first, last) だけを Gemini で抽出（ローカル抽出の不足ページ用）"""
+    from PyPDF2 import PdfReader  # type: ignore
+    chunk_path = _write_pdf_pages(PdfReader(pdf_path), first, last)
+    try:
+        result = _gemini_extract_chunk(model, upload_file, pdf_path, (first, last, chunk_path))
+    finally:
+        try:
+            os.remove(chunk_path)
+        except Exception:
+            pass
+    return _gemini_objs_to_rows(result['rows'])
+
+
+def _local_page_rows(pdf_path: str, first: int, last: int) -> List[List[str]]:
+    """ページ範囲 [first, last) だけを pdfplumber で抽出（Gemini 抽出の不足ページ用）"""
+    import pdfplumber  # type: ignore
+    with pdfplumber.open(pdf_path) as pdf:
+        return [row for page in pdf.pages[first:last] for row in _extract_page_rows(page)[0]]
+
+
+def _iter_gemini_summary_rows(pdf_path: str, model=None, upload_file=None, stats: list = None,
+                              check_pages: bool = False, report: list = None) -> Iterator[List[Any]]:
+    """
+    Gemini 2.5 PRO でPDFから表を抽出し、ヘッダ付き A:E 行として順に yield する。
+    出力トークン上限で行が欠けないよう PDF をページ範囲（GEMINI_PAGES_PER_CHUNK、既定2）に
+    分割し、GEMINI_MAX_WORKERS（既定3）並列で抽出する。チャンクは順番に受け取り、
+    ページ境界で分かれた行を拾うため 1 チャンク分だけ保留して次チャンクの同一コードで
+    空欄を補完してから出す（それより後の重複は先勝ちで捨てる）。
+    model / upload_file を渡すとそれを使う（テスト用スタブ可）。stats にはチャンク毎の
+    ページ範囲・方式・行数・所要時間を追加する。
+    check_pages=True ならチャンク毎にページテキストの明細行数と比べ、足りないチャンクの
+    ページだけ pdfplumber で取り直す（多く取れた方を採用、report に記録）。
+    必要環境変数: GEMINI_API_KEY
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if model is None:
+        model, upload_file = _gemini_model()
+
+    try:
+        pages_per_chunk = max(1, int(os.environ.get('GEMINI_PAGES_PER_CHUNK') or 2))
+        max_workers = max(1, int(os.environ.get('GEMINI_MAX_WORKERS') or 3))
+    except ValueError:
+        pages_per_chunk, max_workers = 2, 3
+    try:
+        chunks = _split_pdf_pages(pdf_path, pages_per_chunk)
+    except Exception:
+        # 分割できないPDFは従来通り一括で送る
+        chunks = [(0, None, pdf_path)]
+
+    def to_row(obj: dict) -> List[Any]:
+        # フォーミュラ要件に合わせて A:E の5列を作成
+        # 3列目(C) = OnHand Quantity SC w/o DN, 4列目(D) = Available, 5列目(E) = Availableの複製
+        return [
             obj.get('Product Code', ''),
             obj.get('Description', ''),
             obj.get('OnHand Quantity SC w/o DN', ''),
             obj.get('Available', ''),
             obj.get('Available', ''),
-        ])
-    return rows
+        ]
+
+    yield list(_SUMMARY_HEADER)
+    emitted = set()
+    pending: dict = {}
+    unnamed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+            # map は投入順に結果を返すので、先頭チャンクの書込中も後続チャンクの抽出が進む
+            results = pool.map(lambda c: _gemini_extract_chunk(model, upload_file, pdf_path, c), chunks)
+            # Gemini の応答待ちの間にページ毎の明細行数を数えておく
+            counts = _pdf_page_item_counts(pdf_path) if check_pages else []
+            for result in results:
+                if counts:
+                    _check_gemini_chunk(pdf_path, result, counts, report)
+                if stats is not None:
+                    stats.append({k: v for k, v in result.items() if k != 'rows'} | {'rows': len(result['rows'])})
+                current: dict = {}
+                for obj in result['rows']:
+                    key = normalize_product_code_key(obj.get('Product Code', ''))
+                    if not key:
+                        unnamed += 1
+                        key = f"#{unnamed}"
+                    if key in emitted:
+                        continue
+                    target = pending.get(key) or current.get(key)
+                    if target is None:
+                        current[key] = dict(obj)
+                        continue
+                    for field, value in obj.items():
+                        if target.get(field) in (None, '') and value not in (None, ''):
+                            target[field] = value
+                for key, obj in pending.items():
+                    emitted.add(key)
+                    yield to_row(obj)
+                pending = current
+    finally:
+        for _, _, chunk_path in chunks:
+            if chunk_path != pdf_path:
+                try:
+                    os.remove(chunk_path)
+                except Exception:
+                    pass
+    for obj in pending.values():
+        yield to_row(obj)
 
 
-def _sheets_create_sheet_if_not_exists(service, spreadsheet_id: str, title: str) -> None:
+def _check_gemini_chunk(pdf_path: str, result: dict, counts: List[int], report: list = None) -> None:
+    """Gemini チャンクの行数がページの明細行数に満たなければ、そのページだけローカル抽出で取り直す"""
+    first = result['pages'][0] - 1
+    last = result['pages'][1] or len(counts)
+    expected = sum(counts[first:last])
+    if len(result['rows']) >= expected:
+        return
+    entry = {
+        'pages': [first + 1, last],
+        'expected': expected,
+        'extracted': len(result['rows']),
+        'retried_with': 'local',
+        'used': 'gemini',
+    }
     try:
-        meta = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        for s in meta.get('sheets', []):
-            if s.get('properties', {}).get('title') == title:
-                return
-        # create
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body={
-                'requests': [{
-                    'addSheet': {
-                        'properties': {'title': title}
-                    }
-                }]
-            }
-        ).execute()
-    except HttpError as e:
-        raise RuntimeError(f'Sheetsのシート作成でエラー: {e}')
+        alt = _local_page_rows(pdf_path, first, last)
+        entry['retry_rows'] = len(alt)
+        if len(alt) > len(result['rows']):
+            result['rows'] = [
+                {'Product Code': code, 'Description': desc, 'OnHand Quantity SC w/o DN': onhand, 'Available': avail}
+                for code, desc, onhand, avail in alt
+            ]
+            entry['used'] = 'local'
+    except Exception as e:
+        entry['error'] = str(e)
+    entry['rows'] = len(result['rows'])
+    _log(logging.WARNING, 'ページ検証で抽出行数が不足', pages=f'{first + 1}-{last}', expected=expected,
+         extracted=entry['extracted'], used=entry['used'])
+    if report is not None:
+        report.append(entry)
 
 
-def _sheets_write_rows(service, spreadsheet_id: str, sheet_title: str, rows: List[List[Any]]):
-    rng = f"{sheet_title}!A1"
-    body = {"values": rows}
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=rng,
-        valueInputOption='USER_ENTERED',
-        body=body
-    ).execute()
+# ---------------------------------------------------------------------------
+# サマリー行の後処理（Apps Script の normalizeText / correctProductCodeErrors /
+# removeDuplicateInventoryItems / formatNumber と同じ結果になるよう移植）
+# ---------------------------------------------------------------------------
+
+# normalizeText: OCR で混入するギリシャ大文字を ASCII に
+_GREEK_TO_ASCII = str.maketrans({
+    'Τ': 'T', 'Ν': 'N', 'Ι': 'I', 'Α': 'A', 'Β': 'B', 'Γ': 'G', 'Δ': 'D', 'Ε': 'E',
+    'Ζ': 'Z', 'Η': 'H', 'Θ': 'TH', 'Κ': 'K', 'Λ': 'L', 'Μ': 'M', 'Ξ': 'X', 'Ο': 'O',
+    'Π': 'P', 'Ρ': 'R', 'Σ': 'S', 'Υ': 'Y', 'Φ': 'F', 'Χ': 'CH', 'Ψ': 'PS', 'Ω': 'W',
+})
+
+# correctProductCodeErrors: 読み取り失敗（I→1）の既知パターン
+_PRODUCT_CODE_CORRECTIONS = {
+    'US05132045M10800': 'US05132045MI0800',
+    'US05132045M10900': 'US05132045MI0900',
+    'UT05125045M10800': 'UT05125045MI0800',
+    'GSW0410800B': 'GSW04I0800B',
+    'GSW0411000B': 'GSW04I1000B',
+    'GSC0810800B': 'GSC08I0800B',
+    'GSC0811000B': 'GSC08I1000B',
+}
+_PRODUCT_CODE_CORRECTIONS_RE = re.compile('|'.join(
+    re.escape(k) for k in sorted(_PRODUCT_CODE_CORRECTIONS, key=len, reverse=True)
+))
+
+_LEADING_NUMBER_RE = re.compile(r'-?(\d+(\.\d*)?|\.\d+)')
+_NON_NUMBER_CHARS_RE = re.compile(r'[^\d.-]')
+
+
+def _normalize_text(text: str) -> str:
+    return text.translate(_GREEK_TO_ASCII)
+
+
+def _correct_product_code_errors(text: str) -> str:
+    if not text:
+        return text
+    return _PRODUCT_CODE_CORRECTIONS_RE.sub(lambda m: _PRODUCT_CODE_CORRECTIONS[m.group(0)], text)
+
+
+def _format_number(value: Any) -> Any:
+    """formatNumber: 数字以外を除いて四捨五入した int に。数値でなければ元の値
+
+    GAS 版は千の位カンマ付き文字列を USER_ENTERED で書いて数値化させていたが、updateCells には
+    int をそのまま numberValue として渡せるので文字列には戻さない（_user_entered_cell の再解析も不要）。
+    """
+    if value is None or value == '':
+        return ''
+    m = _LEADING_NUMBER_RE.match(_NON_NUMBER_CHARS_RE.sub('', str(value)))
+    if not m:
+        return value
+    # JS の Math.round と同じく .5 は正の方向へ丸める（-0 は 0、数値の 0 も空欄にせず 0）
+    return int(math.floor(float(m.group(0)) + 0.5))
+
 
+def _clean_code_stage(row: List[Any]) -> List[Any]:
+    row[0] = _normalize_text(_correct_product_code_errors(str(row[0] or '').strip()))
+    return row
 
-def _sheets_find_last_row_in_stock(service, spreadsheet_id: str) -> int:
+
+def _format_quantity_stage(row: List[Any]) -> List[Any]:
+    for i in range(2, min(len(row), len(_SUMMARY_HEADER))):
+        row[i] = _format_number(row[i])
+    return row
+
+
+def _dedupe_stage():
+    """removeDuplicateInventoryItems: 補正・正規化後のコードが同じ行は先勝ち（コード空欄の行は残す）"""
+    seen = set()
+
+    def stage(row: List[Any]):
+        code = row[0]
+        if code:
+            if code in seen:
+                return None
+            seen.add(code)
+        return row
+    return stage
+
+
+def _clean_summary_rows(rows: Iterable[List[Any]], stages=None) -> Iterator[List[Any]]:
+    """
+    ヘッダ付き A:E 行のストリームに後処理を 1 パスで適用する。
+    stages は行を受け取り行（None なら破棄）を返す関数の列。既定はコード補正・正規化 → 重複除去 → 数量整形。
+    """
+    if stages is None:
+        stages = (_clean_code_stage, _dedupe_stage(), _format_quantity_stage)
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+    for row in rows:
+        row = list(row)
+        if not row:
+            continue
+        for stage in stages:
+            row = stage(row)
+            if row is None:
+                break
+        else:
+            yield row
+
+
+def _sheets_read_stock_codes(service, spreadsheet_id: str) -> List[List[Any]]:
     rng = 'Stock!C:C'
     res = service.spreadsheets().values().get(
         spreadsheetId=spreadsheet_id, range=rng
     ).execute()
-    values = res.get('values', [])
+    return res.get('values', [])
+
+
+def _last_stock_row(values: List[List[Any]]) -> int:
     last = 0
     for i, row in enumerate(values, start=1):
         if row and any(cell.strip() for cell in row if isinstance(cell, str)):
@@ -330,11 +1151,7 @@ def _sheets_find_last_row_in_stock(service, spreadsheet_id: str) -> int:
     return max(last, 2)
 
 
-def _sheets_update_stock_formulas(service, spreadsheet_id: str, summary_title: str):
-    last_row = _sheets_find_last_row_in_stock(service, spreadsheet_id)
-    if last_row < 2:
-        return
-
+def _stock_formula_rows(summary_title: str, last_row: int) -> List[List[str]]:
     # 行別に I/J/K の式を生成
     updates = []
     for r in range(2, last_row + 1):
@@ -342,42 +1159,479 @@ def _sheets_update_stock_formulas(service, spreadsheet_id: str, summary_title: s
         j_formula = f"=IFERROR(VLOOKUP($C{r},{summary_title}!$A:$E, 4, 0), 0)"
         k_formula = f"=IFERROR(VLOOKUP($C{r},{summary_title}!$A:$E, 5, 0), 0)"
         updates.append([i_formula, j_formula, k_formula])
+    return updates
 
-    rng = f"Stock!I2:K{last_row}"
-    body = {"values": updates}
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=rng,
-        valueInputOption='USER_ENTERED',
-        body=body
-    ).execute()
 
+def _add_summary_lookup(lookup: dict, row: List[Any]) -> None:
+    """サマリー 1 行を VLOOKUP 相当の照合表に追加（大文字小文字無視・先頭優先）"""
+    if not row:
+        return
+    key = str(row[0]).casefold()
+    if key and key not in lookup:
+        # 参照先が空セルなら VLOOKUP も空を返すため空のまま
+        lookup[key] = [row[i] if len(row) > i and row[i] is not None else '' for i in (2, 3, 4)]
 
-def run_inventory_sync() -> dict:
-    """メイン処理。例外は呼び出し側でHTTP 500に変換してください。"""
-    service, spreadsheet_id = _ensure_sheets_service()
 
-    pdf_path = _find_latest_inventory_pdf_from_gmail()
-    # 実行優先度: Vercel or FORCE_GEMINI=1 → Gemini優先、それ以外はローカル優先
-    prefer_gemini = bool(os.environ.get('VERCEL')) or os.environ.get('FORCE_GEMINI') == '1'
+def _stock_values_from_lookup(stock_codes: List[List[Any]], lookup: dict) -> List[List[Any]]:
+    last_row = _last_stock_row(stock_codes)
+    values = []
+    for r in range(2, last_row + 1):
+        cell = stock_codes[r - 1] if r - 1 < len(stock_codes) else []
+        code = str(cell[0]).casefold() if cell else ''
+        values.append(lookup.get(code, [0, 0, 0]) if code else [0, 0, 0])
+    return values
+
+
+def _stock_write_mode(mode: str = None) -> str:
+    """Stock!I:K の書込方式。'formulas'（既定、VLOOKUP 式）または 'values'（計算済み値）"""
+    mode = (mode or os.environ.get('INVENTORY_STOCK_WRITE_MODE') or 'formulas').strip().lower()
+    return 'values' if mode == 'values' else 'formulas'
+
+
+_USER_ENTERED_NUMBER = re.compile(r'^[+-]?(\d{1,3}(,\d{3})+|\d+)?(\.\d+)?$')
+
+
+def _user_entered_cell(value: Any) -> dict:
+    """valueInputOption=USER_ENTERED 相当の CellData（updateCells 用）
+
+    再現するのは 式（=...）・数値（カンマ区切り・小数）・真偽値のみ。日付・時刻・パーセント・通貨は
+    書式も伴うため解釈せず文字列のまま書く（同期で書く列はコード・品名・数量なので該当しない）。
+    """
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    text = str(value)
+    if text.startswith('='):
+        return {'userEnteredValue': {'formulaValue': text}}
+    stripped = text.strip()
+    if stripped and stripped not in ('+', '-') and _USER_ENTERED_NUMBER.match(stripped) \
+            and any(ch.isdigit() for ch in stripped):
+        return {'userEnteredValue': {'numberValue': float(stripped.replace(',', ''))}}
+    return {'userEnteredValue': {'stringValue': text}}
+
+
+def _update_cells_request(sheet_id: int, row_index: int, column_index: int, rows: List[List[Any]]) -> dict:
+    return {
+        'updateCells': {
+            'start': {'sheetId': sheet_id, 'rowIndex': row_index, 'columnIndex': column_index},
+            'rows': [{'values': [_user_entered_cell(v) for v in row]} for row in rows],
+            'fields': 'userEnteredValue',
+        }
+    }
+
+
+# addSheet で作るサマリーシートの初期行数（超える分は appendDimension で追加）
+_SUMMARY_GRID_ROWS = 1000
+
+
+class _SheetsWriteError(RuntimeError):
+    """Sheets 書込の失敗（抽出失敗と区別してフォールバックさせないため）"""
+
+
+_SHEETS_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _sheets_chunk_settings() -> Tuple[int, int]:
+    """(1 回の batchUpdate で書く行数, チャンク毎の再試行回数)
+
+    既定 500 行は 1 リクエストの大きさを抑えるための上限で、通常のレポート（200 行前後）は
+    addSheet・差し替え・Stock!I:K と合わせて batchUpdate 1 回（往復最少）で書く。
+    分割されるのは想定外に大きいレポートだけで、途中で失敗しても書いているのは作業用シートなので
+    本番シートは崩れない（_sheets_write_sync_batch 参照）。
+    """
+    try:
+        chunk_rows = max(1, int(os.environ.get('INVENTORY_SHEETS_CHUNK_ROWS') or 500))
+        retries = max(0, int(os.environ.get('INVENTORY_SHEETS_CHUNK_RETRIES') or 3))
+    except ValueError:
+        chunk_rows, retries = 500, 3
+    return chunk_rows, retries
+
 
-    rows: List[List[Any]]
-    if prefer_gemini:
+def _sheets_batch_update(service, spreadsheet_id: str, requests: List[dict], retries: int) -> None:
+    """batchUpdate を 429/5xx・通信エラー時に指数バックオフで再試行"""
+    for attempt in range(retries + 1):
         try:
-            rows = _extract_table_with_gemini(pdf_path)
-        except Exception:
-            # Gemini失敗時はローカルにフォールバック
-            rows = _extract_table_locally(pdf_path)
-    else:
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'requests': requests},
+            ).execute()
+            return
+        except HttpError as e:
+            status = int(getattr(getattr(e, 'resp', None), 'status', 0) or 0)
+            if attempt and status == 400 and any(
+                    marker in str(e) for marker in ('already exists', 'No sheet with id', 'No grid with id')):
+                # 前回の試行は応答を失っただけで反映済み（batchUpdate は全件成功か全件無効なので
+                # addSheet の重複・deleteSheet 済みの sheetId で失敗するのは反映済みの場合だけ）
+                return
+            if attempt >= retries or status not in _SHEETS_RETRY_STATUSES:
+                raise _SheetsWriteError(f'Sheetsへの書込でエラー: {e}')
+        except (OSError, TimeoutError) as e:
+            if attempt >= retries:
+                raise _SheetsWriteError(f'Sheetsへの書込でエラー: {e}')
+        time.sleep(min(8.0, 0.5 * (2 ** attempt)))
+
+
+# 書込中のサマリーを置く作業用シート名（<本番シート名> + この接尾辞）
+_SUMMARY_STAGING_SUFFIX = '_staging'
+
+
+def _sheets_write_sync_batch(service, spreadsheet_id: str, title: str, rows: Iterable[List[Any]],
+                             stock_mode: str, timings: dict = None) -> int:
+    """
+    同期結果の書込:
+      1) シート一覧（sheetId/title/index/グリッド行数のみ）を取得
+      2) Stock!C:C を読む（I/J/K の行数決定・値モードの突合用）
+      3) rows を受け取った順に INVENTORY_SHEETS_CHUNK_ROWS 行（既定500）ずつ作業用シート
+         （title + _SUMMARY_STAGING_SUFFIX）へ updateCells で書く。先頭チャンクに addSheet
+         （前回の失敗で残った作業用シートがあれば deleteSheet も）を同梱し、チャンク毎に再試行する。
+         updateCells はグリッドを広げないため、行数が足りなければ同じ batchUpdate の先頭で appendDimension する。
+      4) 最終チャンクで 旧 title シートの deleteSheet → 作業用シートを title へ改名（旧シートの位置へ）→
+         Stock!I:K の書込 を 1 回の batchUpdate で行う。batchUpdate は全件成功か全件無効なので、
+         抽出や書込が途中で失敗しても本番のシートと Stock!I:K は前回の内容のまま残る。
+    rows はジェネレータでよい（抽出しながら書く）。失敗時は作業用シートを消してから例外を送出する。
+    書いた行数（ヘッダ含む）を返す。
+    """
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+    try:
+        meta = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties(sheetId,title,index,gridProperties.rowCount)',
+        ).execute()
+    except HttpError as e:
+        raise _SheetsWriteError(f'Sheetsのシート情報取得でエラー: {e}')
+    sheet_ids = {}
+    sheet_index = {}
+    for s in meta.get('sheets', []):
+        props = s.get('properties', {})
+        sheet_ids[props.get('title')] = props.get('sheetId', 0)
+        sheet_index[props.get('title')] = props.get('index', 0)
+    if 'Stock' not in sheet_ids:
+        raise _SheetsWriteError('Stockシートが見つかりません')
+    timings['sheets_meta_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    try:
+        stock_codes = _sheets_read_stock_codes(service, spreadsheet_id)
+    except HttpError as e:
+        raise _SheetsWriteError(f'Stockシートの読込でエラー: {e}')
+    timings['stock_read_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    chunk_rows, retries = _sheets_chunk_settings()
+    staging_title = title + _SUMMARY_STAGING_SUFFIX
+    requests = []
+    if staging_title in sheet_ids:
+        # 前回の失敗で残った作業用シート
+        requests.append({'deleteSheet': {'sheetId': sheet_ids[staging_title]}})
+    # 新規シートの sheetId をこちらで決めておけば同じ batchUpdate 内で書き込める
+    staging_id = max(sheet_ids.values()) + 1
+    grid_rows = _SUMMARY_GRID_ROWS
+    requests.append({'addSheet': {'properties': {
+        'sheetId': staging_id, 'title': staging_title,
+        'gridProperties': {'rowCount': _SUMMARY_GRID_ROWS, 'columnCount': 26},
+    }}})
+
+    write_ms = 0.0
+    chunks = 0
+    written = 0
+    buffer: List[List[Any]] = []
+    lookup: dict = {}
+
+    def ensure_rows(requests: List[dict], end_row: int) -> None:
+        """作業用シートを end_row 行まで広げる（再試行で二重に効いても空行が増えるだけ）"""
+        nonlocal grid_rows
+        if end_row <= grid_rows:
+            return
+        length = max(end_row - grid_rows, chunk_rows)
+        position = next((i + 1 for i, rq in enumerate(requests) if 'addSheet' in rq), 0)
+        requests.insert(position, {'appendDimension': {
+            'sheetId': staging_id, 'dimension': 'ROWS', 'length': length,
+        }})
+        grid_rows += length
+
+    def flush(requests: List[dict]) -> None:
+        nonlocal write_ms, chunks
+        sent = time.perf_counter()
+        _sheets_batch_update(service, spreadsheet_id, requests, retries)
+        write_ms += (time.perf_counter() - sent) * 1000
+        chunks += 1
+
+    stream_started = time.perf_counter()
+    try:
+        for row in rows:
+            if stock_mode == 'values' and (written or buffer):
+                _add_summary_lookup(lookup, row)
+            buffer.append(row)
+            if len(buffer) >= chunk_rows:
+                ensure_rows(requests, written + len(buffer))
+                requests.append(_update_cells_request(staging_id, written, 0, buffer))
+                flush(requests)
+                written += len(buffer)
+                requests, buffer = [], []
+        if buffer:
+            ensure_rows(requests, written + len(buffer))
+            requests.append(_update_cells_request(staging_id, written, 0, buffer))
+            written += len(buffer)
+        if title in sheet_ids:
+            requests.append({'deleteSheet': {'sheetId': sheet_ids[title]}})
+            requests.append({'updateSheetProperties': {
+                'properties': {'sheetId': staging_id, 'title': title, 'index': sheet_index[title]},
+                'fields': 'title,index',
+            }})
+        else:
+            requests.append({'updateSheetProperties': {
+                'properties': {'sheetId': staging_id, 'title': title},
+                'fields': 'title',
+            }})
+        if stock_mode == 'values':
+            stock_rows = _stock_values_from_lookup(stock_codes, lookup)
+        else:
+            stock_rows = _stock_formula_rows(title, _last_stock_row(stock_codes))
+        if stock_rows:
+            # Stock!I2 起点（0 始まりで行 1・列 8）
+            requests.append(_update_cells_request(sheet_ids['Stock'], 1, 8, stock_rows))
+        flush(requests)
+    except Exception:
+        if chunks:
+            # 作業用シートは作成済み（消せなくても次回の先頭チャンクで消える）
+            try:
+                service.spreadsheets().batchUpdate(
+                    spreadsheetId=spreadsheet_id,
+                    body={'requests': [{'deleteSheet': {'sheetId': staging_id}}]},
+                ).execute()
+            except Exception:
+                pass
+        raise
+
+    timings['sheets_write_ms'] = round(write_ms, 1)
+    # 書込待ち以外の時間 = 抽出側を待っていた時間
+    timings['extract_ms'] = round((time.perf_counter() - stream_started) * 1000 - write_ms, 1)
+    timings['sheets_chunks'] = chunks
+    return written
+
+
+def _sync_state_path() -> str:
+    return os.environ.get('INVENTORY_SYNC_STATE_PATH') or os.path.join(
+        tempfile.gettempdir(), 'inventory_sync_state.json'
+    )
+
+
+def _file_sha256(path: str) -> str:
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 抽出ロジックを変えたら上げる（キャッシュ済み結果を無効化するため）
+_EXTRACTOR_VERSIONS = {
+    'local': 'local-3',
+    'hybrid': 'hybrid-1',
+    'gemini': 'gemini-2.5-pro-chunked-2',
+}
+
+
+def _extract_cache_dir() -> str:
+    return os.environ.get('INVENTORY_EXTRACT_CACHE_DIR') or os.path.join(
+        tempfile.gettempdir(), 'inventory_extract_cache'
+    )
+
+
+def _extract_cache_file(pdf_sha256: str, extractor: str) -> str:
+    return os.path.join(
+        _extract_cache_dir(), f'{pdf_sha256}_{_EXTRACTOR_VERSIONS[extractor]}.jsonl'
+    )
+
+
+def _iter_cached_rows(path: str) -> Iterator[List[Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield _json.loads(line)
+
+
+def _load_cached_rows(pdf_sha256: str, extractor: str):
+    """PDF の SHA-256 + 抽出器バージョンで抽出結果（1行1JSON）を引く。無ければ None、有れば行のイテレータ"""
+    path = _extract_cache_file(pdf_sha256, extractor)
+    try:
+        if not os.path.getsize(path):
+            return None
+        os.utime(path)  # LRU 追い出し用に参照時刻を更新
+    except OSError:
+        return None
+    return _iter_cached_rows(path)
+
+
+def _prune_extract_cache(cache_dir: str) -> None:
+    """合計サイズが INVENTORY_EXTRACT_CACHE_MAX_BYTES を超えたら古い順に削除"""
+    try:
+        max_bytes = int(os.environ.get('INVENTORY_EXTRACT_CACHE_MAX_BYTES') or 20 * 1024 * 1024)
+    except ValueError:
+        max_bytes = 20 * 1024 * 1024
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.jsonl'):
+            continue
+        full = os.path.join(cache_dir, name)
+        st = os.stat(full)
+        entries.append((st.st_mtime, st.st_size, full))
+    total = sum(size for _, size, _ in entries)
+    for _, size, full in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(full)
+        total -= size
+
+
+def _page_check_failed(entry: dict) -> bool:
+    """ページ検証の記録が「取り直しても不足 / 取り直しに失敗」か"""
+    return bool(entry.get('error')) or entry.get('rows', entry.get('extracted', 0)) < entry.get('expected', 0)
+
+
+def _extract_rows_cached(pdf_path: str, pdf_sha256: str, extractor: str, iterate,
+                         report: list = None) -> Iterator[List[Any]]:
+    """抽出結果を流しながら一時ファイルに書き、最後まで抽出できたらキャッシュとして確定する
+
+    report（ページ検証の記録）にこの抽出中に不足・失敗が残った場合は保存しない
+    （劣化した結果を再試行のたびに使い回さないため）。
+    """
+    checks_from = len(report) if report is not None else 0
+    cached = _load_cached_rows(pdf_sha256, extractor)
+    if cached is not None:
+        yield from cached
+        return
+    path = _extract_cache_file(pdf_sha256, extractor)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        out = open(tmp_path, 'w', encoding='utf-8')
+    except Exception as e:
+        _log(logging.WARNING, '抽出キャッシュ保存失敗', extractor=extractor, error=str(e))
+        out = None
+    completed = False
+    try:
+        for row in iterate(pdf_path):
+            if out is not None:
+                out.write(_json.dumps(row, ensure_ascii=False) + '\n')
+            yield row
+        completed = True
+    finally:
+        if out is not None:
+            out.close()
+            degraded = report is not None and any(_page_check_failed(e) for e in report[checks_from:])
+            if completed and degraded:
+                _log(logging.WARNING, 'ページ検証で不足が残ったため抽出結果はキャッシュしません', extractor=extractor)
+            try:
+                if completed and not degraded:
+                    os.replace(tmp_path, path)
+                    _prune_extract_cache(os.path.dirname(path))
+                else:
+                    os.remove(tmp_path)
+            except Exception as e:
+                _log(logging.WARNING, '抽出キャッシュ保存失敗', extractor=extractor, error=str(e))
+
+
+def run_inventory_sync(force: bool = False, stock_mode: str = None) -> dict:
+    """メイン処理。例外は呼び出し側でHTTP 500に変換してください。
+
+    前回成功時のメール UID と PDF の SHA-256 を INVENTORY_SYNC_STATE_PATH に保存し、
+    新着メールが無い／PDF が前回と同一の場合は抽出と Sheets 書込を省略する。
+    force=True または INVENTORY_SYNC_FORCE=1 で常に再処理。
+    stock_mode（INVENTORY_STOCK_WRITE_MODE）= 'values' で Stock!I:K に式ではなく値を書く。
+    戻り値の timings に各段階の所要時間（ミリ秒）を含める。
+    """
+    force = force or os.environ.get('INVENTORY_SYNC_FORCE') == '1'
+    state = {} if force else _load_json_state(_sync_state_path())
+    sync_started = time.perf_counter()
+    timings = {}
+
+    started = time.perf_counter()
+    pdf_path, cursor = _find_latest_inventory_pdf_from_gmail(state.get('mail_cursor'))
+    timings['mail_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    if not pdf_path:
+        return {
+            'ok': True,
+            'skipped': True,
+            'reason': 'no new inventory mail',
+            'sheet': state.get('sheet'),
+            'wrote_rows': 0,
+        }
+    pdf_sha256 = _file_sha256(pdf_path)
+    if pdf_sha256 == state.get('pdf_sha256'):
         try:
-            rows = _extract_table_locally(pdf_path)
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
         except Exception:
-            rows = _extract_table_with_gemini(pdf_path)
+            pass
+        state['mail_cursor'] = cursor or state.get('mail_cursor')
+        _save_json_state(_sync_state_path(), state)
+        return {
+            'ok': True,
+            'skipped': True,
+            'reason': 'inventory pdf unchanged',
+            'sheet': state.get('sheet'),
+            'wrote_rows': 0,
+        }
+
+    service, spreadsheet_id = _ensure_sheets_service()
+    # 抽出モード: INVENTORY_EXTRACT_MODE=hybrid（既定）|local|gemini、FORCE_GEMINI=1 は gemini 扱い
+    mode = (os.environ.get('INVENTORY_EXTRACT_MODE') or '').strip().lower()
+    if mode not in ('hybrid', 'local', 'gemini'):
+        mode = 'gemini' if os.environ.get('FORCE_GEMINI') == '1' else 'hybrid'
+
+    gemini_chunks: list = []
+    # ページ毎の採点結果（不合格ページのみ）。hybrid は不合格ページだけ Gemini、gemini は不足チャンクをローカルで取り直す
+    page_checks: list = []
+    extractors = {
+        'hybrid': lambda path: _iter_local_summary_rows(path, check_pages=True, report=page_checks),
+        'local': _iter_local_summary_rows,
+        'gemini': lambda path: _iter_gemini_summary_rows(
+            path, stats=gemini_chunks, check_pages=True, report=page_checks
+        ),
+    }
+    order = {
+        'hybrid': ['hybrid', 'gemini'],
+        'local': ['local', 'gemini'],
+        'gemini': ['gemini', 'hybrid'],
+    }[mode]
+    # 同じPDFの再処理（リトライ等）は抽出済み結果を再利用
+    cached = ''
+    for name in order:
+        if os.path.exists(_extract_cache_file(pdf_sha256, name)):
+            order.remove(name)
+            order.insert(0, name)
+            cached = name
+            break
 
     title = _fmt_report_sheet_title()
-    _sheets_create_sheet_if_not_exists(service, spreadsheet_id, title)
-    _sheets_write_rows(service, spreadsheet_id, title, rows)
-    _sheets_update_stock_formulas(service, spreadsheet_id, title)
+    stock_mode = _stock_write_mode(stock_mode)
+    # 抽出（ページ/チャンク単位の生成）→ コード補正・重複除去・数量整形 → チャンク書込を1本のパイプラインで流す
+    extracted_by = f'{cached} (cache)' if cached else order[0]
+    try:
+        wrote_rows = _sheets_write_sync_batch(
+            service, spreadsheet_id, title,
+            _clean_summary_rows(_extract_rows_cached(
+                pdf_path, pdf_sha256, order[0], extractors[order[0]], report=page_checks,
+            )),
+            stock_mode, timings,
+        )
+    except _SheetsWriteError:
+        raise
+    except Exception:
+        # 優先側が失敗したらもう一方にフォールバック（途中まで書いた分は作業用シートごと破棄済み）
+        extracted_by = order[1]
+        wrote_rows = _sheets_write_sync_batch(
+            service, spreadsheet_id, title,
+            _clean_summary_rows(_extract_rows_cached(
+                pdf_path, pdf_sha256, order[1], extractors[order[1]], report=page_checks,
+            )),
+            stock_mode, timings,
+        )
 
     try:
         if os.path.exists(pdf_path):
@@ -385,10 +1639,372 @@ def run_inventory_sync() -> dict:
     except Exception:
         pass
 
-    return {
+    timings['total_ms'] = round((time.perf_counter() - sync_started) * 1000, 1)
+    _save_json_state(_sync_state_path(), {
+        'mail_cursor': cursor,
+        'pdf_sha256': pdf_sha256,
+        'sheet': title,
+        'synced_at': _now_jst().isoformat(),
+    })
+    result = {
         'ok': True,
         'sheet': title,
-        'wrote_rows': len(rows),
+        'wrote_rows': wrote_rows,
+        'extracted_by': extracted_by,
+        'extract_mode': mode,
+        'stock_mode': stock_mode,
+        'timings': timings,
     }
+    if gemini_chunks:
+        result['gemini_chunks'] = gemini_chunks
+    if page_checks:
+        result['page_checks'] = page_checks
+    return result
+
+
+# ---------------------------------------------------------------------------
+# 同期ランナー: 多重実行防止ロック・バックグラウンド実行・定時スケジューラ・実行履歴
+# ---------------------------------------------------------------------------
+
+_SYNC_LOCK_NAME = 'inventory_sync'
+_sync_executor = None
+_sync_executor_lock = None
+_sync_scheduler_thread = None
+
+
+def _now_hkt() -> datetime:
+    # Apps Script（checkScheduledTime）と同じく香港時間で判定
+    return datetime.now(timezone(timedelta(hours=8)))
+
+
+def _sync_db_path() -> str:
+    return os.environ.get('INVENTORY_SYNC_DB_PATH') or os.path.join(
+        tempfile.gettempdir(), 'inventory_sync.sqlite3'
+    )
+
+
+def _sync_db():
+    """ロックと実行履歴の SQLite（同一ホストの複数プロセス間で共有）"""
+    import sqlite3
+    conn = sqlite3.connect(_sync_db_path(), timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS sync_lock ('
+        ' name TEXT PRIMARY KEY, owner TEXT NOT NULL, acquired_at REAL NOT NULL, expires_at REAL NOT NULL)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS sync_runs ('
+        ' run_id TEXT PRIMARY KEY, trigger TEXT NOT NULL, slot TEXT NOT NULL DEFAULT \'\','
+        ' status TEXT NOT NULL, started_at REAL NOT NULL, finished_at REAL,'
+        ' result TEXT, error TEXT)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS sync_runs_started ON sync_runs (started_at)')
+    return conn
+
+
+def _sync_lock_ttl() -> int:
+    """ロック期限（秒）。実行中はハートビートで延長するので、異常終了したプロセスのロックが外れるまでの時間"""
+    try:
+        return max(60, int(os.environ.get('INVENTORY_SYNC_LOCK_TTL_SECONDS') or 900))
+    except ValueError:
+        return 900
+
+
+def _acquire_sync_lock(owner: str) -> bool:
+    """ロック取得。保持者がいても期限切れ（プロセス異常終了など）なら奪う"""
+    now = time.time()
+    conn = _sync_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT owner, expires_at FROM sync_lock WHERE name = ?', (_SYNC_LOCK_NAME,)).fetchone()
+        if row is not None and row['expires_at'] > now:
+            conn.execute('ROLLBACK')
+            return False
+        if row is not None:
+            # 期限切れのまま残っていた実行は放棄扱いにする
+            conn.execute(
+                "UPDATE sync_runs SET status = 'abandoned', finished_at = ? "
+                "WHERE run_id = ? AND status IN ('queued', 'running')",
+                (now, row['owner']),
+            )
+        conn.execute(
+            'INSERT OR REPLACE INTO sync_lock (name, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?)',
+            (_SYNC_LOCK_NAME, owner, now, now + _sync_lock_ttl()),
+        )
+        conn.execute('COMMIT')
+        return True
+    finally:
+        conn.close()
+
+
+def _refresh_sync_lock(owner: str) -> bool:
+    """保持中のロックの期限を延長。既に奪われていれば False"""
+    conn = _sync_db()
+    try:
+        cur = conn.execute(
+            'UPDATE sync_lock SET expires_at = ? WHERE name = ? AND owner = ?',
+            (time.time() + _sync_lock_ttl(), _SYNC_LOCK_NAME, owner),
+        )
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def _start_sync_lock_heartbeat(owner: str):
+    """実行中は TTL の 1/3 ごとにロック期限を延長するスレッド。戻り値の Event を set すると止まる"""
+    import threading
+
+    stop = threading.Event()
+
+    def beat():
+        interval = _sync_lock_ttl() / 3
+        while not stop.wait(interval):
+            try:
+                if not _refresh_sync_lock(owner):
+                    _log(logging.WARNING, '在庫同期ロックを失いました', owner=owner)
+                    return
+            except Exception as e:
+                _log(logging.WARNING, '在庫同期ロックの延長でエラー', owner=owner, error=str(e))
+
+    threading.Thread(target=beat, name='inventory-sync-lock-heartbeat', daemon=True).start()
+    return stop
+
+
+def _release_sync_lock(owner: str) -> None:
+    conn = _sync_db()
+    try:
+        conn.execute('DELETE FROM sync_lock WHERE name = ? AND owner = ?', (_SYNC_LOCK_NAME, owner))
+    finally:
+        conn.close()
+
 
+def _sync_check_times() -> List[str]:
+    raw = os.environ.get('INVENTORY_SYNC_CHECK_TIMES') or '08:05,13:05,18:17'
+    return [t.strip() for t in raw.split(',') if re.match(r'^\d{1,2}:\d{2}$', t.strip())]
 
+
+def _sync_window_minutes() -> int:
+    try:
+        return max(0, int(os.environ.get('INVENTORY_SYNC_WINDOW_MINUTES') or 10))
+    except ValueError:
+        return 10
+
+
+def _scheduled_slot(now: datetime = None) -> str:
+    """checkScheduledTime 相当。指定時刻 ± INVENTORY_SYNC_WINDOW_MINUTES 内ならその枠名、外なら空文字
+
+    日曜日は処理しない。
+    """
+    now = now or _now_hkt()
+    if now.weekday() == 6:
+        return ''
+    current = now.hour * 60 + now.minute
+    window = _sync_window_minutes()
+    for check_time in _sync_check_times():
+        hour, minute = (int(x) for x in check_time.split(':'))
+        if abs(current - (hour * 60 + minute)) <= window:
+            return f"{now:%Y-%m-%d} {hour:02d}:{minute:02d}"
+    return ''
+
+
+def _sync_run_row(row) -> dict:
+    result = _json.loads(row['result']) if row['result'] else None
+    finished_at = row['finished_at']
+    return {
+        'run_id': row['run_id'],
+        'trigger': row['trigger'],
+        'slot': row['slot'] or None,
+        'status': row['status'],
+        'started_at': datetime.fromtimestamp(row['started_at'], timezone.utc).isoformat(),
+        'finished_at': datetime.fromtimestamp(finished_at, timezone.utc).isoformat() if finished_at else None,
+        'duration_ms': round((finished_at - row['started_at']) * 1000, 1) if finished_at else None,
+        'timings': (result or {}).get('timings') or {},
+        'result': result,
+        'error': row['error'],
+    }
+
+
+def _record_sync_run(run_id: str, **fields) -> None:
+    conn = _sync_db()
+    try:
+        if conn.execute('SELECT 1 FROM sync_runs WHERE run_id = ?', (run_id,)).fetchone() is None:
+            conn.execute(
+                'INSERT INTO sync_runs (run_id, trigger, slot, status, started_at) VALUES (?, ?, ?, ?, ?)',
+                (run_id, fields.get('trigger', ''), fields.get('slot', ''), fields.get('status', 'queued'), time.time()),
+            )
+            return
+        sets = ', '.join(f'{k} = ?' for k in fields)
+        conn.execute(f'UPDATE sync_runs SET {sets} WHERE run_id = ?', (*fields.values(), run_id))
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _profiled(label: str, enabled: bool = True):
+    """enabled なら with 内を cProfile で計測し、終了時（例外時も）に保存して info['profile_id'] に入れる
+
+    保存先・ID 形式・世代管理は app.py の /api/profiles と共用（profile_store）。計測対象は呼出スレッドのみ。
+    他の計測（リクエストのプロファイル等）が動いていれば計測せずに実行する。
+    """
+    info = {}
+    profiler = start_profiler() if enabled else None
+    if profiler is None:
+        if enabled:
+            _log(logging.INFO, '他の計測が動いているためプロファイルを省略', label=label)
+        yield info
+        return
+    try:
+        yield info
+    finally:
+        stop_profiler(profiler)
+        try:
+            info['profile_id'] = save_profile(profiler, label)
+            _log(logging.INFO, 'プロファイル保存', label=label, profile_id=info['profile_id'])
+        except OSError as e:
+            _log(logging.WARNING, 'プロファイル保存失敗', label=label, error=str(e))
+
+
+def _execute_sync_run(run_id: str, force: bool, stock_mode: str, profile: bool = False) -> dict:
+    heartbeat = _start_sync_lock_heartbeat(run_id)
+    try:
+        _record_sync_run(run_id, status='running')
+        # 抽出のプロセスプール・Gemini スレッド内の処理は含まれない（待ち時間として現れる）
+        profiling = profile or os.environ.get('INVENTORY_SYNC_PROFILE') == '1'
+        try:
+            with _profiled('run_inventory_sync', enabled=profiling) as profiled:
+                result = run_inventory_sync(force=force, stock_mode=stock_mode)
+        except Exception as e:
+            _log(logging.ERROR, '在庫同期失敗', exc_info=True, run_id=run_id, error=str(e),
+                 error_type=type(e).__name__)
+            # 失敗した実行のプロファイルも履歴から辿れるようにする
+            failed = {'profile_id': profiled['profile_id']} if profiled.get('profile_id') else None
+            _record_sync_run(run_id, status='error', finished_at=time.time(), error=str(e),
+                             result=_json.dumps(failed) if failed else None)
+            raise
+        if profiled.get('profile_id'):
+            result = dict(result, profile_id=profiled['profile_id'])
+        status = 'skipped' if result.get('skipped') else 'ok'
+        _record_sync_run(run_id, status=status, finished_at=time.time(),
+                         result=_json.dumps(result, ensure_ascii=False))
+        return result
+    finally:
+        heartbeat.set()
+        _release_sync_lock(run_id)
+
+
+def submit_inventory_sync(trigger: str = 'manual', force: bool = False, stock_mode: str = None,
+                          slot: str = '', profile: bool = False):
+    """
+    在庫同期をバックグラウンドスレッドで開始する。
+    既に実行中（ロック保持中）なら (None, None) を返す。開始できたら (run_id, Future)。
+    profile=True（または INVENTORY_SYNC_PROFILE=1）で cProfile を取り、結果に profile_id を付ける。
+    """
+    import threading
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+
+    global _sync_executor, _sync_executor_lock
+    run_id = uuid.uuid4().hex
+    if not _acquire_sync_lock(run_id):
+        return None, None
+    try:
+        _record_sync_run(run_id, trigger=trigger, slot=slot, status='queued')
+        if _sync_executor_lock is None:
+            _sync_executor_lock = threading.Lock()
+        with _sync_executor_lock:
+            if _sync_executor is None:
+                _sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inventory-sync')
+        future = _sync_executor.submit(_execute_sync_run, run_id, force, stock_mode, profile)
+    except Exception:
+        _release_sync_lock(run_id)
+        raise
+    return run_id, future
+
+
+def _sync_retry_policy() -> Tuple[int, int]:
+    """(再トライ間隔（分）, 最大再トライ回数)。Apps Script の RETRY_DELAY_MINUTES / MAX_RETRY_ATTEMPTS 相当"""
+    try:
+        delay = max(1, int(os.environ.get('INVENTORY_SYNC_RETRY_MINUTES') or 3))
+        attempts = max(0, int(os.environ.get('INVENTORY_SYNC_MAX_RETRIES') or 2))
+    except ValueError:
+        delay, attempts = 3, 2
+    return delay, attempts
+
+
+def run_scheduled_sync_tick(now: datetime = None) -> dict:
+    """
+    定時実行の 1 回分の判定。時間枠内で、その枠でまだ成功していなければ同期を開始する。
+    新着メールなし・失敗の場合は INVENTORY_SYNC_RETRY_MINUTES 後に最大 INVENTORY_SYNC_MAX_RETRIES 回まで再トライ。
+    スケジューラスレッドと外部 cron（/api/sync/run?scheduled=1、このモジュールを含む常駐サーバー向け）の両方から呼ぶ。
+    """
+    slot = _scheduled_slot(now)
+    if not slot:
+        return {'started': False, 'reason': 'outside schedule window'}
+    conn = _sync_db()
+    try:
+        runs = conn.execute(
+            'SELECT status, started_at FROM sync_runs WHERE slot = ? ORDER BY started_at', (slot,)
+        ).fetchall()
+    finally:
+        conn.close()
+    delay, max_retries = _sync_retry_policy()
+    if any(r['status'] == 'ok' for r in runs):
+        return {'started': False, 'slot': slot, 'reason': 'slot already handled'}
+    if len(runs) > max_retries:
+        return {'started': False, 'slot': slot, 'reason': 'retry limit reached'}
+    if runs and time.time() - runs[-1]['started_at'] < delay * 60:
+        return {'started': False, 'slot': slot, 'reason': 'waiting for retry'}
+    run_id, _ = submit_inventory_sync(trigger='schedule', slot=slot)
+    if run_id is None:
+        return {'started': False, 'slot': slot, 'reason': 'sync already running'}
+    return {'started': True, 'slot': slot, 'run_id': run_id}
+
+
+def start_inventory_sync_scheduler(interval_seconds: int = 60) -> bool:
+    """run_scheduled_sync_tick を一定間隔で呼ぶデーモンスレッドを起動（常駐プロセス用、二重起動しない）"""
+    import threading
+
+    global _sync_scheduler_thread
+    if _sync_scheduler_thread is not None and _sync_scheduler_thread.is_alive():
+        return False
+
+    def loop():
+        while True:
+            try:
+                tick = run_scheduled_sync_tick()
+                if tick.get('started'):
+                    _log(logging.INFO, '定時在庫同期開始', slot=tick['slot'], run_id=tick['run_id'])
+            except Exception as e:
+                _log(logging.WARNING, '定時在庫同期の判定でエラー', error=str(e))
+            time.sleep(interval_seconds)
+
+    _sync_scheduler_thread = threading.Thread(target=loop, name='inventory-sync-scheduler', daemon=True)
+    _sync_scheduler_thread.start()
+    return True
+
+
+def get_sync_status(limit: int = 10) -> dict:
+    """実行中の同期・直近の実行履歴（段階別所要時間つき）・スケジュール設定を返す"""
+    conn = _sync_db()
+    try:
+        lock = conn.execute('SELECT owner, acquired_at, expires_at FROM sync_lock WHERE name = ?',
+                            (_SYNC_LOCK_NAME,)).fetchone()
+        rows = conn.execute('SELECT * FROM sync_runs ORDER BY started_at DESC LIMIT ?', (limit,)).fetchall()
+    finally:
+        conn.close()
+    runs = [_sync_run_row(r) for r in rows]
+    running = None
+    if lock is not None and lock['expires_at'] > time.time():
+        running = next((r for r in runs if r['run_id'] == lock['owner']), {'run_id': lock['owner']})
+    last_finished = next((r for r in runs if r['finished_at']), None)
+    return {
+        'running': running,
+        'last_run': last_finished,
+        'recent_runs': [{k: v for k, v in r.items() if k != 'result'} for r in runs],
+        'schedule': {
+            'check_times': _sync_check_times(),
+            'window_minutes': _sync_window_minutes(),
+            'current_slot': _scheduled_slot() or None,
+            'scheduler_running': bool(_sync_scheduler_thread and _sync_scheduler_thread.is_alive()),
+        },
+    }
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+製品コードの照合キー（app.py と inventory_sync.py で共用）
+"""
+
+import re
+from typing import Any
+
+_QUOTES_RE = re.compile(r"[|'\"`]")
+_DASHES_RE = re.compile(r'[‐‑‒–—―ー]')
+_SPACES_RE = re.compile(r'\s+')
+_INVALID_RE = re.compile(r'[^A-Z0-9-]')
+_PREFIX_NUMBER_RE = re.compile(r'^([A-Z]{1,4})-([0-9O]+)$')
+
+
+def normalize_product_code_key(code: Any) -> str:
+    """大文字化・記号除去・ダッシュ統一、BD-O6O のような O→0 の OCR ゆれを補正"""
+    s = str(code or '').strip().upper()
+    s = _QUOTES_RE.sub('', s)
+    s = _DASHES_RE.sub('-', s)
+    s = _SPACES_RE.sub('', s)
+    s = _INVALID_RE.sub('', s)
+    m = _PREFIX_NUMBER_RE.match(s)
+    if m:
+        s = f"{m[1]}-{m[2].replace('O', '0')}"
+    if s == 'GSC08I11000B':
+        s = 'GSC08I1000B'
+    return s
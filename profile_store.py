@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+cProfile 結果（.pstats）の保存先・ID 形式・世代管理（app.py と inventory_sync.py で共用）
+
+保存先は PROFILE_DIR（既定 <tmp>/kirii_profiles）。新しい PROFILE_KEEP 件（既定 30）を残す。
+計測は start_profiler / stop_profiler を通し、プロセス内で同時に1つだけ動かす。
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+PROFILE_ID_RE = re.compile(r'[0-9T]+_[A-Za-z0-9_]+_[0-9a-f]{8}')
+
+_profiler_lock = threading.Lock()
+
+
+def profile_dir() -> str:
+    return os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'kirii_profiles')
+
+
+def profile_keep() -> int:
+    try:
+        return max(1, int(os.environ.get('PROFILE_KEEP', '30')))
+    except ValueError:
+        return 30
+
+
+def is_profile_id(profile_id: str) -> bool:
+    return bool(PROFILE_ID_RE.fullmatch(profile_id or ''))
+
+
+def start_profiler():
+    """cProfile を開始して返す。他の計測が動いていれば待たずに None
+
+    Python 3.12 以降は別スレッドでも cProfile を同時に enable すると
+    ValueError（Another profiling tool is already active）になるため、1プロセス1つに限る。
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # profile_store を通さない計測ツールが動いている
+        _profiler_lock.release()
+        return None
+    return profiler
+
+
+def stop_profiler(profiler) -> None:
+    """start_profiler で開始した計測を止める"""
+    profiler.disable()
+    _profiler_lock.release()
+
+
+def save_profile(profiler, label: str) -> str:
+    """pstats を保存して古いものを削除し、プロファイルIDを返す（保存失敗時は OSError）"""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{label}_{uuid.uuid4().hex[:8]}"
+    profiler.dump_stats(os.path.join(directory, profile_id + '.pstats'))
+    saved = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.pstats')),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in saved[:-profile_keep()]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return profile_id